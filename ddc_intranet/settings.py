@@ -171,6 +171,16 @@ CACHES = {
 }
 
 
+# Страховой запас реагентов (рекомендуемый минимальный порог)
+# LEAD_TIME_DAYS - срок поставки, SERVICE_LEVEL - допустимая вероятность
+# не уйти в ноль за время поставки, HISTORY_DAYS - глубина статистики расхода
+SAFETY_STOCK = {
+    'LEAD_TIME_DAYS': 14,
+    'SERVICE_LEVEL': 0.95,
+    'HISTORY_DAYS': 90,
+}
+
+
 # Django Debug Toolbar Configuration
 INTERNAL_IPS = [
     '127.0.0.1',
@@ -194,10 +204,13 @@ SESSION_SAVE_EVERY_REQUEST = False
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
+        'intranet.authentication.TokenScopePermission',
     ],
+    # Скрипты и приборы - по токенам (intranet/authentication.py):
+    # Basic-аутентификация хешировала пароль (PBKDF2) на каждом запросе
     'DEFAULT_AUTHENTICATION_CLASSES': [
+        'intranet.authentication.ApiTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
-        'rest_framework.authentication.BasicAuthentication',
     ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 20,
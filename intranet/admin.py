@@ -5,23 +5,33 @@
 
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
+from django.db.models import F
+from django.utils import timezone
 from django.utils.html import format_html
+from django.core.exceptions import PermissionDenied
 from django.http import HttpResponse
-from django.urls import reverse
+from django.template.response import TemplateResponse
+from django.urls import path, reverse
 from django.utils.safestring import mark_safe
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import letter, A4
 from reportlab.lib.units import inch
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
+import csv
 import io
 import os
 from decimal import Decimal
 
+from . import authentication, barcodes, csv_import, dashboard_cache, inventory, planning
+from .forms import MovementImportForm
+from .autocomplete import reagent_index
 from .models import (
-    User, Reagent, ReagentMovement, Recipe, RecipeReagent,
+    User, ApiToken, Reagent, ReagentMovement, Recipe, RecipeReagent,
     Culture, CultureEvent, Task, TaskComment, Announcement,
-    CalendarEvent, DocumentTemplate
+    CalendarEvent, DocumentTemplate, ReagentStockSnapshot, ReagentForecast,
+    ReagentReservation, ReagentLot, ReagentLotAllocation, Stocktake, StocktakeLine,
+    ReagentMovementMonthly, ReagentMovementArchive
 )
 
 
@@ -56,6 +66,33 @@ class UserAdmin(BaseUserAdmin):
         return '—'
 
 
+@admin.register(ApiToken)
+class ApiTokenAdmin(admin.ModelAdmin):
+    """
+    Админ-класс для токенов API
+    Ключ показывается один раз - в сообщении после создания
+    """
+    list_display = ['name', 'user', 'prefix', 'scopes', 'expires_at', 'is_active', 'last_used_at']
+    list_filter = ['is_active', 'created_at']
+    search_fields = ['name', 'prefix', 'user__username']
+    list_select_related = ['user']
+    readonly_fields = ['prefix', 'last_used_at', 'created_at']
+    actions = ['revoke_tokens']
+    
+    def save_model(self, request, obj, form, change):
+        key = None if change else authentication.set_new_key(obj)
+        super().save_model(request, obj, form, change)
+        if key:
+            self.message_user(request, f'Ключ токена (сохраните его, повторно он не показывается): {key}')
+    
+    @admin.action(description='Отозвать токены')
+    def revoke_tokens(self, request, queryset):
+        tokens = list(queryset.filter(is_active=True))
+        queryset.filter(pk__in=[token.pk for token in tokens]).update(is_active=False)
+        authentication.forget_tokens(tokens)
+        self.message_user(request, f'Отозвано токенов: {len(tokens)}')
+
+
 # ============================================================================
 # РЕАГЕНТЫ
 # ============================================================================
@@ -66,11 +103,22 @@ class ReagentMovementInline(admin.TabularInline):
     """
     model = ReagentMovement
     extra = 1
-    fields = ['movement_type', 'quantity', 'date', 'user', 'comment']
-    raw_id_fields = ['user']
+    fields = ['movement_type', 'quantity', 'lot', 'date', 'user', 'comment']
+    raw_id_fields = ['user', 'lot']
     readonly_fields = ['date']
 
 
+class ReagentLotInline(admin.TabularInline):
+    """
+    Инлайн для партий реагента
+    """
+    model = ReagentLot
+    extra = 0
+    # Партия удаляется со списанием остатка - через админку партий
+    can_delete = False
+    fields = ['lot_number', 'barcode', 'expiry_date', 'on_hand', 'certificate', 'received_at']
+
+
 @admin.register(Reagent)
 class ReagentAdmin(admin.ModelAdmin):
     """
@@ -78,17 +126,25 @@ class ReagentAdmin(admin.ModelAdmin):
     """
     list_display = [
         'name', 'category', 'on_hand_colored', 'min_threshold',
-        'expiry_date_colored', 'image_preview', 'created_at'
+        'recommended_threshold_colored', 'expiry_date_colored', 'image_preview',
+        'created_at'
     ]
     list_display_links = ['name']
     list_filter = ['category', 'created_at', 'expiry_date']
     search_fields = ['name', 'external_link']
     date_hierarchy = 'created_at'
-    readonly_fields = ['created_at', 'updated_at', 'image_preview_large']
+    readonly_fields = [
+        'created_at', 'updated_at', 'image_preview_large', 'reserved',
+        'recommended_threshold', 'recommended_at'
+    ]
     
     fieldsets = (
         ('Основная информация', {
-            'fields': ('name', 'category', 'on_hand', 'min_threshold')
+            'fields': ('name', 'category', 'on_hand', 'reserved', 'unit', 'density', 'min_threshold')
+        }),
+        ('Рекомендуемый порог', {
+            'fields': ('recommended_threshold', 'recommended_at'),
+            'description': 'Рассчитывается командой recommend_thresholds по статистике расхода'
         }),
         ('Сроки и ссылки', {
             'fields': ('expiry_date', 'external_link')
@@ -102,9 +158,25 @@ class ReagentAdmin(admin.ModelAdmin):
         }),
     )
     
-    inlines = [ReagentMovementInline]
+    inlines = [ReagentLotInline, ReagentMovementInline]
+    
+    actions = [
+        'export_to_pdf', 'mark_as_critical', 'reconcile_stock',
+        'apply_recommended_thresholds'
+    ]
     
-    actions = ['export_to_pdf', 'mark_as_critical']
+    def get_search_results(self, request, queryset, search_term):
+        """
+        Поиск по названию через индекс автодополнения в памяти
+        (используется в т.ч. во всплывающем окне raw_id_fields)
+        """
+        if not search_term:
+            return super().get_search_results(request, queryset, search_term)
+        ids = [item['id'] for item in reagent_index.search(search_term, limit=100)]
+        if ids:
+            return queryset.filter(pk__in=ids), False
+        # Поиск по остальным search_fields (например, по ссылке)
+        return super().get_search_results(request, queryset, search_term)
     
     @admin.display(description='Остаток', ordering='on_hand')
     def on_hand_colored(self, obj):
@@ -120,6 +192,22 @@ class ReagentAdmin(admin.ModelAdmin):
             color, obj.on_hand
         )
     
+    @admin.display(description='Рекомендуемый порог', ordering='recommended_threshold')
+    def recommended_threshold_colored(self, obj):
+        """Рекомендуемый порог; выделяется, если отличается от текущего"""
+        if obj.recommended_threshold is None:
+            return '—'
+        if obj.recommended_threshold > obj.min_threshold:
+            color = 'red'
+        elif obj.recommended_threshold < obj.min_threshold:
+            color = 'blue'
+        else:
+            return obj.recommended_threshold
+        return format_html(
+            '<span style="color: {}; font-weight: bold;">{}</span>',
+            color, obj.recommended_threshold
+        )
+    
     @admin.display(description='Срок годности', ordering='expiry_date')
     def expiry_date_colored(self, obj):
         """Цветной вывод срока годности"""
@@ -228,8 +316,9 @@ class ReagentAdmin(admin.ModelAdmin):
             
             p.drawString(50, y, name)
             p.drawString(250, y, category)
-            p.drawString(400, y, str(reagent.on_hand))
-            p.drawString(480, y, str(reagent.min_threshold))
+            unit = reagent.get_unit_display()
+            p.drawString(400, y, f"{reagent.on_hand} {unit}")
+            p.drawString(480, y, f"{reagent.min_threshold} {unit}")
             y -= 20
         
         # Футер
@@ -251,8 +340,72 @@ class ReagentAdmin(admin.ModelAdmin):
     @admin.action(description='Отметить как критические (для теста)')
     def mark_as_critical(self, request, queryset):
         """Массовое действие для тестирования"""
+        reagent_ids = list(queryset.values_list('pk', flat=True))
         count = queryset.update(on_hand=0)
+        # update() не отправляет сигналов: виджеты, сканирование, доступность рецептур
+        inventory.notify_stock_changed(reagent_ids)
         self.message_user(request, f'{count} реагентов отмечены как критические')
+    
+    @admin.action(description='Сверить остатки с журналом движений')
+    def reconcile_stock(self, request, queryset):
+        """Пересчитывает остатки выбранных реагентов по журналу движений"""
+        drifts = inventory.find_stock_drift(
+            reagent_ids=list(queryset.values_list('pk', flat=True))
+        )
+        repaired = inventory.repair_stock_drift(drifts)
+        if repaired:
+            self.message_user(request, f'Исправлены остатки {repaired} реагентов')
+        else:
+            self.message_user(request, 'Расхождений с журналом движений не найдено')
+    
+    @admin.action(description='Применить рекомендуемые пороги')
+    def apply_recommended_thresholds(self, request, queryset):
+        """Заменяет минимальный порог рассчитанной рекомендацией (один UPDATE)"""
+        count = queryset.filter(recommended_threshold__isnull=False).exclude(
+            min_threshold=F('recommended_threshold')
+        ).update(min_threshold=F('recommended_threshold'), updated_at=timezone.now())
+        dashboard_cache.invalidate(dashboard_cache.GROUP_REAGENTS)
+        barcodes.invalidate_reagents(queryset.values_list('pk', flat=True))
+        self.message_user(request, f'Порог обновлён у {count} реагентов')
+
+
+@admin.register(ReagentLot)
+class ReagentLotAdmin(admin.ModelAdmin):
+    """
+    Админ-класс для партий реагентов
+    Изменение остатка партии проводится корректирующим движением,
+    удаление - после списания остатка
+    """
+    list_display = ['lot_number', 'barcode', 'reagent', 'on_hand', 'expiry_date', 'received_at']
+    list_filter = ['expiry_date', 'received_at']
+    search_fields = ['lot_number', 'barcode', 'reagent__name']
+    list_select_related = ['reagent']
+    raw_id_fields = ['reagent']
+    
+    def get_readonly_fields(self, request, obj=None):
+        # Перенос партии к другому реагенту разошёлся бы с журналом движений
+        return ['reagent'] if obj else []
+    
+    def delete_model(self, request, obj):
+        inventory.delete_lot(obj, user=request.user)
+    
+    def delete_queryset(self, request, queryset):
+        for lot in queryset:
+            inventory.delete_lot(lot, user=request.user)
+
+
+class ReagentLotAllocationInline(admin.TabularInline):
+    """
+    Инлайн списаний движения по партиям (только просмотр)
+    """
+    model = ReagentLotAllocation
+    extra = 0
+    fields = ['lot', 'quantity']
+    readonly_fields = ['lot', 'quantity']
+    can_delete = False
+    
+    def has_add_permission(self, request, obj=None):
+        return False
 
 
 @admin.register(ReagentMovement)
@@ -264,7 +417,190 @@ class ReagentMovementAdmin(admin.ModelAdmin):
     list_filter = ['movement_type', 'date']
     search_fields = ['reagent__name', 'comment']
     date_hierarchy = 'date'
-    raw_id_fields = ['reagent', 'user']
+    raw_id_fields = ['reagent', 'user', 'lot']
+    inlines = [ReagentLotAllocationInline]
+    change_list_template = 'admin/intranet/reagentmovement/change_list.html'
+    
+    def get_urls(self):
+        return [
+            path(
+                'import-csv/',
+                self.admin_site.admin_view(self.import_csv_view),
+                name='intranet_reagentmovement_import_csv',
+            ),
+        ] + super().get_urls()
+    
+    def import_csv_view(self, request):
+        """
+        Загрузка CSV с движениями: файл читается потоково
+        (большие загрузки Django хранит во временном файле)
+        """
+        if not self.has_add_permission(request):
+            raise PermissionDenied
+        
+        result = None
+        form = MovementImportForm(request.POST or None, request.FILES or None)
+        if request.method == 'POST' and form.is_valid():
+            upload = form.cleaned_data['file']
+            stream = io.TextIOWrapper(upload.file, encoding=form.cleaned_data['encoding'], newline='')
+            try:
+                result = csv_import.import_movements(
+                    stream, user=request.user, dry_run=form.cleaned_data['dry_run']
+                )
+            except (UnicodeDecodeError, csv.Error, csv_import.CSVImportError) as error:
+                form.add_error('file', str(error))
+            else:
+                if not form.cleaned_data['dry_run']:
+                    self.message_user(
+                        request,
+                        f"Создано движений: {result['created']}, отклонено строк: {result['rejected']}"
+                    )
+        
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': 'Импорт движений из CSV',
+            'form': form,
+            'result': result,
+        }
+        return TemplateResponse(request, 'admin/intranet/reagentmovement/import_csv.html', context)
+
+
+@admin.register(ReagentReservation)
+class ReagentReservationAdmin(admin.ModelAdmin):
+    """
+    Админ-класс для резервов реагентов
+    Резервы меняются только действиями (израсходовать/отменить),
+    чтобы Reagent.reserved оставался согласованным
+    """
+    list_display = ['reagent', 'quantity', 'status', 'recipe', 'task', 'user', 'created_at', 'closed_at']
+    list_filter = ['status', 'created_at']
+    search_fields = ['reagent__name', 'comment']
+    list_select_related = ['reagent', 'recipe', 'task', 'user']
+    readonly_fields = [
+        'reagent', 'quantity', 'recipe', 'task', 'status', 'movement',
+        'comment', 'user', 'created_at', 'closed_at'
+    ]
+    actions = ['consume_reservations', 'cancel_reservations']
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_delete_permission(self, request, obj=None):
+        return False
+    
+    @admin.action(description='Израсходовать (создать движения расхода)')
+    def consume_reservations(self, request, queryset):
+        consumed = inventory.consume_reservations(
+            list(queryset.values_list('pk', flat=True)), user=request.user
+        )
+        self.message_user(request, f'Израсходовано резервов: {len(consumed)}')
+    
+    @admin.action(description='Отменить резервы')
+    def cancel_reservations(self, request, queryset):
+        cancelled = inventory.cancel_reservations(list(queryset.values_list('pk', flat=True)))
+        self.message_user(request, f'Отменено резервов: {len(cancelled)}')
+
+
+class StocktakeLineInline(admin.TabularInline):
+    """
+    Инлайн строк инвентаризации (только просмотр)
+    """
+    model = StocktakeLine
+    extra = 0
+    fields = ['reagent', 'lot', 'expected', 'counted', 'difference', 'movement']
+    readonly_fields = fields
+    can_delete = False
+    
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(Stocktake)
+class StocktakeAdmin(admin.ModelAdmin):
+    """
+    Админ-класс для инвентаризаций (только просмотр,
+    проводятся через API /api/stocktakes/)
+    """
+    list_display = ['__str__', 'user', 'reagents_counted', 'discrepancies', 'created_at']
+    list_filter = ['created_at']
+    list_select_related = ['user']
+    readonly_fields = ['comment', 'user', 'reagents_counted', 'discrepancies', 'created_at']
+    inlines = [StocktakeLineInline]
+    
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(ReagentStockSnapshot)
+class ReagentStockSnapshotAdmin(admin.ModelAdmin):
+    """
+    Админ-класс для снимков остатков
+    """
+    list_display = ['reagent', 'on_hand', 'taken_at']
+    list_filter = ['taken_at']
+    search_fields = ['reagent__name']
+    date_hierarchy = 'taken_at'
+    raw_id_fields = ['reagent']
+
+
+@admin.register(ReagentMovementMonthly)
+class ReagentMovementMonthlyAdmin(admin.ModelAdmin):
+    """
+    Админ-класс для месячных итогов движений (только просмотр,
+    ведутся автоматически, пересчёт - команда rebuild_movement_rollup)
+    """
+    list_display = ['reagent', 'month', 'movement_type', 'quantity', 'count']
+    list_filter = ['movement_type', 'month']
+    search_fields = ['reagent__name']
+    date_hierarchy = 'month'
+    list_select_related = ['reagent']
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(ReagentMovementArchive)
+class ReagentMovementArchiveAdmin(admin.ModelAdmin):
+    """
+    Админ-класс для архива движений (только просмотр,
+    заполняется командой archive_movements)
+    """
+    list_display = ['reagent', 'movement_type', 'quantity', 'date', 'user', 'archived_at']
+    list_filter = ['movement_type', 'date']
+    search_fields = ['reagent__name', 'comment']
+    date_hierarchy = 'date'
+    list_select_related = ['reagent', 'user']
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(ReagentForecast)
+class ReagentForecastAdmin(admin.ModelAdmin):
+    """
+    Админ-класс для прогнозов расхода (только просмотр,
+    пересчитываются командой forecast_reagents)
+    """
+    list_display = [
+        'reagent', 'daily_rate_7d', 'daily_rate_30d', 'daily_rate',
+        'days_left', 'stockout_date', 'reorder_date', 'computed_at'
+    ]
+    list_filter = ['stockout_date']
+    search_fields = ['reagent__name']
+    list_select_related = ['reagent']
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
 
 
 # ============================================================================
@@ -314,7 +650,11 @@ class RecipeAdmin(admin.ModelAdmin):
         Массовое утверждение рецептур
         """
         from django.utils import timezone
-        count = queryset.update(status='approved', approved_at=timezone.now())
+        now = timezone.now()
+        # updated_at - валидатор условных запросов к API рецептур
+        count = queryset.update(status='approved', approved_at=now, updated_at=now)
+        # update() не отправляет сигналов - утверждённые рецептуры входят в доступность
+        planning.invalidate_availability()
         self.message_user(request, f'{count} рецептур утверждено')
 
 
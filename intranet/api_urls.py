@@ -9,7 +9,8 @@ from .api_views import (
     UserViewSet, ReagentViewSet, ReagentMovementViewSet,
     RecipeViewSet, CultureViewSet, CultureEventViewSet,
     TaskViewSet, TaskCommentViewSet, AnnouncementViewSet,
-    CalendarEventViewSet, DocumentTemplateViewSet
+    CalendarEventViewSet, DocumentTemplateViewSet, StatsViewSet,
+    SearchViewSet, ReagentReservationViewSet, ReagentLotViewSet, StocktakeViewSet
 )
 
 # Создаем роутер для автоматической генерации URL
@@ -18,7 +19,10 @@ router = DefaultRouter()
 # Регистрируем ViewSets
 router.register(r'users', UserViewSet, basename='user')
 router.register(r'reagents', ReagentViewSet, basename='reagent')
+router.register(r'reagent-lots', ReagentLotViewSet, basename='reagent-lot')
 router.register(r'reagent-movements', ReagentMovementViewSet, basename='reagent-movement')
+router.register(r'reagent-reservations', ReagentReservationViewSet, basename='reagent-reservation')
+router.register(r'stocktakes', StocktakeViewSet, basename='stocktake')
 router.register(r'recipes', RecipeViewSet, basename='recipe')
 router.register(r'cultures', CultureViewSet, basename='culture')
 router.register(r'culture-events', CultureEventViewSet, basename='culture-event')
@@ -27,6 +31,8 @@ router.register(r'task-comments', TaskCommentViewSet, basename='task-comment')
 router.register(r'announcements', AnnouncementViewSet, basename='announcement')
 router.register(r'calendar-events', CalendarEventViewSet, basename='calendar-event')
 router.register(r'documents', DocumentTemplateViewSet, basename='document')
+router.register(r'stats', StatsViewSet, basename='stats')
+router.register(r'search', SearchViewSet, basename='search')
 
 urlpatterns = [
     path('', include(router.urls)),
@@ -6,32 +6,141 @@ from rest_framework import viewsets, filters, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
-from django.db.models import Q
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.http import http_date, quote_etag
+from datetime import datetime, time, timedelta
+from decimal import Decimal
 
 from .models import (
     User, Reagent, ReagentMovement, Recipe, RecipeReagent,
     Culture, CultureEvent, Task, TaskComment, Announcement,
-    CalendarEvent, DocumentTemplate
+    CalendarEvent, DocumentTemplate, ReagentForecast, ReagentReservation,
+    ReagentLot, Stocktake
 )
+from . import barcodes, conditional, dashboard_cache, forecasting, history, inventory, planning, rollups, search, stats
+from .authentication import TokenScopePermission
+from .pagination import KeysetPagination
+from .autocomplete import reagent_index
 from .serializers import (
-    UserSerializer, ReagentSerializer, ReagentMovementSerializer,
+    related_lookups, UserSerializer, ReagentSerializer, ReagentMovementSerializer,
     RecipeSerializer, RecipeReagentSerializer, CultureSerializer,
     CultureEventSerializer, TaskSerializer, TaskCommentSerializer,
-    AnnouncementSerializer, CalendarEventSerializer, DocumentTemplateSerializer
+    AnnouncementSerializer, CalendarEventSerializer, DocumentTemplateSerializer,
+    ReagentMovementBulkSerializer, ReagentMovementBulkItemSerializer,
+    ReagentForecastSerializer, RecipePlanSerializer,
+    ReagentReservationSerializer, ReagentReservationCreateSerializer,
+    ReagentLotSerializer, StocktakeSerializer, StocktakeLineSerializer,
+    StocktakeCreateSerializer
 )
 
 
+def parse_moment(value, end_of_day=True):
+    """
+    Разбирает дату или дату и время из параметра запроса
+    Дата без времени означает конец дня (end_of_day=False - начало);
+    наивное время - в текущем часовом поясе
+    """
+    try:
+        moment = parse_datetime(value)
+        if moment is None:
+            day = parse_date(value)
+            if day is None:
+                return None
+            moment = datetime.combine(day, time.max if end_of_day else time.min)
+    except ValueError:
+        return None
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+class RelatedFieldsMixin:
+    """
+    Связанные объекты загружаются только для выводимых полей:
+    select_related/prefetch_related и счётчики строятся по полям
+    сериализатора с учётом ?fields= и ?expand= (см. serializers.related_lookups)
+    """
+    
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        serializer = self.get_serializer()
+        if serializer.Meta.model is not queryset.model:
+            return queryset
+        select, prefetch, annotations = related_lookups(serializer)
+        if annotations:
+            queryset = queryset.annotate(**annotations)
+        return queryset.select_related(*select).prefetch_related(*prefetch)
+
+
+class ConditionalGetMixin:
+    """
+    Условные GET для list и retrieve (см. conditional.py): валидаторы
+    считаются до выборки и сериализации, совпадение с If-None-Match /
+    If-Modified-Since - 304 без тела.
+    conditional_groups - группы данных dashboard_cache, от которых зависит
+    ответ; без них - Max('updated_at') и число строк, если у модели есть
+    updated_at (тогда же отдаётся Last-Modified)
+    """
+    conditional_groups = ()
+    
+    def get_validator_parts(self):
+        """Дополнительные части ETag (данные, зависящие от времени)"""
+        return ()
+    
+    def get_validators(self, request):
+        """(ETag или None, Last-Modified или None)"""
+        parts = (request.accepted_renderer.format, *self.get_validator_parts())
+        if self.conditional_groups:
+            return conditional.collection_etag(request, self.conditional_groups, *parts), None
+        
+        queryset = self.filter_queryset(self.get_queryset())
+        if not any(field.name == 'updated_at' for field in queryset.model._meta.concrete_fields):
+            return None, None
+        lookup = self.lookup_url_kwarg or self.lookup_field
+        if lookup in self.kwargs:
+            queryset = queryset.filter(**{self.lookup_field: self.kwargs[lookup]})
+        last_modified, count = conditional.modified_and_count(queryset)
+        etag = conditional.collection_etag(request, (), last_modified, count, *parts)
+        return etag, last_modified
+    
+    def conditional_response(self, request, view, *args, **kwargs):
+        etag, last_modified = self.get_validators(request)
+        if etag is None:
+            return view(request, *args, **kwargs)
+        timestamp = int(last_modified.timestamp()) if last_modified else None
+        response = get_conditional_response(request, etag=quote_etag(etag), last_modified=timestamp)
+        if response is None:
+            response = view(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+        response['ETag'] = quote_etag(etag)
+        if timestamp is not None:
+            response['Last-Modified'] = http_date(timestamp)
+        # Кешировать можно, но перед использованием - проверять у сервера
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+    
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(request, super().list, *args, **kwargs)
+    
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(request, super().retrieve, *args, **kwargs)
+
+
 # ============================================================================
 # ПОЛЬЗОВАТЕЛИ
 # ============================================================================
 
-class UserViewSet(viewsets.ReadOnlyModelViewSet):
+class UserViewSet(RelatedFieldsMixin, viewsets.ReadOnlyModelViewSet):
     """
     ViewSet для просмотра пользователей
     """
     queryset = User.objects.all()
     serializer_class = UserSerializer
-    permission_classes = [IsAuthenticated]
+    permission_classes = [IsAuthenticated, TokenScopePermission]
     filter_backends = [filters.SearchFilter, filters.OrderingFilter]
     search_fields = ['username', 'first_name', 'last_name', 'email']
     ordering_fields = ['username', 'date_joined']
@@ -44,23 +153,72 @@ class UserViewSet(viewsets.ReadOnlyModelViewSet):
         return Response(serializer.data)
 
 
+# ============================================================================
+# СТАТИСТИКА
+# ============================================================================
+
+class StatsViewSet(viewsets.ViewSet):
+    """
+    ViewSet со сводной статистикой (та же, что на дашборде)
+    """
+    permission_classes = [IsAuthenticated, TokenScopePermission]
+    
+    def list(self, request):
+        """Статистика текущего пользователя и общие счётчики"""
+        return Response({
+            'user': stats.user_task_stats(request.user),
+            'global': stats.global_stats(),
+        })
+
+
+class SearchViewSet(viewsets.ViewSet):
+    """
+    Единый полнотекстовый поиск по реагентам, задачам, объявлениям,
+    культурам, рецептурам и документам
+    """
+    permission_classes = [IsAuthenticated, TokenScopePermission]
+    
+    def list(self, request):
+        """
+        Параметры: q - строка поиска, kind - типы объектов через запятую,
+        limit - количество результатов (не больше 100)
+        """
+        query = request.query_params.get('q', '')
+        kinds = [k for k in request.query_params.get('kind', '').split(',') if k]
+        try:
+            limit = min(int(request.query_params.get('limit', 20)), 100)
+        except ValueError:
+            return Response(
+                {'error': 'limit должен быть числом'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        results = search.search(query, kinds=kinds, limit=limit)
+        return Response({'query': query, 'count': len(results), 'results': results})
+
+
 # ============================================================================
 # РЕАГЕНТЫ
 # ============================================================================
 
-class ReagentViewSet(viewsets.ModelViewSet):
+class ReagentViewSet(ConditionalGetMixin, RelatedFieldsMixin, viewsets.ModelViewSet):
     """
     ViewSet для работы с реагентами
     Поддерживает CRUD операции
     """
     queryset = Reagent.objects.all()
     serializer_class = ReagentSerializer
-    permission_classes = [IsAuthenticated]
+    permission_classes = [IsAuthenticated, TokenScopePermission]
+    conditional_groups = [dashboard_cache.GROUP_REAGENTS]
     filter_backends = [filters.SearchFilter, filters.OrderingFilter]
     search_fields = ['name', 'category']
     ordering_fields = ['name', 'on_hand', 'expiry_date', 'created_at']
     ordering = ['name']
     
+    def get_validator_parts(self):
+        # is_expiring_soon зависит от текущей даты
+        return (timezone.localdate(),)
+    
     def get_queryset(self):
         """
         Фильтрация реагентов по параметрам запроса
@@ -75,7 +233,7 @@ class ReagentViewSet(viewsets.ModelViewSet):
         # Фильтр по критичному остатку
         is_critical = self.request.query_params.get('is_critical', None)
         if is_critical == 'true':
-            queryset = queryset.filter(on_hand__lte=models.F('min_threshold'))
+            queryset = queryset.filter(on_hand__lte=F('min_threshold'))
         
         # Только активные реагенты (с остатком > 0)
         active_only = self.request.query_params.get('active_only', None)
@@ -86,16 +244,213 @@ class ReagentViewSet(viewsets.ModelViewSet):
     
     @action(detail=True, methods=['get'])
     def movements(self, request, pk=None):
-        """Получить движения конкретного реагента"""
+        """
+        Получить движения конкретного реагента (рабочая таблица;
+        движения старше срока хранения - в архиве, см. monthly)
+        Курсорная пагинация: следующая страница - по ссылке next
+        """
+        reagent = self.get_object()
+        movements = reagent.movements.select_related('reagent', 'user', 'lot')
+        paginator = KeysetPagination()
+        page = paginator.paginate_queryset(movements, request, view=self)
+        serializer = ReagentMovementSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+    
+    @action(detail=True, methods=['get'])
+    def monthly(self, request, pk=None):
+        """
+        Помесячные итоги движений реагента (включая архивные)
+        Параметр months - за сколько последних месяцев (по умолчанию 12, до 120)
+        """
         reagent = self.get_object()
-        movements = reagent.movements.all()
-        serializer = ReagentMovementSerializer(movements, many=True)
+        try:
+            months = int(request.query_params.get('months', 12))
+        except ValueError:
+            return Response(
+                {'error': 'months должен быть числом'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if not 1 <= months <= 120:
+            return Response(
+                {'error': 'months должен быть от 1 до 120'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        since = rollups.archive_cutoff(months=months - 1).date()
+        rows = reagent.monthly_movements.filter(month__gte=since).order_by('month', 'movement_type')
+        return Response([
+            {
+                'month': row.month,
+                'movement_type': row.movement_type,
+                'quantity': str(row.quantity),
+                'count': row.count,
+            }
+            for row in rows
+        ])
+    
+    @action(detail=True, methods=['get'])
+    def history(self, request, pk=None):
+        """
+        Динамика остатка реагента для графика
+        Параметры: since, until - границы периода (дата или ISO 8601),
+        points - число точек после прореживания LTTB (по умолчанию 500, 3-5000)
+        Результат кешируется до следующего движения
+        """
+        reagent = self.get_object()
+        try:
+            points = int(request.query_params.get('points', history.DEFAULT_POINTS))
+        except ValueError:
+            return Response(
+                {'error': 'points должен быть числом'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if not 3 <= points <= history.MAX_POINTS:
+            return Response(
+                {'error': f'points должен быть от 3 до {history.MAX_POINTS}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        period = {}
+        for name in ('since', 'until'):
+            if request.query_params.get(name):
+                period[name] = parse_moment(request.query_params[name], end_of_day=name == 'until')
+                if period[name] is None:
+                    return Response(
+                        {'error': f'{name}: укажите дату в формате ISO 8601'},
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
+        
+        return Response(history.stock_history(reagent, points=points, **period))
+    
+    @action(detail=True, methods=['get'], url_path='stock-at')
+    def stock_at(self, request, pk=None):
+        """
+        Остаток реагента на момент времени
+        Параметр ts - дата (2025-03-01) или дата и время в формате ISO 8601
+        """
+        reagent = self.get_object()
+        moment = parse_moment(request.query_params.get('ts', ''))
+        if moment is None:
+            return Response(
+                {'error': 'Укажите параметр ts в формате ISO 8601'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        result = inventory.stock_at(reagent, moment)
+        return Response({'reagent': reagent.pk, 'ts': moment, **result})
+    
+    @action(detail=False, methods=['get'])
+    def autocomplete(self, request):
+        """
+        Автодополнение названий реагентов из индекса в памяти
+        Параметры: q - начало названия (допускаются опечатки), limit - до 50
+        """
+        try:
+            limit = min(int(request.query_params.get('limit', 10)), 50)
+        except ValueError:
+            return Response(
+                {'error': 'limit должен быть числом'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        results = reagent_index.search(request.query_params.get('q', ''), limit=limit)
+        return Response(results)
+    
+    @action(detail=False, methods=['get'], url_path=r'scan/(?P<code>[^/]+)')
+    def scan(self, request, code=None):
+        """
+        Поиск по штрихкоду партии (сканирование флакона)
+        Возвращает реагент с остатками, партию и заготовку движения;
+        повторные сканирования обслуживаются из кеша процесса
+        """
+        result = barcodes.scan(code)
+        if result is None:
+            return Response(
+                {'error': f'Штрихкод {code} не найден'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        return Response(result)
+    
+    @action(detail=False, methods=['get'])
+    def forecast(self, request):
+        """
+        Прогноз расхода и даты окончания остатков (таблица ReagentForecast)
+        Параметр days - только реагенты, остатка которых хватит не более чем на N дней
+        Сначала реагенты, которые закончатся раньше
+        """
+        forecasts = ReagentForecast.objects.select_related('reagent').order_by(
+            F('stockout_date').asc(nulls_last=True), 'reagent__name'
+        )
+        days = request.query_params.get('days')
+        if days:
+            try:
+                horizon = timezone.localdate() + timedelta(days=int(days))
+            except ValueError:
+                return Response(
+                    {'error': 'days должен быть числом'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            forecasts = forecasts.filter(stockout_date__lte=horizon)
+        
+        page = self.paginate_queryset(forecasts)
+        if page is not None:
+            serializer = ReagentForecastSerializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+        serializer = ReagentForecastSerializer(forecasts, many=True)
         return Response(serializer.data)
     
+    @action(detail=False, methods=['get'], url_path='stockout-risk')
+    def stockout_risk(self, request):
+        """
+        Вероятность окончания остатка в течение N дней (Монте-Карло)
+        Параметры: days - горизонт и trials - число испытаний (только из
+        наборов forecasting.RISK_PRESET_*), min_probability - нижняя
+        граница вероятности. Расчёт в процессе запроса, без пула процессов
+        """
+        try:
+            days = int(request.query_params.get('days', forecasting.RISK_HORIZON_DAYS))
+            trials = int(request.query_params.get('trials', forecasting.RISK_TRIALS))
+            min_probability = float(request.query_params.get('min_probability', 0))
+        except ValueError:
+            return Response(
+                {'error': 'days, trials и min_probability должны быть числами'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if days not in forecasting.RISK_PRESET_DAYS or trials not in forecasting.RISK_PRESET_TRIALS:
+            return Response(
+                {'error': (
+                    f'days: {", ".join(map(str, forecasting.RISK_PRESET_DAYS))}; '
+                    f'trials: {", ".join(map(str, forecasting.RISK_PRESET_TRIALS))}. '
+                    'Большие расчёты - командой manage.py stockout_risk'
+                )},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        risk = forecasting.stockout_risk(horizon_days=days, trials=trials, workers=1)
+        results = [row for row in risk['results'] if row['probability'] >= min_probability]
+        names = dict(
+            Reagent.objects.filter(
+                pk__in=[row['reagent_id'] for row in results]
+            ).values_list('pk', 'name')
+        )
+        return Response({
+            'horizon_days': risk['horizon_days'],
+            'trials': risk['trials'],
+            'computed_at': risk['computed_at'],
+            'results': [
+                {
+                    'reagent': row['reagent_id'],
+                    'reagent_name': names.get(row['reagent_id']),
+                    'on_hand': row['on_hand'],
+                    'probability': row['probability'],
+                }
+                for row in results
+            ],
+        })
+    
     @action(detail=False, methods=['get'])
     def critical(self, request):
         """Получить список реагентов с критичным остатком"""
-        critical_reagents = self.queryset.filter(on_hand__lte=models.F('min_threshold'))
+        critical_reagents = self.queryset.filter(on_hand__lte=F('min_threshold'))
         serializer = self.get_serializer(critical_reagents, many=True)
         return Response(serializer.data)
     
@@ -117,34 +472,285 @@ class ReagentViewSet(viewsets.ModelViewSet):
         return Response(serializer.data)
 
 
-class ReagentMovementViewSet(viewsets.ModelViewSet):
+class ReagentLotViewSet(ConditionalGetMixin, RelatedFieldsMixin, viewsets.ModelViewSet):
+    """
+    ViewSet для партий реагентов
+    Изменение остатка партии проводится корректирующим движением,
+    удаление - после списания остатка (inventory.delete_lot)
+    """
+    queryset = ReagentLot.objects.all()
+    serializer_class = ReagentLotSerializer
+    permission_classes = [IsAuthenticated, TokenScopePermission]
+    conditional_groups = [dashboard_cache.GROUP_REAGENTS]
+    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
+    search_fields = ['lot_number', 'reagent__name']
+    ordering_fields = ['expiry_date', 'received_at', 'on_hand']
+    ordering = ['reagent', 'expiry_date', 'received_at']
+    
+    def get_queryset(self):
+        """Фильтрация по реагенту и наличию остатка"""
+        queryset = super().get_queryset()
+        
+        reagent = self.request.query_params.get('reagent')
+        if reagent:
+            queryset = queryset.filter(reagent=reagent)
+        
+        in_stock = self.request.query_params.get('in_stock')
+        if in_stock == 'true':
+            queryset = queryset.filter(on_hand__gt=0)
+        
+        return queryset
+    
+    def perform_destroy(self, instance):
+        inventory.delete_lot(instance, user=self.request.user)
+
+
+class ReagentMovementViewSet(ConditionalGetMixin, RelatedFieldsMixin, viewsets.ModelViewSet):
     """
     ViewSet для работы с движениями реагентов
     """
-    queryset = ReagentMovement.objects.select_related('reagent', 'user').all()
+    queryset = ReagentMovement.objects.all()
     serializer_class = ReagentMovementSerializer
-    permission_classes = [IsAuthenticated]
+    permission_classes = [IsAuthenticated, TokenScopePermission]
+    conditional_groups = [dashboard_cache.GROUP_MOVEMENTS, dashboard_cache.GROUP_REAGENTS]
+    pagination_class = KeysetPagination
     filter_backends = [filters.SearchFilter, filters.OrderingFilter]
     search_fields = ['reagent__name', 'comment']
-    ordering_fields = ['date', 'quantity']
+    # Курсорная пагинация идёт по ключу (date, id) - сортировка только по дате
+    ordering_fields = ['date']
     ordering = ['-date']
     
     def perform_create(self, serializer):
         """Автоматически устанавливаем текущего пользователя"""
         serializer.save(user=self.request.user)
+    
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """
+        Пакетная загрузка движений (сотни и тысячи строк за запрос)
+        
+        Все строки проверяются вместе (реагенты - одним запросом),
+        сохраняются через bulk_create в одной транзакции, остаток
+        каждого реагента обновляется одним UPDATE.
+        Возвращает результат по каждой строке.
+        """
+        bulk_serializer = ReagentMovementBulkSerializer(data=request.data)
+        bulk_serializer.is_valid(raise_exception=True)
+        mode = bulk_serializer.validated_data['mode']
+        rows = bulk_serializer.validated_data['movements']
+        
+        # Проверка полей каждой строки
+        results = []
+        valid_rows = []
+        for index, row in enumerate(rows):
+            item = ReagentMovementBulkItemSerializer(data=row)
+            if item.is_valid():
+                valid_rows.append((index, item.validated_data))
+                results.append({'index': index, 'status': 'created'})
+            else:
+                results.append({'index': index, 'status': 'error', 'errors': item.errors})
+        
+        # Проверка реагентов одним запросом; партии и реагенты с партиями -
+        # по запросу, только если они нужны для проверки
+        reagents = Reagent.objects.in_bulk({data['reagent'] for _, data in valid_rows})
+        lot_ids = {data['lot'] for _, data in valid_rows if data['lot'] is not None}
+        lots = ReagentLot.objects.in_bulk(lot_ids) if lot_ids else {}
+        unlotted_receipts = {
+            data['reagent'] for _, data in valid_rows
+            if data['lot'] is None and data['movement_type'] == 'in'
+        }
+        lot_tracked = set(
+            ReagentLot.objects.filter(reagent_id__in=unlotted_receipts).values_list('reagent_id', flat=True)
+        ) if unlotted_receipts else set()
+        
+        movements = []
+        accepted = []
+        for index, data in valid_rows:
+            if data['reagent'] not in reagents:
+                errors = {'reagent': [f'Реагент {data["reagent"]} не найден']}
+            elif data['lot'] is not None and data['lot'] not in lots:
+                errors = {'lot': [f'Партия {data["lot"]} не найдена']}
+            else:
+                movement = ReagentMovement(**dict(
+                    data, reagent=reagents[data['reagent']], lot=lots.get(data['lot']), user=request.user
+                ))
+                error = movement.lot_error(lot_tracked=data['reagent'] in lot_tracked)
+                errors = {'lot': [error]} if error else None
+            if errors:
+                results[index] = {'index': index, 'status': 'error', 'errors': errors}
+                continue
+            movements.append(movement)
+            accepted.append(index)
+        
+        rejected = len(rows) - len(accepted)
+        if mode == 'atomic' and rejected:
+            for result in results:
+                if result['status'] == 'created':
+                    result['status'] = 'skipped'
+            return Response(
+                {'mode': mode, 'created': 0, 'rejected': rejected, 'results': results},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        created = inventory.create_movements(movements)
+        for index, movement in zip(accepted, created):
+            results[index]['id'] = movement.pk
+        
+        return Response(
+            {'mode': mode, 'created': len(created), 'rejected': rejected, 'results': results},
+            status=status.HTTP_201_CREATED if created else status.HTTP_400_BAD_REQUEST
+        )
+
+
+class ReagentReservationViewSet(RelatedFieldsMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    ViewSet для резервов реагентов
+    Резервы создаются, расходуются и отменяются только через
+    операции inventory, которые поддерживают Reagent.reserved
+    """
+    queryset = ReagentReservation.objects.all()
+    serializer_class = ReagentReservationSerializer
+    permission_classes = [IsAuthenticated, TokenScopePermission]
+    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
+    search_fields = ['reagent__name', 'comment']
+    ordering_fields = ['created_at', 'quantity']
+    ordering = ['-created_at']
+    
+    def get_queryset(self):
+        """Фильтрация по статусу, рецептуре, задаче и реагенту"""
+        queryset = super().get_queryset()
+        for param in ('status', 'recipe', 'task', 'reagent'):
+            value = self.request.query_params.get(param)
+            if value:
+                queryset = queryset.filter(**{param: value})
+        return queryset
+    
+    def create(self, request):
+        """
+        Резервирование под рецептуру или задачу (всё или ничего)
+        При нехватке доступного остатка - 409 со списком дефицитов
+        """
+        serializer = ReagentReservationCreateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        
+        if data.get('items'):
+            items = [(item['reagent'].pk, item['quantity']) for item in data['items']]
+        else:
+            try:
+                items = planning.recipe_requirements(data['recipe'].pk, data['batches'])
+            except ValueError as error:
+                return Response({'error': str(error)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            reservations = inventory.reserve(
+                items,
+                recipe=data.get('recipe'),
+                task=data.get('task'),
+                user=request.user,
+                comment=data['comment'],
+            )
+        except inventory.InsufficientStockError as error:
+            return Response(
+                {'error': str(error), 'shortages': error.shortages},
+                status=status.HTTP_409_CONFLICT
+            )
+        
+        return Response(
+            ReagentReservationSerializer(reservations, many=True).data,
+            status=status.HTTP_201_CREATED
+        )
+    
+    @action(detail=True, methods=['post'])
+    def consume(self, request, pk=None):
+        """Израсходовать резерв: создаётся движение 'out'"""
+        reservation = self.get_object()
+        if not inventory.consume_reservations([reservation.pk], user=request.user):
+            return Response(
+                {'error': 'Резерв уже закрыт'},
+                status=status.HTTP_409_CONFLICT
+            )
+        reservation.refresh_from_db()
+        return Response(self.get_serializer(reservation).data)
+    
+    @action(detail=True, methods=['post'])
+    def cancel(self, request, pk=None):
+        """Отменить резерв и освободить количество"""
+        reservation = self.get_object()
+        if not inventory.cancel_reservations([reservation.pk]):
+            return Response(
+                {'error': 'Резерв уже закрыт'},
+                status=status.HTTP_409_CONFLICT
+            )
+        reservation.refresh_from_db()
+        return Response(self.get_serializer(reservation).data)
+
+
+class StocktakeViewSet(RelatedFieldsMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    ViewSet для инвентаризаций
+    Инвентаризация проводится одним запросом: фактические остатки
+    сравниваются с учётом, расхождения проводятся движениями
+    """
+    queryset = Stocktake.objects.all()
+    serializer_class = StocktakeSerializer
+    permission_classes = [IsAuthenticated, TokenScopePermission]
+    filter_backends = [filters.OrderingFilter]
+    ordering_fields = ['created_at', 'discrepancies']
+    ordering = ['-created_at']
+    
+    def _summary(self, stocktake, lines, dry_run=False):
+        discrepancies = [line for line in lines if line.difference]
+        return {
+            **StocktakeSerializer(stocktake).data,
+            'dry_run': dry_run,
+            'surplus': str(sum((line.difference for line in discrepancies if line.difference > 0), Decimal('0.00'))),
+            'shortage': str(sum((-line.difference for line in discrepancies if line.difference < 0), Decimal('0.00'))),
+            'lines': StocktakeLineSerializer(discrepancies, many=True).data,
+        }
+    
+    def retrieve(self, request, pk=None):
+        """Инвентаризация и строки с расхождениями"""
+        stocktake = self.get_object()
+        lines = stocktake.lines.select_related('reagent', 'lot').exclude(difference=0).order_by('reagent_id', 'lot_id')
+        return Response(self._summary(stocktake, lines))
+    
+    def create(self, request):
+        """
+        Провести инвентаризацию: counts - фактические остатки реагентов
+        dry_run - только показать расхождения, ничего не сохраняя
+        """
+        serializer = StocktakeCreateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        
+        try:
+            stocktake, lines = inventory.apply_stocktake(
+                [(item['reagent'], item['lot'], item['counted']) for item in data['counts']],
+                user=request.user,
+                comment=data['comment'],
+                dry_run=data['dry_run'],
+            )
+        except (Reagent.DoesNotExist, inventory.StocktakeError) as error:
+            return Response({'error': str(error)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        return Response(
+            self._summary(stocktake, lines, dry_run=data['dry_run']),
+            status=status.HTTP_200_OK if data['dry_run'] else status.HTTP_201_CREATED
+        )
 
 
 # ============================================================================
 # РЕЦЕПТУРЫ
 # ============================================================================
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(ConditionalGetMixin, RelatedFieldsMixin, viewsets.ModelViewSet):
     """
     ViewSet для работы с рецептурами
     """
-    queryset = Recipe.objects.select_related('author').prefetch_related('reagents').all()
+    queryset = Recipe.objects.all()
     serializer_class = RecipeSerializer
-    permission_classes = [IsAuthenticated]
+    permission_classes = [IsAuthenticated, TokenScopePermission]
     filter_backends = [filters.SearchFilter, filters.OrderingFilter]
     search_fields = ['name', 'description']
     ordering_fields = ['name', 'created_at', 'status']
@@ -176,19 +782,72 @@ class RecipeViewSet(viewsets.ModelViewSet):
         
         serializer = self.get_serializer(recipe)
         return Response(serializer.data)
+    
+    @action(detail=False, methods=['get'])
+    def availability(self, request):
+        """
+        Сколько партий каждой утверждённой рецептуры можно приготовить
+        из текущих остатков и какой реагент ограничивает выпуск
+        """
+        result = planning.recipe_availability()
+        return Response({
+            'computed_at': result['computed_at'],
+            'results': [
+                {
+                    'recipe': row['recipe_id'],
+                    'recipe_name': row['name'],
+                    'batches': row['batches'],
+                    'limiting_reagent': row['limiting_reagent_id'],
+                    'limiting_reagent_name': row['limiting_reagent_name'],
+                }
+                for row in result['recipes']
+            ],
+        })
+    
+    @action(detail=False, methods=['post'])
+    def plan(self, request):
+        """
+        Потребность в реагентах для производственного плана
+        Тело: {"items": [{"recipe": 1, "batches": 12}, ...], "horizon_days": 7}
+        Возвращает потребность по реагентам и дефицит относительно остатка
+        """
+        serializer = RecipePlanSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        
+        result = planning.plan_demand(
+            [(item['recipe'], item['batches']) for item in data['items']],
+            horizon_days=data['horizon_days'],
+        )
+        if result['missing_recipes']:
+            return Response(
+                {'error': 'Рецептуры не найдены', 'missing_recipes': result['missing_recipes']},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        reagents = result['reagents']
+        if data['only_shortfalls']:
+            reagents = [row for row in reagents if row['shortfall'] > 0]
+        return Response({
+            'horizon_days': data['horizon_days'],
+            'shortfall_count': sum(1 for row in result['reagents'] if row['shortfall'] > 0),
+            'unconvertible': result['unconvertible'],
+            'reagents': reagents,
+        })
 
 
 # ============================================================================
 # КУЛЬТУРЫ
 # ============================================================================
 
-class CultureViewSet(viewsets.ModelViewSet):
+class CultureViewSet(ConditionalGetMixin, RelatedFieldsMixin, viewsets.ModelViewSet):
     """
     ViewSet для работы с культурами
     """
-    queryset = Culture.objects.select_related('recipe', 'responsible').prefetch_related('events').all()
+    queryset = Culture.objects.all()
     serializer_class = CultureSerializer
-    permission_classes = [IsAuthenticated]
+    permission_classes = [IsAuthenticated, TokenScopePermission]
+    conditional_groups = [dashboard_cache.GROUP_CULTURES]
     filter_backends = [filters.SearchFilter, filters.OrderingFilter]
     search_fields = ['name', 'notes']
     ordering_fields = ['name', 'seeding_date', 'passage_number']
@@ -206,23 +865,30 @@ class CultureViewSet(viewsets.ModelViewSet):
     
     @action(detail=True, methods=['get'])
     def events(self, request, pk=None):
-        """Получить все события конкретной культуры"""
+        """
+        Получить события конкретной культуры
+        Курсорная пагинация: следующая страница - по ссылке next
+        """
         culture = self.get_object()
-        events = culture.events.all()
-        serializer = CultureEventSerializer(events, many=True)
-        return Response(serializer.data)
+        events = culture.events.select_related('culture', 'user')
+        paginator = KeysetPagination()
+        page = paginator.paginate_queryset(events, request, view=self)
+        serializer = CultureEventSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
 
 
-class CultureEventViewSet(viewsets.ModelViewSet):
+class CultureEventViewSet(ConditionalGetMixin, RelatedFieldsMixin, viewsets.ModelViewSet):
     """
     ViewSet для работы с событиями культур
     """
-    queryset = CultureEvent.objects.select_related('culture', 'user').all()
+    queryset = CultureEvent.objects.all()
     serializer_class = CultureEventSerializer
-    permission_classes = [IsAuthenticated]
+    permission_classes = [IsAuthenticated, TokenScopePermission]
+    conditional_groups = [dashboard_cache.GROUP_CULTURES]
+    pagination_class = KeysetPagination
     filter_backends = [filters.SearchFilter, filters.OrderingFilter]
     search_fields = ['culture__name', 'comment']
-    ordering_fields = ['date', 'event_type']
+    ordering_fields = ['date']
     ordering = ['-date']
     
     def perform_create(self, serializer):
@@ -234,18 +900,23 @@ class CultureEventViewSet(viewsets.ModelViewSet):
 # ЗАДАЧИ
 # ============================================================================
 
-class TaskViewSet(viewsets.ModelViewSet):
+class TaskViewSet(ConditionalGetMixin, RelatedFieldsMixin, viewsets.ModelViewSet):
     """
     ViewSet для работы с задачами
     """
-    queryset = Task.objects.select_related('assignee', 'creator').prefetch_related('comments').all()
+    queryset = Task.objects.all()
     serializer_class = TaskSerializer
-    permission_classes = [IsAuthenticated]
+    permission_classes = [IsAuthenticated, TokenScopePermission]
+    conditional_groups = [dashboard_cache.GROUP_TASKS]
     filter_backends = [filters.SearchFilter, filters.OrderingFilter]
     search_fields = ['title', 'description']
     ordering_fields = ['created_at', 'deadline', 'priority', 'status']
     ordering = ['deadline', '-priority']
     
+    def get_validator_parts(self):
+        # is_overdue меняется с наступлением срока
+        return (conditional.last_passed_deadline(),)
+    
     def get_queryset(self):
         """Фильтрация задач"""
         queryset = super().get_queryset()
@@ -306,18 +977,31 @@ class TaskViewSet(viewsets.ModelViewSet):
         return Response(serializer.data)
 
 
-class TaskCommentViewSet(viewsets.ModelViewSet):
+class TaskCommentViewSet(ConditionalGetMixin, RelatedFieldsMixin, viewsets.ModelViewSet):
     """
     ViewSet для работы с комментариями к задачам
     """
-    queryset = TaskComment.objects.select_related('task', 'user').all()
+    queryset = TaskComment.objects.all()
     serializer_class = TaskCommentSerializer
-    permission_classes = [IsAuthenticated]
+    permission_classes = [IsAuthenticated, TokenScopePermission]
+    conditional_groups = [dashboard_cache.GROUP_TASKS]
+    pagination_class = KeysetPagination
     filter_backends = [filters.SearchFilter, filters.OrderingFilter]
     search_fields = ['text']
     ordering_fields = ['date']
     ordering = ['date']
     
+    def get_queryset(self):
+        """
+        Фильтр по задаче: вся история комментариев
+        (в задаче выводятся только последние, см. TaskSerializer)
+        """
+        queryset = super().get_queryset()
+        task = self.request.query_params.get('task', None)
+        if task:
+            queryset = queryset.filter(task_id=task)
+        return queryset
+    
     def perform_create(self, serializer):
         """Автоматически устанавливаем текущего пользователя"""
         serializer.save(user=self.request.user)
@@ -327,13 +1011,14 @@ class TaskCommentViewSet(viewsets.ModelViewSet):
 # ОБЪЯВЛЕНИЯ И КАЛЕНДАРЬ
 # ============================================================================
 
-class AnnouncementViewSet(viewsets.ModelViewSet):
+class AnnouncementViewSet(ConditionalGetMixin, RelatedFieldsMixin, viewsets.ModelViewSet):
     """
     ViewSet для работы с объявлениями
     """
-    queryset = Announcement.objects.select_related('author').all()
+    queryset = Announcement.objects.all()
     serializer_class = AnnouncementSerializer
-    permission_classes = [IsAuthenticated]
+    permission_classes = [IsAuthenticated, TokenScopePermission]
+    conditional_groups = [dashboard_cache.GROUP_ANNOUNCEMENTS]
     filter_backends = [filters.SearchFilter, filters.OrderingFilter]
     search_fields = ['title', 'text']
     ordering_fields = ['published_at', 'is_pinned']
@@ -351,13 +1036,13 @@ class AnnouncementViewSet(viewsets.ModelViewSet):
         return Response(serializer.data)
 
 
-class CalendarEventViewSet(viewsets.ModelViewSet):
+class CalendarEventViewSet(RelatedFieldsMixin, viewsets.ModelViewSet):
     """
     ViewSet для работы с событиями календаря
     """
-    queryset = CalendarEvent.objects.select_related('organizer').prefetch_related('participants').all()
+    queryset = CalendarEvent.objects.all()
     serializer_class = CalendarEventSerializer
-    permission_classes = [IsAuthenticated]
+    permission_classes = [IsAuthenticated, TokenScopePermission]
     filter_backends = [filters.SearchFilter, filters.OrderingFilter]
     search_fields = ['subject', 'description', 'location']
     ordering_fields = ['start_datetime', 'end_datetime']
@@ -391,13 +1076,13 @@ class CalendarEventViewSet(viewsets.ModelViewSet):
         serializer.save(organizer=self.request.user)
 
 
-class DocumentTemplateViewSet(viewsets.ModelViewSet):
+class DocumentTemplateViewSet(RelatedFieldsMixin, viewsets.ModelViewSet):
     """
     ViewSet для работы с документами
     """
-    queryset = DocumentTemplate.objects.select_related('uploaded_by').all()
+    queryset = DocumentTemplate.objects.all()
     serializer_class = DocumentTemplateSerializer
-    permission_classes = [IsAuthenticated]
+    permission_classes = [IsAuthenticated, TokenScopePermission]
     filter_backends = [filters.SearchFilter, filters.OrderingFilter]
     search_fields = ['name', 'description']
     ordering_fields = ['name', 'uploaded_at']
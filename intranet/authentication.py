@@ -0,0 +1,130 @@
+"""
+Аутентификация API по токенам для сервисных учётных записей
+
+Приборы и скрипты передают ключ в заголовке:
+    Authorization: Token <префикс>.<секрет>
+
+Секрет - 256 случайных бит, поэтому в базе достаточно хранить SHA-256
+ключа: медленное хеширование паролей (PBKDF2 при Basic-аутентификации)
+здесь ничего не добавляет, а стоит десятки миллисекунд на каждый запрос.
+Токен ищется по уникальному префиксу, хеш сравнивается за постоянное время.
+
+Разрешённый токен (пользователь и токен) кешируется на
+PRINCIPAL_CACHE_TIMEOUT секунд по хешу ключа - повторные запросы
+проходят аутентификацию без обращения к базе. Изменение или удаление
+токена и любое сохранение пользователя сбрасывают запись (см. signals.py),
+но только в том кеше, где это произошло. С LocMemCache у каждого процесса
+(воркера) свой кеш: в остальных процессах отозванный токен действует
+ещё до PRINCIPAL_CACHE_TIMEOUT секунд. С общим кешем (Redis, Memcached)
+отзыв действует сразу во всех процессах.
+"""
+
+import hashlib
+import hmac
+import secrets
+
+from django.core.cache import cache
+from django.utils import timezone
+from rest_framework import exceptions
+from rest_framework.authentication import BaseAuthentication, get_authorization_header
+from rest_framework.permissions import SAFE_METHODS, BasePermission
+
+from .models import ApiToken
+
+
+KEYWORD = 'Token'
+PRINCIPAL_CACHE_TIMEOUT = 60
+
+
+def hash_key(key):
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def principal_cache_key(key_hash):
+    return f'apitoken:{key_hash}'
+
+
+def set_new_key(token):
+    """
+    Генерирует ключ для несохранённого токена (префикс и хеш)
+    Возвращает ключ; он больше нигде не сохраняется - его нужно передать владельцу
+    """
+    token.prefix = secrets.token_hex(4)
+    key = f'{token.prefix}.{secrets.token_urlsafe(32)}'
+    token.key_hash = hash_key(key)
+    return key
+
+
+def issue_token(user, name, scopes=('read',), expires_at=None):
+    """Выпускает токен. Возвращает (ApiToken, ключ)"""
+    token = ApiToken(user=user, name=name, scopes=','.join(scopes), expires_at=expires_at)
+    key = set_new_key(token)
+    token.save()
+    return token, key
+
+
+def forget_tokens(tokens):
+    """Сбрасывает кешированные учётные данные токенов"""
+    cache.delete_many([principal_cache_key(token.key_hash) for token in tokens])
+
+
+def resolve_token(key):
+    """
+    (пользователь, токен) по ключу: из кеша или одним запросом к базе
+    Неизвестный, отозванный или просроченный ключ - AuthenticationFailed
+    """
+    key_hash = hash_key(key)
+    cache_key = principal_cache_key(key_hash)
+    principal = cache.get(cache_key)
+    if principal is None:
+        prefix = key.partition('.')[0]
+        token = ApiToken.objects.select_related('user').filter(prefix=prefix).first()
+        if token is None or not hmac.compare_digest(token.key_hash, key_hash):
+            raise exceptions.AuthenticationFailed('Неверный токен')
+        if not token.is_active or not token.user.is_active:
+            raise exceptions.AuthenticationFailed('Токен отозван или пользователь отключён')
+
+        # Отметка использования - не чаще раза за время жизни записи в кеше
+        token.last_used_at = timezone.now()
+        ApiToken.objects.filter(pk=token.pk).update(last_used_at=token.last_used_at)
+        principal = (token.user, token)
+        cache.set(cache_key, principal, PRINCIPAL_CACHE_TIMEOUT)
+
+    if principal[1].is_expired:
+        raise exceptions.AuthenticationFailed('Срок действия токена истёк')
+    return principal
+
+
+class ApiTokenAuthentication(BaseAuthentication):
+    """
+    Аутентификация по заголовку «Authorization: Token <ключ>»
+    request.auth - экземпляр ApiToken (для проверки прав токена)
+    """
+
+    def authenticate(self, request):
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != KEYWORD.lower().encode():
+            return None
+        if len(auth) != 2:
+            raise exceptions.AuthenticationFailed('Неверный заголовок: ожидается «Token <ключ>»')
+        try:
+            key = auth[1].decode()
+        except UnicodeError:
+            raise exceptions.AuthenticationFailed('Ключ содержит недопустимые символы')
+        return resolve_token(key)
+
+    def authenticate_header(self, request):
+        return KEYWORD
+
+
+class TokenScopePermission(BasePermission):
+    """
+    Права токена: чтение (GET, HEAD, OPTIONS) - scope read,
+    остальные методы - scope write. Сессии пользователей не ограничиваются
+    """
+    message = 'Недостаточно прав токена'
+
+    def has_permission(self, request, view):
+        if not isinstance(request.auth, ApiToken):
+            return True
+        return request.auth.has_scope('read' if request.method in SAFE_METHODS else 'write')
@@ -0,0 +1,247 @@
+"""
+Автодополнение названий реагентов из индекса в памяти процесса
+
+Индекс строится один раз (при первом обращении после запуска процесса)
+и обновляется инкрементально сигналами при сохранении/удалении Reagent.
+Поиск не обращается к базе данных:
+- префиксный поиск по словам названия - бинарный поиск в отсортированном
+  списке слов (bisect);
+- при нехватке результатов - нечёткий поиск по триграммам, который
+  допускает опечатки;
+- если ничего не найдено, запрос повторяется в другой раскладке
+  клавиатуры («nhbgcby» -> «трипсин»).
+
+Количество просматриваемых кандидатов ограничено, поэтому время ответа
+не зависит от размера справочника.
+
+При нескольких процессах изменения в других процессах отслеживаются
+по номеру версии в общем кеше: при расхождении индекс перестраивается.
+С LocMemCache у каждого процесса своя версия, поэтому она живёт не дольше
+dashboard_cache.GENERATION_TIMEOUT: изменения других процессов видны
+не позже, чем через 5 минут.
+"""
+
+import bisect
+import re
+import threading
+import uuid
+
+from django.core.cache import cache
+
+from . import dashboard_cache
+from .models import Reagent
+
+
+# Ограничения на количество просматриваемых кандидатов
+MAX_PREFIX_SCAN = 500
+MAX_TRIGRAM_POSTINGS = 2000
+MIN_SIMILARITY = 0.3
+
+VERSION_CACHE_KEY = 'autocomplete:reagents:version'
+
+_LATIN = "qwertyuiop[]asdfghjkl;'zxcvbnm,.`"
+_CYRILLIC = 'йцукенгшщзхъфывапролджэячсмитьбюё'
+_LAYOUT = str.maketrans(_LATIN + _CYRILLIC, _CYRILLIC + _LATIN)
+
+
+def normalize(text):
+    """Нижний регистр, ё -> е"""
+    return text.lower().replace('ё', 'е')
+
+
+def tokenize(text):
+    """Слова названия (кириллица, латиница, цифры)"""
+    return re.findall(r'[^\W_]+', normalize(text))
+
+
+def trigrams(word):
+    """Триграммы слова с границами: 'fbs' -> {'  f', ' fb', 'fbs', 'bs '}"""
+    padded = f'  {word} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class ReagentNameIndex:
+    """
+    Префиксный и триграммный индекс названий реагентов
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._built = False
+        self._version = None
+        self._reset()
+
+    def _reset(self):
+        self._entries = {}         # id -> {'id', 'name', 'category'}
+        self._tokens = []          # отсортированный список (слово, id)
+        self._trigrams = {}        # триграмма -> множество id
+        self._trigram_counts = {}  # id -> число триграмм названия
+
+    # ------------------------------------------------------------------
+    # Построение и обновление
+    # ------------------------------------------------------------------
+
+    def build(self):
+        """
+        Строит индекс по всем реагентам (один запрос)
+        Слова собираются в список и сортируются один раз
+        """
+        with self._lock:
+            self._reset()
+            tokens = []
+            rows = Reagent.objects.values_list('id', 'name', 'category')
+            for pk, name, category in rows.iterator():
+                self._add(pk, name, category, tokens)
+            self._tokens = sorted(tokens)
+            self._built = True
+            self._version = _current_version()
+
+    def _add(self, pk, name, category, tokens=None):
+        """tokens - список для слов при построении; иначе слово вставляется в отсортированный список"""
+        self._entries[pk] = {'id': pk, 'name': name, 'category': category}
+        name_trigrams = set()
+        for token in set(tokenize(name)):
+            if tokens is None:
+                bisect.insort(self._tokens, (token, pk))
+            else:
+                tokens.append((token, pk))
+            name_trigrams |= trigrams(token)
+        for trigram in name_trigrams:
+            self._trigrams.setdefault(trigram, set()).add(pk)
+        self._trigram_counts[pk] = len(name_trigrams)
+
+    def _remove(self, pk):
+        entry = self._entries.pop(pk, None)
+        if entry is None:
+            return
+        del self._trigram_counts[pk]
+        for token in set(tokenize(entry['name'])):
+            position = bisect.bisect_left(self._tokens, (token, pk))
+            if position < len(self._tokens) and self._tokens[position] == (token, pk):
+                del self._tokens[position]
+            for trigram in trigrams(token):
+                postings = self._trigrams.get(trigram)
+                if postings is not None:
+                    postings.discard(pk)
+                    if not postings:
+                        del self._trigrams[trigram]
+
+    def update(self, reagent, previous=None):
+        """
+        Добавляет или обновляет реагент
+        previous - (название, категория) до сохранения; если они не
+        изменились (правка остатка, порогов, единиц), индекс и версия не
+        меняются - другие процессы не перестраивают индекс без нужды
+        """
+        with self._lock:
+            entry = self._entries.get(reagent.pk) if self._built else None
+            if previous is None and entry is not None:
+                previous = (entry['name'], entry['category'])
+            if previous == (reagent.name, reagent.category):
+                return
+            version = _bump_version()
+            if self._built:
+                self._remove(reagent.pk)
+                self._add(reagent.pk, reagent.name, reagent.category)
+                self._version = version
+
+    def remove(self, pk):
+        """Удаляет реагент из индекса"""
+        with self._lock:
+            version = _bump_version()
+            if self._built:
+                self._remove(pk)
+                self._version = version
+
+    def _ensure_fresh(self):
+        """Строит индекс при первом обращении или после изменений в другом процессе"""
+        if not self._built or _current_version() != self._version:
+            self.build()
+
+    # ------------------------------------------------------------------
+    # Поиск
+    # ------------------------------------------------------------------
+
+    def _prefix_ids(self, prefix):
+        """id реагентов, у которых есть слово с данным префиксом"""
+        ids = set()
+        start = bisect.bisect_left(self._tokens, (prefix,))
+        for token, pk in self._tokens[start:start + MAX_PREFIX_SCAN]:
+            if not token.startswith(prefix):
+                break
+            ids.add(pk)
+        return ids
+
+    def _prefix_search(self, tokens):
+        """Реагенты, в названии которых каждое слово запроса - префикс какого-то слова"""
+        result = None
+        for token in tokens:
+            ids = self._prefix_ids(token)
+            result = ids if result is None else result & ids
+            if not result:
+                return []
+        return sorted(result, key=lambda pk: (len(self._entries[pk]['name']), self._entries[pk]['name']))
+
+    def _fuzzy_search(self, tokens, exclude):
+        """Нечёткий поиск по триграммам (коэффициент Дайса)"""
+        query_trigrams = set()
+        for token in tokens:
+            query_trigrams |= trigrams(token)
+
+        # Самые редкие триграммы дают меньше кандидатов - начинаем с них
+        scores = {}
+        scanned = 0
+        for trigram in sorted(query_trigrams, key=lambda t: len(self._trigrams.get(t, ()))):
+            postings = self._trigrams.get(trigram, ())
+            if scanned + len(postings) > MAX_TRIGRAM_POSTINGS:
+                break
+            scanned += len(postings)
+            for pk in postings:
+                scores[pk] = scores.get(pk, 0) + 1
+
+        ranked = []
+        for pk, shared in scores.items():
+            if pk in exclude:
+                continue
+            similarity = 2 * shared / (len(query_trigrams) + self._trigram_counts[pk])
+            if similarity >= MIN_SIMILARITY:
+                ranked.append((similarity, pk))
+        ranked.sort(key=lambda item: (-item[0], self._entries[item[1]]['name']))
+        return [pk for _, pk in ranked]
+
+    def _search(self, tokens, limit):
+        ids = self._prefix_search(tokens)[:limit]
+        if len(ids) < limit:
+            ids += self._fuzzy_search(tokens, set(ids))[:limit - len(ids)]
+        return ids
+
+    def search(self, query, limit=10):
+        """
+        Возвращает до limit реагентов: [{'id', 'name', 'category'}, ...]
+        Сначала точные совпадения по префиксу, затем нечёткие
+        """
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+
+        with self._lock:
+            self._ensure_fresh()
+            ids = self._search(tokens, limit)
+            if not ids:
+                ids = self._search(tokenize(normalize(query).translate(_LAYOUT)), limit)
+            return [dict(self._entries[pk]) for pk in ids]
+
+
+def _current_version():
+    """Версия индекса; после вытеснения ключа - новая, и индекс перестраивается"""
+    return cache.get_or_set(VERSION_CACHE_KEY, uuid.uuid4().hex, dashboard_cache.GENERATION_TIMEOUT)
+
+
+def _bump_version():
+    version = uuid.uuid4().hex
+    cache.set(VERSION_CACHE_KEY, version, dashboard_cache.GENERATION_TIMEOUT)
+    return version
+
+
+# Единственный экземпляр индекса на процесс
+reagent_index = ReagentNameIndex()
@@ -0,0 +1,165 @@
+"""
+Поиск реагента по штрихкоду партии (сканирование флакона)
+
+Штрихкод хранится в ReagentLot.barcode с уникальным индексом: партия,
+реагент и его остатки читаются одним запросом с JOIN.
+
+Перед базой стоит небольшой LRU-кеш в памяти процесса - при инвентаризации
+одни и те же флаконы сканируются многократно. Каждая запись помечена
+версией своего реагента из общего кеша: сигналы меняют версию только
+у реагентов, чьи данные, партии или остатки изменились (в том числе
+в другом процессе, если кеш общий), поэтому движение по одному реагенту
+не сбрасывает записи остальных. Версии живут столько же, сколько
+поколения dashboard_cache.
+"""
+
+import threading
+import uuid
+from collections import OrderedDict
+
+from django.core.cache import cache
+
+from . import dashboard_cache
+from .models import ReagentLot
+
+
+SCAN_CACHE_SIZE = 1024
+
+
+def normalize_code(code):
+    """Сканеры добавляют пробелы и перевод строки по краям"""
+    return code.strip()
+
+
+def _version_key(reagent_id):
+    return f'barcodes:reagent:{reagent_id}'
+
+
+def reagent_version(reagent_id):
+    """Текущая версия данных реагента для записей кеша сканирования"""
+    return cache.get_or_set(_version_key(reagent_id), uuid.uuid4().hex, dashboard_cache.GENERATION_TIMEOUT)
+
+
+def invalidate_reagents(reagent_ids):
+    """
+    Устаревают записи сканирования указанных реагентов. Новая версия -
+    случайное значение, как и поколения dashboard_cache
+    """
+    versions = {_version_key(reagent_id): uuid.uuid4().hex for reagent_id in set(reagent_ids)}
+    if versions:
+        cache.set_many(versions, dashboard_cache.GENERATION_TIMEOUT)
+
+
+class ScanCache:
+    """
+    LRU-кеш результатов сканирования: код -> (версия реагента, результат)
+    Версию проверяет scan()
+    """
+
+    def __init__(self, maxsize=SCAN_CACHE_SIZE):
+        self._lock = threading.Lock()
+        self._maxsize = maxsize
+        self._entries = OrderedDict()
+
+    def get(self, code):
+        """(версия, результат) или None"""
+        with self._lock:
+            entry = self._entries.get(code)
+            if entry is not None:
+                self._entries.move_to_end(code)
+            return entry
+
+    def put(self, code, version, value):
+        with self._lock:
+            self._entries[code] = (version, value)
+            self._entries.move_to_end(code)
+            while len(self._entries) > self._maxsize:
+                self._entries.popitem(last=False)
+
+    def discard(self, code):
+        with self._lock:
+            self._entries.pop(code, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+scan_cache = ScanCache()
+
+
+def find_by_barcode(code):
+    """
+    Партия и реагент по штрихкоду (один запрос) или None
+
+    Возвращает словарь:
+    {'code', 'reagent': {...остатки...}, 'lot': {...},
+     'movement': заготовка формы движения для POST /api/reagent-movements/}
+    """
+    row = ReagentLot.objects.filter(barcode=code).values(
+        'pk', 'lot_number', 'expiry_date', 'on_hand',
+        'reagent_id', 'reagent__name', 'reagent__category', 'reagent__unit',
+        'reagent__on_hand', 'reagent__reserved', 'reagent__min_threshold',
+        'reagent__expiry_date',
+    ).first()
+    if row is None:
+        return None
+    return {
+        'code': code,
+        'reagent': {
+            'id': row['reagent_id'],
+            'name': row['reagent__name'],
+            'category': row['reagent__category'],
+            'unit': row['reagent__unit'],
+            'on_hand': row['reagent__on_hand'],
+            'reserved': row['reagent__reserved'],
+            'available': row['reagent__on_hand'] - row['reagent__reserved'],
+            'min_threshold': row['reagent__min_threshold'],
+            'expiry_date': row['reagent__expiry_date'],
+        },
+        'lot': {
+            'id': row['pk'],
+            'lot_number': row['lot_number'],
+            'expiry_date': row['expiry_date'],
+            'on_hand': row['on_hand'],
+        },
+        'movement': {
+            'reagent': row['reagent_id'],
+            'lot': row['pk'],
+            'movement_type': 'out',
+            'quantity': None,
+            'comment': '',
+        },
+    }
+
+
+def scan(code):
+    """
+    Результат сканирования из LRU-кеша процесса или из базы
+
+    Версия реагента читается до выборки: изменение, сделанное после неё,
+    меняет версию, и запись сразу считается устаревшей. При первом
+    сканировании кода реагент сначала определяется по индексу штрихкода
+    """
+    code = normalize_code(code)
+    entry = scan_cache.get(code)
+    if entry is not None:
+        reagent_id = entry[1]['reagent']['id']
+    else:
+        reagent_id = ReagentLot.objects.filter(barcode=code).values_list('reagent_id', flat=True).first()
+        if reagent_id is None:
+            return None
+    version = reagent_version(reagent_id)
+    if entry is not None and entry[0] == version:
+        return entry[1]
+
+    result = find_by_barcode(code)
+    if result is not None and result['reagent']['id'] == reagent_id:
+        scan_cache.put(code, version, result)
+    else:
+        # Штрихкод перешёл к партии другого реагента или удалён
+        scan_cache.discard(code)
+    return result
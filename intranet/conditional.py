@@ -0,0 +1,79 @@
+"""
+Условные GET-запросы (ETag / Last-Modified) для списков API и страниц
+
+Клиенты, опрашивающие списки реагентов и задач, получают одни и те же
+данные много раз подряд. Валидатор ответа считается до выборки и
+сериализации:
+- по поколениям групп данных dashboard_cache - их меняют сигналы,
+  в том числе при массовых операциях со складом (без запросов к базе);
+- для моделей вне групп - по Max('updated_at') и числу строк (один запрос).
+Если валидатор совпал с If-None-Match / If-Modified-Since клиента,
+возвращается 304 Not Modified без тела.
+
+В ETag входят полный путь запроса (фильтры, страница, курсор),
+пользователь и данные, зависящие от времени (текущая дата,
+наступившие сроки задач).
+"""
+
+import hashlib
+
+from django.contrib import messages
+from django.core.cache import cache
+from django.db.models import Count, Max, Min, Q
+from django.utils import timezone
+
+from . import dashboard_cache
+from .models import Task
+
+
+def collection_etag(request, groups=(), *parts):
+    """ETag ответа на запрос: путь, пользователь, поколения групп и parts"""
+    owner = request.user.pk if request.user.is_authenticated else ''
+    generations = [dashboard_cache.get_generation(group) for group in groups]
+    source = '|'.join(str(part) for part in (request.get_full_path(), owner, *generations, *parts))
+    return hashlib.md5(source.encode()).hexdigest()
+
+
+def modified_and_count(queryset):
+    """
+    (Max('updated_at'), число строк) выборки - валидатор для моделей
+    без группы данных; число строк учитывает удаление
+    """
+    values = queryset.order_by().aggregate(last_modified=Max('updated_at'), total=Count('pk'))
+    return values['last_modified'], values['total']
+
+
+def last_passed_deadline():
+    """
+    Последний наступивший срок задачи: признак «просрочена» меняется
+    со временем, без сохранения задачи. Вместе с ближайшим будущим сроком
+    кешируется до изменения задач - запрос к базе нужен, только когда
+    этот срок наступил
+    """
+    key = f'conditional:deadline:{dashboard_cache.get_generation(dashboard_cache.GROUP_TASKS)}'
+    now = timezone.now()
+    deadlines = cache.get(key)
+    if deadlines is None or (deadlines[1] is not None and deadlines[1] <= now):
+        values = Task.objects.aggregate(
+            passed=Max('deadline', filter=Q(deadline__lte=now)),
+            upcoming=Min('deadline', filter=Q(deadline__gt=now)),
+        )
+        deadlines = (values['passed'], values['upcoming'])
+        cache.set(key, deadlines, dashboard_cache.WIDGET_TIMEOUT)
+    return deadlines[0]
+
+
+def page_etag(groups, *extra):
+    """
+    Функция ETag для декоратора condition() страниц интранета
+    extra - функции без аргументов, значения которых входят в ETag.
+    Страница с неполученными сообщениями (messages) всегда строится заново;
+    токен CSRF формы зависит от cookie, поэтому cookie тоже входит в ETag
+    """
+    def etag_func(request, *args, **kwargs):
+        if len(messages.get_messages(request)):
+            return None
+        return collection_etag(
+            request, groups, request.META.get('CSRF_COOKIE', ''), *(part() for part in extra)
+        )
+    return etag_func
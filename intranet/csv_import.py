@@ -0,0 +1,239 @@
+"""
+Потоковый импорт движений реагентов из CSV (выгрузки дозаторов и ERP)
+
+Файл читается построчно и не загружается в память целиком. Строки
+собираются в пакеты по CHUNK_SIZE; каждый пакет проверяется и
+сохраняется отдельной транзакцией (см. inventory.create_movements):
+bulk_create движений и один агрегированный UPDATE остатков на пакет.
+
+Реагент в строке указывается названием или id, партия - штрихкодом.
+Справочники (реагенты, партии, реагенты с партиями) строятся один раз
+перед импортом (по запросу на справочник), дальше каждая строка
+разрешается поиском в словаре.
+
+Колонки (заголовок обязателен, разделитель «,» или «;»):
+    reagent        - название или id реагента (обязательно)
+    quantity       - количество, допускается десятичная запятая (обязательно)
+    movement_type  - in/out или приход/расход (по умолчанию out)
+    date           - ISO 8601 или ДД.ММ.ГГГГ [ЧЧ:ММ] (по умолчанию - время импорта)
+    lot            - штрихкод партии (обязательно для прихода реагента с партиями)
+    comment        - комментарий
+"""
+
+import csv
+import functools
+import itertools
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import inventory
+from .models import Reagent, ReagentLot, ReagentMovement
+
+
+CHUNK_SIZE = 5000
+MAX_REPORTED_ERRORS = 1000
+
+REQUIRED_COLUMNS = ('reagent', 'quantity')
+
+MOVEMENT_TYPES = {
+    'in': 'in',
+    'out': 'out',
+    'приход': 'in',
+    'расход': 'out',
+}
+
+DATE_FORMATS = ('%d.%m.%Y %H:%M:%S', '%d.%m.%Y %H:%M', '%d.%m.%Y')
+
+
+class CSVImportError(ValueError):
+    """Файл нельзя импортировать (нет заголовка или обязательных колонок)"""
+
+
+def _normalize_name(name):
+    return name.strip().casefold()
+
+
+def reagent_lookup():
+    """
+    Словарь для разрешения реагентов (один запрос):
+    id и название в нижнем регистре -> id реагента.
+    Неоднозначные названия (несколько реагентов) -> None
+    """
+    lookup = {}
+    for pk, name in Reagent.objects.values_list('pk', 'name').iterator():
+        lookup[str(pk)] = pk
+        key = _normalize_name(name)
+        lookup[key] = None if key in lookup and lookup[key] != pk else pk
+    return lookup
+
+
+def lot_lookup():
+    """Штрихкод партии -> (id реагента, id партии) (один запрос)"""
+    return {
+        barcode: (reagent_id, pk)
+        for pk, reagent_id, barcode in ReagentLot.objects.filter(
+            barcode__isnull=False
+        ).values_list('pk', 'reagent_id', 'barcode').iterator()
+    }
+
+
+def lot_tracked_reagents():
+    """id реагентов с партиями - их приход требует партии (один запрос)"""
+    return set(ReagentLot.objects.order_by().values_list('reagent_id', flat=True).distinct())
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_moment(value, tz=None):
+    """
+    Дата или дата и время; наивное время - в часовом поясе tz (по умолчанию
+    в текущем). В выгрузках отметки времени часто повторяются - результат
+    кешируется; при импорте tz передаётся один раз вычисленным
+    """
+    moment = parse_datetime(value)
+    if moment is None:
+        for date_format in DATE_FORMATS:
+            try:
+                moment = datetime.strptime(value, date_format)
+                break
+            except ValueError:
+                continue
+        else:
+            raise ValueError(f'Неверная дата: {value}')
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment, tz)
+    return moment
+
+
+def read_rows(stream):
+    """
+    Построчное чтение CSV: (номер строки, словарь колонок)
+    Разделитель определяется по строке заголовка
+    """
+    header = next(stream, None)
+    if header is None or not header.strip():
+        raise CSVImportError('Пустой файл')
+    delimiter = ';' if header.count(';') > header.count(',') else ','
+
+    reader = csv.reader(itertools.chain([header], stream), delimiter=delimiter)
+    columns = [column.strip().lower() for column in next(reader)]
+    missing = [column for column in REQUIRED_COLUMNS if column not in columns]
+    if missing:
+        raise CSVImportError(f'Нет обязательных колонок: {", ".join(missing)}')
+
+    for values in reader:
+        if not any(values):
+            continue
+        yield reader.line_num, dict(zip(columns, (value.strip() for value in values)))
+
+
+def build_movement(row, reagents, lots, user, now, lot_tracked=frozenset(), tz=None):
+    """
+    Движение из строки CSV (без сохранения)
+    lot_tracked - id реагентов с партиями (см. lot_tracked_reagents)
+    tz          - часовой пояс наивных дат (по умолчанию текущий)
+    Возвращает (ReagentMovement, None) или (None, {поле: ошибка})
+    """
+    errors = {}
+
+    reagent_id = None
+    lot_id = None
+    if row.get('lot'):
+        reagent_id, lot_id = lots.get(row['lot'], (None, None))
+        if lot_id is None:
+            errors['lot'] = f'Партия со штрихкодом {row["lot"]} не найдена'
+    name = row.get('reagent', '')
+    if name:
+        by_name = reagents.get(name) or reagents.get(_normalize_name(name))
+        if by_name is None:
+            errors['reagent'] = f'Реагент «{name}» не найден или название неоднозначно'
+        elif reagent_id is not None and by_name != reagent_id:
+            errors['lot'] = 'Партия относится к другому реагенту'
+        reagent_id = by_name
+    elif lot_id is None:
+        errors['reagent'] = 'Не указан реагент'
+
+    try:
+        quantity = Decimal(row.get('quantity', '').replace(',', '.').replace(' ', ''))
+        if not quantity.is_finite() or quantity <= 0:
+            raise InvalidOperation
+        quantity = quantity.quantize(Decimal('0.01'))
+    except InvalidOperation:
+        errors['quantity'] = f'Неверное количество: {row.get("quantity", "")}'
+
+    movement_type = MOVEMENT_TYPES.get((row.get('movement_type') or 'out').lower())
+    if movement_type is None:
+        errors['movement_type'] = f'Неизвестный тип движения: {row["movement_type"]}'
+    elif movement_type == 'in' and lot_id is None and reagent_id in lot_tracked and 'lot' not in errors:
+        errors['lot'] = 'У реагента есть партии: укажите штрихкод партии прихода'
+
+    date = now
+    if row.get('date'):
+        try:
+            date = parse_moment(row['date'], tz)
+        except ValueError as error:
+            errors['date'] = str(error)
+
+    if errors:
+        return None, errors
+    return ReagentMovement(
+        reagent_id=reagent_id,
+        lot_id=lot_id,
+        quantity=quantity,
+        movement_type=movement_type,
+        date=date,
+        comment=row.get('comment', ''),
+        user_id=user.pk if user is not None else None,
+    ), None
+
+
+def import_movements(stream, user=None, chunk_size=CHUNK_SIZE, dry_run=False, on_reject=None):
+    """
+    Импортирует движения из текстового потока CSV
+
+    stream    - итератор строк (открытый файл, TextIOWrapper загрузки)
+    dry_run   - только проверить строки, ничего не сохраняя
+    on_reject - вызывается для каждой отклонённой строки:
+                on_reject(номер строки, словарь колонок, ошибки)
+
+    Возвращает словарь:
+    {'rows', 'created', 'rejected', 'chunks',
+     'errors': [{'line', 'errors'}, ...] - первые MAX_REPORTED_ERRORS ошибок}
+    """
+    reagents = reagent_lookup()
+    lots = lot_lookup()
+    lot_tracked = lot_tracked_reagents()
+    now = timezone.now()
+    tz = timezone.get_current_timezone()
+    result = {'rows': 0, 'created': 0, 'rejected': 0, 'chunks': 0, 'errors': []}
+
+    def reject(line, row, errors):
+        result['rejected'] += 1
+        if len(result['errors']) < MAX_REPORTED_ERRORS:
+            result['errors'].append({'line': line, 'errors': errors})
+        if on_reject is not None:
+            on_reject(line, row, errors)
+
+    def flush(chunk):
+        result['chunks'] += 1
+        if not dry_run:
+            result['created'] += len(inventory.create_movements(chunk))
+        else:
+            result['created'] += len(chunk)
+
+    chunk = []
+    for line, row in read_rows(iter(stream)):
+        result['rows'] += 1
+        movement, errors = build_movement(row, reagents, lots, user, now, lot_tracked, tz)
+        if errors:
+            reject(line, row, errors)
+            continue
+        chunk.append(movement)
+        if len(chunk) >= chunk_size:
+            flush(chunk)
+            chunk = []
+    if chunk:
+        flush(chunk)
+    return result
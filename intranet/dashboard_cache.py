@@ -0,0 +1,200 @@
+"""
+Кеширование виджетов главной страницы (дашборда)
+
+Каждый виджет кешируется отдельно. Ключ виджета содержит «поколение»
+группы данных, от которой он зависит (announcements, tasks, reagents,
+cultures, movements). При изменении модели сигнал меняет поколение группы,
+и все связанные ключи (в том числе персональные) сразу становятся
+недействительными - перебирать ключи пользователей не нужно.
+"""
+
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+from django.utils import timezone
+
+from . import stats
+from .models import Announcement, Task, Reagent, ReagentForecast
+
+
+# Поколения сбрасываются только в том кеше, где их сменил сигнал.
+# LocMemCache у каждого процесса свой: изменения, сделанные другим
+# процессом (воркером), сюда не доходят. С ним сами поколения и записи
+# живут не дольше прежнего cache_page (5 минут) - так ограничено
+# устаревание виджетов, ETag (conditional.py) и других ключей по поколениям
+SHARED_CACHE = 'locmem' not in settings.CACHES['default']['BACKEND'].lower()
+LOCAL_CACHE_TIMEOUT = 5 * 60
+
+# Время жизни записей. В общем кеше инвалидация выполняется сигналами,
+# таймаут лишь ограничивает устаревание данных, зависящих от времени
+WIDGET_TIMEOUT = 60 * 60 if SHARED_CACHE else LOCAL_CACHE_TIMEOUT
+GENERATION_TIMEOUT = None if SHARED_CACHE else LOCAL_CACHE_TIMEOUT
+TIME_SENSITIVE_TIMEOUT = 60
+
+# Группы данных и модели, изменение которых их затрагивает
+GROUP_ANNOUNCEMENTS = 'announcements'
+GROUP_TASKS = 'tasks'
+GROUP_REAGENTS = 'reagents'
+GROUP_CULTURES = 'cultures'
+GROUP_MOVEMENTS = 'movements'
+GROUP_FORECASTS = 'forecasts'
+
+# Горизонт виджета прогноза: реагенты, которые достигнут порога за N дней
+FORECAST_HORIZON_DAYS = 14
+
+
+def _generation_key(group):
+    return f'dashboard:gen:{group}'
+
+
+def get_generation(group):
+    """Возвращает текущее поколение группы данных"""
+    return cache.get_or_set(_generation_key(group), uuid.uuid4().hex, GENERATION_TIMEOUT)
+
+
+def invalidate(*groups):
+    """
+    Инвалидирует все виджеты, зависящие от указанных групп.
+    Новое поколение - случайное значение, поэтому после вытеснения
+    ключа из кеша старые записи не могут «воскреснуть»
+    """
+    cache.set_many(
+        {_generation_key(group): uuid.uuid4().hex for group in groups},
+        GENERATION_TIMEOUT
+    )
+
+
+def cached_widget(name, groups, builder, user=None, timeout=WIDGET_TIMEOUT, suffix=''):
+    """
+    Возвращает значение виджета из кеша или строит его через builder()
+
+    name    - имя виджета
+    groups  - группы данных, от которых зависит виджет
+    user    - для персональных виджетов ключ строится по пользователю
+    suffix  - дополнительная часть ключа (например, текущая дата)
+    """
+    generations = ':'.join(get_generation(group) for group in groups)
+    owner = f'u{user.pk}' if user is not None else 'all'
+    key = f'dashboard:{name}:{owner}:{suffix}:{generations}'
+
+    value = cache.get(key)
+    if value is None:
+        value = builder()
+        cache.set(key, value, timeout)
+    return value
+
+
+# ============================================================================
+# ВИДЖЕТЫ
+# ============================================================================
+
+def latest_announcements(limit=5):
+    """Последние объявления (закреплённые - первыми)"""
+    return cached_widget(
+        'announcements', [GROUP_ANNOUNCEMENTS],
+        lambda: list(
+            Announcement.objects.select_related('author').order_by(
+                '-is_pinned', '-published_at'
+            )[:limit]
+        ),
+    )
+
+
+def user_tasks(user, limit=5):
+    """Актуальные задачи пользователя"""
+    return cached_widget(
+        'user_tasks', [GROUP_TASKS],
+        lambda: list(
+            Task.objects.filter(assignee=user).exclude(
+                status='done'
+            ).select_related('creator').order_by('deadline', '-priority')[:limit]
+        ),
+        user=user,
+    )
+
+
+def user_task_stats(user):
+    """Счётчики задач пользователя (см. stats.user_task_stats)"""
+    return cached_widget(
+        'user_task_stats', [GROUP_TASKS],
+        lambda: stats.user_task_stats(user),
+        user=user,
+        timeout=TIME_SENSITIVE_TIMEOUT,
+    )
+
+
+def global_stats():
+    """Общие счётчики по реагентам, культурам и движениям"""
+    return cached_widget(
+        'global_stats', [GROUP_REAGENTS, GROUP_CULTURES, GROUP_MOVEMENTS],
+        stats.global_stats,
+    )
+
+
+def overdue_tasks_count(user):
+    """Количество просроченных задач пользователя"""
+    return user_task_stats(user)['overdue_tasks']
+
+
+def critical_reagents(limit=5):
+    """Реагенты с остатком ниже минимального порога"""
+    return cached_widget(
+        'critical_reagents', [GROUP_REAGENTS],
+        lambda: list(
+            Reagent.objects.filter(
+                on_hand__lt=F('min_threshold')
+            ).order_by('on_hand')[:limit]
+        ),
+    )
+
+
+def expiring_reagents(limit=5):
+    """Реагенты, срок годности которых истекает в ближайшие 30 дней"""
+    today = timezone.now().date()
+    return cached_widget(
+        'expiring_reagents', [GROUP_REAGENTS],
+        lambda: list(
+            Reagent.objects.filter(
+                expiry_date__lte=today + timedelta(days=30),
+                expiry_date__gte=today
+            ).order_by('expiry_date')[:limit]
+        ),
+        suffix=today.isoformat(),
+    )
+
+
+def stockout_forecast(limit=5):
+    """
+    Реагенты, которые по прогнозу расхода достигнут минимального порога
+    в ближайшие FORECAST_HORIZON_DAYS дней (см. forecasting.py)
+    """
+    today = timezone.now().date()
+    return cached_widget(
+        'stockout_forecast', [GROUP_FORECASTS, GROUP_REAGENTS],
+        lambda: list(
+            ReagentForecast.objects.filter(
+                reorder_date__lte=today + timedelta(days=FORECAST_HORIZON_DAYS)
+            ).select_related('reagent').order_by('stockout_date', 'reorder_date')[:limit]
+        ),
+        suffix=today.isoformat(),
+    )
+
+
+def dashboard_stats(user):
+    """Сводная статистика для карточек дашборда"""
+    user_stats = user_task_stats(user)
+    common_stats = global_stats()
+    return {
+        'total_reagents': common_stats['total_reagents'],
+        'total_tasks': user_stats['total_tasks'],
+        'active_cultures': common_stats['active_cultures'],
+        'pending_tasks': user_stats['pending_tasks'],
+    }
+
+
+def movements_stats():
+    """Количество движений реагентов по типам"""
+    return stats.movements_by_type(global_stats())
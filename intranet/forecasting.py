@@ -0,0 +1,395 @@
+"""
+Прогноз расхода реагентов и даты окончания остатка
+
+История расхода всех реагентов загружается одним сгруппированным запросом
+(суммы 'out' по реагенту и дню) и раскладывается в матрицу NumPy
+[реагент x день]. Скользящие средние, прогнозный расход и даты окончания
+остатка считаются векторно для всего каталога сразу.
+
+Результат сохраняется в таблицу ReagentForecast командой forecast_reagents
+(запускается по расписанию, например из cron), API и дашборд читают
+готовые значения.
+
+По той же матрице рассчитывается рекомендуемый минимальный порог
+(страховой запас) - команда recommend_thresholds - и вероятность
+окончания остатка методом Монте-Карло - команда stockout_risk и
+/api/reagents/stockout-risk/.
+"""
+
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from statistics import NormalDist
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from . import dashboard_cache
+from .models import Reagent, ReagentMovement, ReagentForecast
+
+
+# Глубина истории расхода, дней (включая текущий день)
+HISTORY_DAYS = 90
+
+# Окна скользящего среднего и вес короткого окна в прогнозном расходе
+SHORT_WINDOW = 7
+LONG_WINDOW = 30
+SHORT_WINDOW_WEIGHT = 0.5
+
+# Даты дальше горизонта не сохраняются (остатка хватит «надолго»)
+MAX_HORIZON_DAYS = 3650
+
+
+# ============================================================================
+# ЗАГРУЗКА ДАННЫХ
+# ============================================================================
+
+def load_catalog():
+    """
+    Остатки всех реагентов (один запрос)
+    Возвращает (ids, on_hand, min_threshold) - массивы, упорядоченные по id
+    """
+    rows = list(Reagent.objects.order_by('pk').values_list('pk', 'on_hand', 'min_threshold'))
+    ids = np.array([row[0] for row in rows], dtype=np.int64)
+    on_hand = np.array([float(row[1]) for row in rows], dtype=np.float64)
+    min_threshold = np.array([float(row[2]) for row in rows], dtype=np.float64)
+    return ids, on_hand, min_threshold
+
+
+def consumption_matrix(reagent_ids, days=HISTORY_DAYS, today=None):
+    """
+    Суточный расход реагентов: матрица [len(reagent_ids) x days]
+
+    Последний столбец - текущий день. reagent_ids - упорядоченный массив id
+    (см. load_catalog). Движения загружаются одним запросом, суммы по дням
+    считаются в базе данных.
+    """
+    today = today or timezone.localdate()
+    start = today - timedelta(days=days - 1)
+    matrix = np.zeros((len(reagent_ids), days), dtype=np.float64)
+    if not len(reagent_ids):
+        return matrix
+
+    rows = list(
+        ReagentMovement.objects.filter(
+            movement_type='out',
+            date__gte=timezone.make_aware(datetime.combine(start, time.min)),
+        ).order_by().annotate(
+            day=TruncDate('date')
+        ).values('reagent_id', 'day').annotate(
+            total=Sum('quantity')
+        ).values_list('reagent_id', 'day', 'total')
+    )
+    if not rows:
+        return matrix
+
+    movement_reagents = np.array([row[0] for row in rows], dtype=np.int64)
+    day_index = np.array([(row[1] - start).days for row in rows], dtype=np.int64)
+    totals = np.array([float(row[2]) for row in rows], dtype=np.float64)
+
+    # Позиция реагента в отсортированном массиве id; движения будущих дат
+    # и реагентов, созданных после загрузки каталога, отбрасываются
+    rows_index = np.searchsorted(reagent_ids, movement_reagents)
+    rows_index = np.minimum(rows_index, len(reagent_ids) - 1)
+    known = (reagent_ids[rows_index] == movement_reagents) & (day_index < days)
+    np.add.at(matrix, (rows_index[known], day_index[known]), totals[known])
+    return matrix
+
+
+# ============================================================================
+# РАСЧЁТ ПРОГНОЗА
+# ============================================================================
+
+def rolling_rates(matrix, window):
+    """Средний суточный расход за последние window дней (по каждой строке)"""
+    window = min(window, matrix.shape[1])
+    if not window:
+        return np.zeros(matrix.shape[0])
+    return matrix[:, -window:].sum(axis=1) / window
+
+
+def days_until(level, rate):
+    """
+    Через сколько дней остаток level израсходуется при расходе rate в день
+    При нулевом расходе - бесконечность, при level <= 0 - ноль
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        days = np.where(rate > 0, np.maximum(level, 0) / rate, np.inf)
+    return np.where(level <= 0, 0.0, days)
+
+
+def _offset_dates(today, days):
+    """Даты today + floor(days); None для дней за горизонтом прогноза"""
+    finite = days <= MAX_HORIZON_DAYS
+    offsets = np.floor(np.where(finite, days, 0)).astype('timedelta64[D]')
+    dates = (np.datetime64(today, 'D') + offsets).tolist()
+    return [date if ok else None for date, ok in zip(dates, finite.tolist())]
+
+
+def compute_forecasts(today=None):
+    """
+    Прогноз для всего каталога
+
+    Возвращает список словарей:
+    {'reagent_id', 'daily_rate_7d', 'daily_rate_30d', 'daily_rate',
+     'days_left', 'stockout_date', 'reorder_date'}
+    """
+    today = today or timezone.localdate()
+    ids, on_hand, min_threshold = load_catalog()
+    matrix = consumption_matrix(ids, today=today)
+
+    short_rate = rolling_rates(matrix, SHORT_WINDOW)
+    long_rate = rolling_rates(matrix, LONG_WINDOW)
+    rate = SHORT_WINDOW_WEIGHT * short_rate + (1 - SHORT_WINDOW_WEIGHT) * long_rate
+
+    days_left = days_until(on_hand, rate)
+    stockout_dates = _offset_dates(today, days_left)
+    reorder_dates = _offset_dates(today, days_until(on_hand - min_threshold, rate))
+
+    return [
+        {
+            'reagent_id': int(ids[i]),
+            'daily_rate_7d': _decimal(short_rate[i], 4),
+            'daily_rate_30d': _decimal(long_rate[i], 4),
+            'daily_rate': _decimal(rate[i], 4),
+            'days_left': _decimal(days_left[i], 1) if stockout_dates[i] else None,
+            'stockout_date': stockout_dates[i],
+            'reorder_date': reorder_dates[i],
+        }
+        for i in range(len(ids))
+    ]
+
+
+def _decimal(value, places):
+    return Decimal(str(round(float(value), places)))
+
+
+def refresh_forecasts(today=None):
+    """
+    Пересчитывает таблицу ReagentForecast целиком
+    Возвращает количество сохранённых прогнозов
+    """
+    computed_at = timezone.now()
+    forecasts = [
+        ReagentForecast(computed_at=computed_at, **values)
+        for values in compute_forecasts(today)
+    ]
+    with transaction.atomic():
+        ReagentForecast.objects.all().delete()
+        ReagentForecast.objects.bulk_create(forecasts, batch_size=1000)
+        transaction.on_commit(lambda: dashboard_cache.invalidate(dashboard_cache.GROUP_FORECASTS))
+    return len(forecasts)
+
+
+# ============================================================================
+# СТРАХОВОЙ ЗАПАС И РЕКОМЕНДУЕМЫЙ ПОРОГ
+# ============================================================================
+
+SAFETY_STOCK_DEFAULTS = {
+    'LEAD_TIME_DAYS': 14,
+    'SERVICE_LEVEL': 0.95,
+    'HISTORY_DAYS': HISTORY_DAYS,
+}
+
+
+def safety_stock_settings(**overrides):
+    """
+    Параметры расчёта страхового запаса: значения по умолчанию,
+    settings.SAFETY_STOCK и явно переданные (не None) значения
+    """
+    config = dict(SAFETY_STOCK_DEFAULTS)
+    config.update(getattr(settings, 'SAFETY_STOCK', {}))
+    config.update({key: value for key, value in overrides.items() if value is not None})
+
+    if config['LEAD_TIME_DAYS'] <= 0:
+        raise ValueError('Срок поставки должен быть больше нуля')
+    if not 0 < config['SERVICE_LEVEL'] < 1:
+        raise ValueError('Уровень сервиса должен быть в интервале (0, 1)')
+    if config['HISTORY_DAYS'] < 2:
+        raise ValueError('Глубина истории должна быть не меньше 2 дней')
+    return config
+
+
+def recommend_thresholds(lead_time_days=None, service_level=None, history_days=None, today=None):
+    """
+    Рекомендуемый минимальный порог для всего каталога
+
+    Порог - точка заказа: средний расход за срок поставки плюс страховой
+    запас z * sigma * sqrt(L), где sigma - стандартное отклонение суточного
+    расхода, z - квантиль нормального распределения для уровня сервиса.
+
+    Возвращает (ids, thresholds); для реагентов без расхода за период - NaN
+    """
+    config = safety_stock_settings(
+        LEAD_TIME_DAYS=lead_time_days,
+        SERVICE_LEVEL=service_level,
+        HISTORY_DAYS=history_days,
+    )
+    lead_time = config['LEAD_TIME_DAYS']
+    z = NormalDist().inv_cdf(config['SERVICE_LEVEL'])
+
+    ids, _, _ = load_catalog()
+    matrix = consumption_matrix(ids, days=config['HISTORY_DAYS'], today=today)
+
+    mean = matrix.mean(axis=1)
+    sigma = matrix.std(axis=1, ddof=1)
+    thresholds = mean * lead_time + z * sigma * math.sqrt(lead_time)
+
+    # Округление вверх до сотых; без истории расхода рекомендации нет
+    thresholds = np.ceil(np.round(thresholds * 100, 6)) / 100
+    thresholds[~matrix.any(axis=1)] = np.nan
+    return ids, thresholds
+
+
+def refresh_recommended_thresholds(batch_size=500, **options):
+    """
+    Сохраняет рекомендуемые пороги в Reagent.recommended_threshold
+    (bulk_update пакетами). Текущий min_threshold не меняется - рекомендации
+    применяются вручную из админки.
+    Возвращает количество реагентов с рекомендацией
+    """
+    ids, thresholds = recommend_thresholds(**options)
+    recommended_at = timezone.now()
+    reagents = [
+        Reagent(
+            pk=int(pk),
+            recommended_threshold=None if math.isnan(value) else _decimal(value, 2),
+            recommended_at=recommended_at,
+        )
+        for pk, value in zip(ids.tolist(), thresholds.tolist())
+    ]
+    with transaction.atomic():
+        Reagent.objects.bulk_update(
+            reagents, ['recommended_threshold', 'recommended_at'], batch_size=batch_size
+        )
+        # bulk_update не отправляет сигналы, а рекомендации выводятся в API реагентов
+        transaction.on_commit(lambda: dashboard_cache.invalidate(dashboard_cache.GROUP_REAGENTS))
+    return int(np.count_nonzero(~np.isnan(thresholds)))
+
+
+# ============================================================================
+# ВЕРОЯТНОСТЬ ОКОНЧАНИЯ ОСТАТКА (МОНТЕ-КАРЛО)
+# ============================================================================
+
+# Количество испытаний и горизонт по умолчанию
+RISK_TRIALS = 1000
+RISK_HORIZON_DAYS = 30
+
+# Варианты, доступные в API: расчёт идёт внутри запроса, поэтому объём
+# ограничен (не больше 2000 x 90 выборок на реагент), а число вариантов
+# ключей кеша конечно. Большие расчёты - только командой stockout_risk
+RISK_PRESET_DAYS = (7, 14, 30, 60, 90)
+RISK_PRESET_TRIALS = (500, 1000, 2000)
+
+# Ограничение размера массива выборок одного пакета реагентов
+# (реагенты x испытания x дни), ~32 МБ для float64
+RISK_CHUNK_ELEMENTS = 4_000_000
+
+# Начиная с этого размера каталога пакеты считаются в пуле процессов
+RISK_PARALLEL_MIN_REAGENTS = 2000
+
+# Результат кешируется до появления новых движений или изменения
+# остатков (поколения групп dashboard_cache), но не дольше суток
+RISK_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def simulate_chunk(matrix, on_hand, trials, horizon_days, seed):
+    """
+    Вероятность окончания остатка для пакета реагентов
+
+    Для каждого реагента trials раз выбирается horizon_days случайных дней
+    его истории (с возвращением); остаток заканчивается, если суммарный
+    расход за горизонт не меньше on_hand. Функция не обращается к базе
+    данных, поэтому может выполняться в отдельном процессе.
+    """
+    rng = np.random.default_rng(seed)
+    rows, history = matrix.shape
+    days = rng.integers(0, history, size=(rows, trials, horizon_days))
+    totals = matrix[np.arange(rows)[:, None, None], days].sum(axis=2)
+    return (totals >= on_hand[:, None]).mean(axis=1)
+
+
+def simulate_stockout_risk(matrix, on_hand, trials=RISK_TRIALS, horizon_days=RISK_HORIZON_DAYS,
+                           seed=None, workers=None):
+    """
+    Вероятности окончания остатка для всех строк матрицы расхода
+
+    Каталог делится на пакеты ограниченного размера; для больших каталогов
+    пакеты считаются параллельно в ProcessPoolExecutor (workers процессов,
+    по умолчанию - по числу ядер; workers=1 - без пула)
+    """
+    rows = matrix.shape[0]
+    if not rows:
+        return np.zeros(0)
+
+    chunk_rows = max(1, RISK_CHUNK_ELEMENTS // (trials * horizon_days))
+    bounds = [(start, min(start + chunk_rows, rows)) for start in range(0, rows, chunk_rows)]
+    seeds = np.random.SeedSequence(seed).spawn(len(bounds))
+    chunks = [
+        (matrix[start:end], on_hand[start:end], trials, horizon_days, chunk_seed)
+        for (start, end), chunk_seed in zip(bounds, seeds)
+    ]
+
+    workers = workers or os.cpu_count() or 1
+    if workers > 1 and len(chunks) > 1 and rows >= RISK_PARALLEL_MIN_REAGENTS:
+        with ProcessPoolExecutor(max_workers=min(workers, len(chunks))) as executor:
+            results = list(executor.map(simulate_chunk, *zip(*chunks)))
+    else:
+        results = [simulate_chunk(*chunk) for chunk in chunks]
+    return np.concatenate(results)
+
+
+def _risk_cache_key(horizon_days, trials, today):
+    generations = ':'.join(
+        dashboard_cache.get_generation(group)
+        for group in (dashboard_cache.GROUP_MOVEMENTS, dashboard_cache.GROUP_REAGENTS)
+    )
+    return f'forecast:stockout_risk:{today.isoformat()}:{horizon_days}:{trials}:{generations}'
+
+
+def stockout_risk(horizon_days=RISK_HORIZON_DAYS, trials=RISK_TRIALS, seed=None,
+                  workers=None, use_cache=True):
+    """
+    Вероятность окончания остатка каждого реагента в течение horizon_days
+
+    Возвращает словарь:
+    {'horizon_days', 'trials', 'computed_at',
+     'results': [{'reagent_id', 'on_hand', 'probability'}, ...]}
+    Результаты упорядочены по убыванию вероятности
+    """
+    today = timezone.localdate()
+    key = _risk_cache_key(horizon_days, trials, today)
+    if use_cache:
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+    ids, on_hand, _ = load_catalog()
+    matrix = consumption_matrix(ids, today=today)
+    probabilities = simulate_stockout_risk(
+        matrix, on_hand, trials=trials, horizon_days=horizon_days, seed=seed, workers=workers
+    )
+
+    order = np.argsort(-probabilities, kind='stable')
+    result = {
+        'horizon_days': horizon_days,
+        'trials': trials,
+        'computed_at': timezone.now(),
+        'results': [
+            {
+                'reagent_id': int(ids[i]),
+                'on_hand': _decimal(on_hand[i], 2),
+                'probability': round(float(probabilities[i]), 4),
+            }
+            for i in order.tolist()
+        ],
+    }
+    cache.set(key, result, RISK_CACHE_TIMEOUT)
+    return result
@@ -5,6 +5,7 @@
 
 from django import forms
 from django.contrib.auth.forms import UserCreationForm, AuthenticationForm
+from django.urls import reverse_lazy
 from django.utils import timezone
 from .models import (
     User, Reagent, ReagentMovement, Recipe, RecipeReagent,
@@ -76,6 +77,13 @@ class UserRegisterForm(UserCreationForm):
 # ФОРМЫ РЕАГЕНТОВ
 # ============================================================================
 
+# Атрибуты выпадающего списка реагентов с автодополнением (см. main.js)
+REAGENT_AUTOCOMPLETE_ATTRS = {
+    'class': 'form-select',
+    'data-autocomplete-url': reverse_lazy('reagent-autocomplete'),
+}
+
+
 class ReagentForm(forms.ModelForm):
     """
     Форма для создания/редактирования реагента
@@ -85,7 +93,7 @@ class ReagentForm(forms.ModelForm):
     class Meta:
         model = Reagent
         fields = [
-            'name', 'category', 'on_hand', 'min_threshold',
+            'name', 'category', 'on_hand', 'unit', 'density', 'min_threshold',
             'expiry_date', 'image', 'certificate', 'external_link'
         ]
         widgets = {
@@ -98,6 +106,11 @@ class ReagentForm(forms.ModelForm):
                 'class': 'form-control',
                 'step': '0.01'
             }),
+            'unit': forms.Select(attrs={'class': 'form-select'}),
+            'density': forms.NumberInput(attrs={
+                'class': 'form-control',
+                'step': '0.0001'
+            }),
             'min_threshold': forms.NumberInput(attrs={
                 'class': 'form-control',
                 'step': '0.01'
@@ -117,6 +130,8 @@ class ReagentForm(forms.ModelForm):
             'name': 'Название',
             'category': 'Категория',
             'on_hand': 'Остаток на складе',
+            'unit': 'Единица учёта',
+            'density': 'Плотность, г/мл',
             'min_threshold': 'Минимальный порог',
             'expiry_date': 'Срок годности',
             'image': 'Изображение',
@@ -124,7 +139,8 @@ class ReagentForm(forms.ModelForm):
             'external_link': 'Внешняя ссылка',
         }
         help_texts = {
-            'on_hand': 'Текущее количество на складе',
+            'on_hand': 'Текущее количество на складе (в единице учёта)',
+            'density': 'Нужна, если в рецептурах реагент указан в единицах массы, а учитывается в объёме (или наоборот)',
             'min_threshold': 'При достижении этого значения реагент считается критичным',
             'expiry_date': 'Дата окончания срока годности',
         }
@@ -168,14 +184,15 @@ class ReagentMovementForm(forms.ModelForm):
     
     class Meta:
         model = ReagentMovement
-        fields = ['reagent', 'quantity', 'movement_type', 'comment']
+        fields = ['reagent', 'quantity', 'movement_type', 'lot', 'comment']
         widgets = {
-            'reagent': forms.Select(attrs={'class': 'form-select'}),
+            'reagent': forms.Select(attrs=REAGENT_AUTOCOMPLETE_ATTRS),
             'quantity': forms.NumberInput(attrs={
                 'class': 'form-control',
                 'step': '0.01'
             }),
             'movement_type': forms.Select(attrs={'class': 'form-select'}),
+            'lot': forms.Select(attrs={'class': 'form-select'}),
             'comment': forms.Textarea(attrs={
                 'class': 'form-control',
                 'rows': 3
@@ -183,6 +200,25 @@ class ReagentMovementForm(forms.ModelForm):
         }
 
 
+class MovementImportForm(forms.Form):
+    """
+    Форма загрузки CSV с движениями реагентов (админка)
+    Формат файла - см. csv_import.py
+    """
+    ENCODING_CHOICES = [
+        ('utf-8-sig', 'UTF-8'),
+        ('cp1251', 'Windows-1251 (Excel)'),
+    ]
+    
+    file = forms.FileField(label='CSV-файл')
+    encoding = forms.ChoiceField(label='Кодировка', choices=ENCODING_CHOICES, initial='utf-8-sig')
+    dry_run = forms.BooleanField(
+        label='Только проверить',
+        required=False,
+        help_text='Проверить строки, ничего не сохраняя'
+    )
+
+
 # ============================================================================
 # ФОРМЫ РЕЦЕПТУР
 # ============================================================================
@@ -227,7 +263,7 @@ class RecipeReagentForm(forms.ModelForm):
         model = RecipeReagent
         fields = ['reagent', 'quantity', 'unit']
         widgets = {
-            'reagent': forms.Select(attrs={'class': 'form-select'}),
+            'reagent': forms.Select(attrs=REAGENT_AUTOCOMPLETE_ATTRS),
             'quantity': forms.NumberInput(attrs={
                 'class': 'form-control',
                 'step': '0.01'
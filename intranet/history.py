@@ -0,0 +1,101 @@
+"""
+Динамика остатка реагента для графиков
+
+Ряд остатков после каждого движения считается в SQL оконной функцией
+(см. inventory.stock_series) и прореживается на сервере методом
+Largest-Triangle-Three-Buckets (LTTB, S. Steinarsson, 2013): ряд делится
+на корзины, из каждой берётся точка, образующая наибольший треугольник с
+точкой, выбранной в предыдущей корзине, и средним следующей. Форма ряда
+(пики, провалы, ступеньки остатков) сохраняется, а размер ответа API не
+зависит от длины истории.
+
+Прореженный ряд кешируется; ключ содержит поколения групп движений и
+реагентов (см. dashboard_cache), поэтому любое движение сбрасывает кеш.
+"""
+
+from datetime import datetime, timezone
+
+import numpy as np
+from django.core.cache import cache
+
+from . import dashboard_cache, inventory
+
+
+DEFAULT_POINTS = 500
+MAX_POINTS = 5000
+HISTORY_TIMEOUT = 60 * 60
+
+
+def lttb(x, y, points):
+    """
+    Индексы точек ряда (x, y), оставляемых при прореживании до points точек
+    Первая и последняя точки сохраняются всегда; короткие ряды не меняются
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    size = len(x)
+    if points >= size or points < 3:
+        return np.arange(size)
+
+    selected = np.empty(points, dtype=int)
+    selected[0] = 0
+    selected[-1] = size - 1
+    every = (size - 2) / (points - 2)
+    previous = 0
+    for bucket in range(points - 2):
+        start = int(bucket * every) + 1
+        end = int((bucket + 1) * every) + 1
+        next_end = min(int((bucket + 2) * every) + 1, size)
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+
+        # Площади треугольников для всех точек корзины сразу
+        areas = np.abs(
+            (x[previous] - avg_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (avg_y - y[previous])
+        )
+        previous = start + int(areas.argmax())
+        selected[bucket + 1] = previous
+    return selected
+
+
+def downsample(series, points):
+    """Прореживает ряд [(x, y), ...] до points точек"""
+    if len(series) <= points:
+        return series
+    x, y = zip(*series)
+    return [series[index] for index in lttb(x, y, points)]
+
+
+def _history_key(reagent, points, since, until):
+    generations = ':'.join(
+        dashboard_cache.get_generation(group)
+        for group in (dashboard_cache.GROUP_MOVEMENTS, dashboard_cache.GROUP_REAGENTS)
+    )
+    period = ':'.join(moment.isoformat() if moment else '' for moment in (since, until))
+    return f'history:{reagent.pk}:{points}:{period}:{generations}'
+
+
+def stock_history(reagent, points=DEFAULT_POINTS, since=None, until=None):
+    """
+    Прореженная динамика остатка реагента
+
+    Возвращает словарь:
+    {'reagent', 'unit', 'total_points',
+     'points': [{'date', 'on_hand'}, ...] - не больше points точек}
+    """
+    key = _history_key(reagent, points, since, until)
+    result = cache.get(key)
+    if result is None:
+        series = inventory.stock_series(reagent, since=since, until=until)
+        result = {
+            'reagent': reagent.pk,
+            'unit': reagent.unit,
+            'total_points': len(series),
+            'points': [
+                {'date': datetime.fromtimestamp(moment, timezone.utc), 'on_hand': round(on_hand, 2)}
+                for moment, on_hand in downsample(series, points)
+            ],
+        }
+        cache.set(key, result, HISTORY_TIMEOUT)
+    return result
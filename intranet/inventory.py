@@ -0,0 +1,791 @@
+"""
+Операции со складскими остатками реагентов
+
+Массовые операции (пакетная загрузка движений и т.п.) не вызывают
+ReagentMovement.save(): строки вставляются через bulk_create, а остатки
+меняются одним UPDATE с F-выражением на каждый затронутый реагент.
+После фиксации транзакции отправляется сигнал stock_changed.
+
+Операции с резервами блокируют строки реагентов (select_for_update)
+всегда в порядке возрастания id - это исключает взаимоблокировки
+между параллельными транзакциями.
+
+Для реагентов с партиями (ReagentLot) расход распределяется по партиям
+в порядке FEFO, а on_hand и expiry_date реагента - сводные значения
+по партиям.
+"""
+
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import (
+    F, Q, Sum, Case, When, Value, Count, Max, Min, OuterRef, Subquery, Exists, Window, Func,
+    DecimalField, FloatField
+)
+from django.db.models.functions import Cast, Coalesce
+from django.db.models.expressions import RowRange
+from django.utils import timezone
+
+from .models import (
+    Reagent, ReagentMovement, ReagentStockSnapshot, ReagentReservation,
+    ReagentLot, ReagentLotAllocation, Stocktake, StocktakeLine, ReagentMovementArchive
+)
+from . import rollups
+from .signals import stock_changed
+
+
+# Направление движения: приход увеличивает остаток, расход - уменьшает
+MOVEMENT_SIGN = {
+    'in': 1,
+    'out': -1,
+}
+
+
+def signed_quantity():
+    """
+    Выражение: количество со знаком (приход +, расход -)
+    для агрегирования движений в SQL
+    """
+    return Case(
+        When(movement_type='in', then=F('quantity')),
+        When(movement_type='out', then=-F('quantity')),
+        default=0,
+        output_field=DecimalField(max_digits=12, decimal_places=2),
+    )
+
+
+class Epoch(Func):
+    """
+    Момент времени в секундах Unix (float) средствами СУБД -
+    для длинных рядов, где преобразование каждой строки в datetime
+    в Python обходится дороже самого запроса
+    """
+    template = 'EXTRACT(EPOCH FROM %(expressions)s)::double precision'
+    output_field = FloatField()
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return self.as_sql(
+            compiler, connection,
+            template='((julianday(%(expressions)s) - 2440587.5) * 86400.0)',
+            **extra_context
+        )
+
+    def as_mysql(self, compiler, connection, **extra_context):
+        return self.as_sql(
+            compiler, connection, template='UNIX_TIMESTAMP(%(expressions)s)', **extra_context
+        )
+
+
+def net_movement(movements):
+    """Сумма движений со знаком по QuerySet движений (один запрос)"""
+    return movements.aggregate(
+        total=Coalesce(Sum(signed_quantity()), Decimal('0'),
+                       output_field=DecimalField(max_digits=12, decimal_places=2)),
+        count=Count('id'),
+    )
+
+
+def stock_deltas(movements):
+    """
+    Суммарное изменение остатка по реагентам: {reagent_id: Decimal}
+    """
+    deltas = defaultdict(Decimal)
+    for movement in movements:
+        deltas[movement.reagent_id] += MOVEMENT_SIGN[movement.movement_type] * movement.quantity
+    return dict(deltas)
+
+
+def apply_stock_deltas(deltas, batch_size=500):
+    """
+    Применяет изменения остатков: один UPDATE с CASE на пакет реагентов
+    Нулевые изменения пропускаются. SQL собирается вручную - компиляция
+    CASE из сотен When(pk=...) в ORM дороже самого запроса
+    """
+    deltas = [(reagent_id, delta) for reagent_id, delta in deltas.items() if delta]
+    if not deltas:
+        return
+    quote = connection.ops.quote_name
+    table, on_hand = quote(Reagent._meta.db_table), quote('on_hand')
+    pk = quote(Reagent._meta.pk.column)
+    with connection.cursor() as cursor:
+        for start in range(0, len(deltas), batch_size):
+            batch = deltas[start:start + batch_size]
+            cursor.execute(
+                f'UPDATE {table} SET {on_hand} = {on_hand} + CASE {pk} '
+                f'{" ".join(["WHEN %s THEN %s"] * len(batch))} ELSE 0 END '
+                f'WHERE {pk} IN ({", ".join(["%s"] * len(batch))})',
+                [param for item in batch for param in item] + [reagent_id for reagent_id, _ in batch],
+            )
+
+
+def notify_stock_changed(reagent_ids):
+    """Отправляет stock_changed после фиксации текущей транзакции"""
+    reagent_ids = sorted(set(reagent_ids))
+    if reagent_ids:
+        transaction.on_commit(
+            lambda: stock_changed.send(sender=ReagentMovement, reagent_ids=reagent_ids)
+        )
+
+
+def register_movements(movements):
+    """
+    Проводит сохранённые движения по партиям (FEFO) и месячным итогам,
+    удаляет снимки остатков, не учитывающие движения задним числом
+    Вызывается всеми путями создания движений
+    """
+    allocate_lots(movements)
+    rollups.add_movements(movements)
+    discard_stale_snapshots(movements)
+
+
+def create_movements(movements, batch_size=1000):
+    """
+    Сохраняет несохранённые ReagentMovement одной транзакцией:
+    bulk_create и агрегированное обновление остатков
+
+    Возвращает список созданных движений (с id)
+    """
+    if not movements:
+        return []
+
+    with transaction.atomic():
+        created = ReagentMovement.objects.bulk_create(movements, batch_size=batch_size)
+        deltas = stock_deltas(created)
+        apply_stock_deltas(deltas)
+        register_movements(created)
+        notify_stock_changed(deltas.keys())
+
+    return created
+
+
+# ============================================================================
+# ПАРТИИ (FEFO)
+# ============================================================================
+
+def allocate_lots(movements):
+    """
+    Проводит сохранённые движения по партиям реагентов
+
+    - приход с указанной партией увеличивает её остаток;
+    - расход с указанной партией списывается с неё, без партии -
+      распределяется по партиям с остатком в порядке FEFO (партии всех
+      реагентов читаются одним запросом с блокировкой). Если остатка партий
+      не хватает, непокрытая часть списывается с последней партии
+      (её остаток уходит в минус, как и on_hand реагента).
+
+    Списания сохраняются в ReagentLotAllocation, остатки партий меняются
+    одним UPDATE, затем обновляется сводный срок годности реагентов.
+    Реагенты без партий пропускаются.
+    """
+    lot_deltas = defaultdict(Decimal)
+    allocations = []
+    fefo_movements = defaultdict(list)
+
+    for movement in movements:
+        if movement.lot_id:
+            sign = MOVEMENT_SIGN[movement.movement_type]
+            lot_deltas[movement.lot_id] += sign * movement.quantity
+            if movement.movement_type == 'out':
+                allocations.append(ReagentLotAllocation(
+                    movement=movement, lot_id=movement.lot_id, quantity=movement.quantity
+                ))
+        elif movement.movement_type == 'out':
+            fefo_movements[movement.reagent_id].append(movement)
+
+    # Партии всех реагентов - одним запросом, по реагенту в порядке FEFO
+    lots_by_reagent = defaultdict(list)
+    if fefo_movements:
+        lots = ReagentLot.objects.select_for_update().filter(
+            reagent_id__in=fefo_movements
+        ).order_by('reagent_id', *ReagentLot.FEFO_ORDER).values_list('reagent_id', 'pk', 'on_hand')
+        for reagent_id, lot_id, on_hand in lots:
+            lots_by_reagent[reagent_id].append((lot_id, on_hand))
+
+    for reagent_id, reagent_lots in lots_by_reagent.items():
+        # Расходуются партии с остатком; если таких нет - последняя партия
+        lots = [lot for lot in reagent_lots if lot[1] > 0] or reagent_lots[-1:]
+        position = 0
+        remaining_in_lot = max(lots[0][1], Decimal('0'))
+        for movement in fefo_movements[reagent_id]:
+            need = movement.quantity
+            while need > 0:
+                last_lot = position == len(lots) - 1
+                take = need if last_lot else min(need, remaining_in_lot)
+                if take > 0:
+                    lot_id = lots[position][0]
+                    lot_deltas[lot_id] -= take
+                    allocations.append(ReagentLotAllocation(
+                        movement=movement, lot_id=lot_id, quantity=take
+                    ))
+                    need -= take
+                    remaining_in_lot -= take
+                if need > 0:
+                    position += 1
+                    remaining_in_lot = lots[position][1]
+
+    if not lot_deltas:
+        return
+    ReagentLotAllocation.objects.bulk_create(allocations)
+    ReagentLot.objects.filter(pk__in=lot_deltas).update(
+        on_hand=Case(
+            *[When(pk=pk, then=F('on_hand') + delta) for pk, delta in lot_deltas.items()],
+            default=F('on_hand'),
+        )
+    )
+    refresh_lot_rollups({movement.reagent_id for movement in movements})
+
+
+def refresh_lot_rollups(reagent_ids, include_on_hand=False):
+    """
+    Пересчитывает сводные поля реагентов с партиями одним UPDATE:
+    expiry_date - ближайший срок годности среди партий с остатком;
+    при include_on_hand также on_hand - сумма остатков партий
+    (после ручного изменения партий). Реагенты без партий не меняются.
+    """
+    lots = ReagentLot.objects.filter(reagent=OuterRef('pk')).order_by().values('reagent')
+    updates = {
+        'expiry_date': Subquery(
+            lots.filter(on_hand__gt=0).annotate(nearest=Min('expiry_date')).values('nearest')
+        ),
+    }
+    if include_on_hand:
+        updates['on_hand'] = Subquery(lots.annotate(total=Sum('on_hand')).values('total'))
+
+    Reagent.objects.filter(pk__in=list(reagent_ids)).filter(Exists(lots)).update(**updates)
+
+
+# Номер начальной партии: остаток реагента, учтённый до появления партий
+OPENING_LOT_NUMBER = 'Остаток до учёта партий'
+
+
+def open_lot_balance(lot):
+    """
+    Вызывается при создании партии. Если это первая партия реагента, его
+    остаток, учтённый без партий, переносится в начальную партию (срок
+    годности - прежний срок реагента): иначе расход по FEFO списывал бы
+    этот остаток с новой партии и уводил её в минус.
+    Движение не создаётся - остаток уже учтён в on_hand и журнале.
+    Возвращает начальную партию или None
+    """
+    if ReagentLot.objects.filter(reagent_id=lot.reagent_id).exclude(pk=lot.pk).exists():
+        return None
+    on_hand, expiry_date, created_at = Reagent.objects.filter(pk=lot.reagent_id).values_list(
+        'on_hand', 'expiry_date', 'created_at'
+    ).get()
+    if not on_hand:
+        return None
+    # bulk_create - без сигналов сохранения партии (hold_lot_quantity)
+    opening, = ReagentLot.objects.bulk_create([ReagentLot(
+        reagent_id=lot.reagent_id, lot_number=OPENING_LOT_NUMBER, on_hand=on_hand,
+        expiry_date=expiry_date, received_at=min(created_at, lot.received_at),
+    )])
+    return opening
+
+
+def adjust_lot(lot, on_hand, user=None):
+    """
+    Доводит остаток сохранённой партии до on_hand корректирующим
+    движением (приход или расход с этой партией): остаток реагента,
+    партии и журнал движений меняются вместе.
+    lot.on_hand - учтённый остаток партии. Возвращает движение или None
+    """
+    delta = Decimal(on_hand) - lot.on_hand
+    if not delta:
+        return None
+    movement, = create_movements([ReagentMovement(
+        reagent_id=lot.reagent_id,
+        lot=lot,
+        quantity=abs(delta),
+        movement_type='in' if delta > 0 else 'out',
+        user=user,
+        comment=f'Корректировка партии {lot.lot_number}',
+    )])
+    lot.on_hand = on_hand
+    return movement
+
+
+def delete_lot(lot, user=None):
+    """
+    Удаляет партию, предварительно списав её остаток движением -
+    иначе остаток реагента разошёлся бы с суммой партий
+    """
+    with transaction.atomic():
+        adjust_lot(lot, 0, user=user)
+        lot.delete()
+
+
+# ============================================================================
+# ОСТАТОК НА ДАТУ И СНИМКИ
+# ============================================================================
+
+def _replay(reagent, **period):
+    """Сумма движений реагента за период по рабочей таблице и архиву"""
+    replay = net_movement(ReagentMovement.objects.filter(reagent=reagent, **period))
+    archived = net_movement(ReagentMovementArchive.objects.filter(reagent=reagent, **period))
+    return {
+        'total': replay['total'] + archived['total'],
+        'count': replay['count'] + archived['count'],
+    }
+
+
+def stock_at(reagent, moment):
+    """
+    Остаток реагента на момент moment
+
+    Берётся ближайший по времени снимок - до moment (движения
+    воспроизводятся вперёд) или после него, в т.ч. текущий остаток
+    (движения вычитаются). Объём работы ограничен движениями между
+    снимком и moment и не зависит от длины всей истории.
+
+    Возвращает словарь:
+    {'on_hand', 'source' ('snapshot'|'current'), 'snapshot_taken_at', 'replayed_movements'}
+    """
+    snapshots = ReagentStockSnapshot.objects.filter(reagent=reagent)
+    before = snapshots.filter(taken_at__lte=moment).order_by('-taken_at').first()
+    after = snapshots.filter(taken_at__gt=moment).order_by('taken_at').first()
+
+    now = timezone.now()
+    after_taken_at = after.taken_at if after else max(now, moment)
+    use_before = before is not None and (moment - before.taken_at) <= (after_taken_at - moment)
+
+    if use_before:
+        replay = _replay(reagent, date__gt=before.taken_at, date__lte=moment)
+        on_hand = before.on_hand + replay['total']
+        source, taken_at = 'snapshot', before.taken_at
+    elif after is not None:
+        replay = _replay(reagent, date__gt=moment, date__lte=after.taken_at)
+        on_hand = after.on_hand - replay['total']
+        source, taken_at = 'snapshot', after.taken_at
+    else:
+        # Текущий остаток - это «снимок» на текущий момент
+        replay = _replay(reagent, date__gt=moment)
+        on_hand = reagent.on_hand - replay['total']
+        source, taken_at = 'current', None
+
+    return {
+        'on_hand': on_hand,
+        'source': source,
+        'snapshot_taken_at': taken_at,
+        'replayed_movements': replay['count'],
+    }
+
+
+def stock_series(reagent, since=None, until=None):
+    """
+    Остаток реагента после каждого движения за период:
+    [(время Unix, остаток), ...] - float, для графиков
+
+    Нарастающая сумма движений считается в SQL оконной функцией
+    SUM(...) OVER (ORDER BY date, id ROWS UNBOUNDED PRECEDING) -
+    Python получает готовый ряд.
+    Отсчёт ведётся от остатка на начало периода: текущий остаток минус
+    движения рабочей таблицы начиная с since (без since - все). Архивные
+    движения в ряд не входят и в отсчёте не участвуют - последнее значение
+    ряда без until совпадает с on_hand.
+    """
+    movements = ReagentMovement.objects.filter(reagent=reagent)
+    if since is not None:
+        movements = movements.filter(date__gte=since)
+    later = None
+    if until is not None:
+        # Движения после until в ряд не входят, но уже вошли в on_hand
+        later = net_movement(movements)['total']
+        movements = movements.filter(date__lte=until)
+
+    running = list(movements.order_by('date', 'id').annotate(
+        running=Cast(
+            Window(
+                Sum(signed_quantity()),
+                order_by=[F('date').asc(), F('id').asc()],
+                frame=RowRange(start=None, end=0),
+            ),
+            FloatField()
+        )
+    ).values_list(Epoch('date'), 'running'))
+    if later is None:
+        # Ряд до конца: сумма его движений - последнее значение нарастающей суммы
+        later = running[-1][1] if running else 0
+    start = float(reagent.on_hand) - float(later)
+    return [(moment, start + total) for moment, total in running]
+
+
+def discard_stale_snapshots(movements, batch_size=500):
+    """
+    Удаляет снимки, снятые в момент движения или позже: движение задним
+    числом (дата в пакетной загрузке, CSV, админке) уже вошло в on_hand,
+    но не в эти снимки, и stock_at ошибся бы на его количество.
+    Более ранние снимки верны и остаются. Один запрос кандидатов (с самой
+    ранней даты пакета) на пакет реагентов, отбор - по дате своего реагента
+    """
+    earliest = {}
+    for movement in movements:
+        if movement.reagent_id not in earliest or movement.date < earliest[movement.reagent_id]:
+            earliest[movement.reagent_id] = movement.date
+
+    reagent_ids = sorted(earliest)
+    for start in range(0, len(reagent_ids), batch_size):
+        batch = reagent_ids[start:start + batch_size]
+        candidates = ReagentStockSnapshot.objects.filter(
+            reagent_id__in=batch, taken_at__gte=min(earliest[reagent_id] for reagent_id in batch)
+        ).values_list('pk', 'reagent_id', 'taken_at')
+        stale = [pk for pk, reagent_id, taken_at in candidates if taken_at >= earliest[reagent_id]]
+        if stale:
+            ReagentStockSnapshot.objects.filter(pk__in=stale).delete()
+
+
+def take_snapshots(min_movements=0, reagent_ids=None):
+    """
+    Создаёт снимки остатков (bulk_create)
+
+    min_movements - снимать только реагенты, у которых с последнего снимка
+    накопилось не меньше указанного числа движений (0 - все реагенты)
+    Возвращает количество созданных снимков
+    """
+    taken_at = timezone.now()
+    reagents = Reagent.objects.all()
+    if reagent_ids is not None:
+        reagents = reagents.filter(pk__in=reagent_ids)
+
+    if min_movements:
+        last_snapshot = ReagentStockSnapshot.objects.filter(
+            reagent=OuterRef('pk')
+        ).order_by().values('reagent').annotate(last=Max('taken_at')).values('last')
+        reagents = reagents.annotate(
+            last_snapshot_at=Subquery(last_snapshot)
+        ).annotate(
+            new_movements=Count(
+                'movements',
+                filter=Q(last_snapshot_at__isnull=True) | Q(movements__date__gt=F('last_snapshot_at'))
+            )
+        ).filter(new_movements__gte=min_movements)
+
+    with transaction.atomic():
+        snapshots = [
+            ReagentStockSnapshot(reagent_id=pk, on_hand=on_hand, taken_at=taken_at)
+            for pk, on_hand in reagents.values_list('pk', 'on_hand')
+        ]
+        ReagentStockSnapshot.objects.bulk_create(snapshots, batch_size=1000)
+    return len(snapshots)
+
+
+# ============================================================================
+# СВЕРКА ОСТАТКОВ С ЖУРНАЛОМ ДВИЖЕНИЙ
+# ============================================================================
+
+def ledger_totals(reagent_ids=None):
+    """
+    Ожидаемые остатки по журналу движений: {reagent_id: Decimal}
+    Один запрос: сгруппированные суммы по ReagentMovement и архиву (UNION ALL)
+    """
+    grouped = []
+    for model in (ReagentMovement, ReagentMovementArchive):
+        movements = model.objects.all()
+        if reagent_ids is not None:
+            movements = movements.filter(reagent_id__in=reagent_ids)
+        grouped.append(
+            movements.order_by().values('reagent').annotate(
+                total=Sum(signed_quantity())
+            ).values_list('reagent', 'total')
+        )
+
+    totals = defaultdict(Decimal)
+    for reagent_id, total in grouped[0].union(grouped[1], all=True):
+        totals[reagent_id] += total
+    return dict(totals)
+
+
+def find_stock_drift(reagent_ids=None, tolerance=Decimal('0')):
+    """
+    Сравнивает on_hand с журналом движений
+    Возвращает список расхождений, больших tolerance:
+    [{'reagent_id', 'name', 'on_hand', 'expected', 'drift'}, ...]
+    """
+    expected = ledger_totals(reagent_ids)
+    reagents = Reagent.objects.order_by('pk')
+    if reagent_ids is not None:
+        reagents = reagents.filter(pk__in=reagent_ids)
+
+    drifts = []
+    for pk, name, on_hand in reagents.values_list('pk', 'name', 'on_hand').iterator():
+        total = expected.get(pk, Decimal('0'))
+        if abs(on_hand - total) > tolerance:
+            drifts.append({
+                'reagent_id': pk,
+                'name': name,
+                'on_hand': on_hand,
+                'expected': total,
+                'drift': on_hand - total,
+            })
+    return drifts
+
+
+def repair_stock_drift(drifts, batch_size=500):
+    """
+    Приводит on_hand к значениям журнала пакетами: один UPDATE с CASE
+    на пакет. Корректируется на величину расхождения (F('on_hand') - drift),
+    поэтому движения, проведённые после сверки, не теряются.
+    Возвращает количество исправленных реагентов
+    """
+    repaired = 0
+    for start in range(0, len(drifts), batch_size):
+        batch = drifts[start:start + batch_size]
+        with transaction.atomic():
+            repaired += Reagent.objects.filter(
+                pk__in=[item['reagent_id'] for item in batch]
+            ).update(on_hand=Case(
+                *[When(pk=item['reagent_id'], then=F('on_hand') - item['drift']) for item in batch],
+                default=F('on_hand'),
+            ))
+            notify_stock_changed(item['reagent_id'] for item in batch)
+    return repaired
+
+
+# ============================================================================
+# РЕЗЕРВИРОВАНИЕ
+# ============================================================================
+
+class InsufficientStockError(Exception):
+    """
+    Доступного остатка не хватает для резерва
+    shortages - [{'reagent_id', 'name', 'requested', 'available'}, ...]
+    """
+
+    def __init__(self, shortages):
+        self.shortages = shortages
+        names = ', '.join(item['name'] for item in shortages)
+        super().__init__(f'Недостаточно доступного остатка: {names}')
+
+
+def lock_reagents(reagent_ids):
+    """
+    Блокирует строки реагентов до конца транзакции (SELECT ... FOR UPDATE)
+    в порядке возрастания id. Возвращает {id: Reagent}
+    """
+    reagents = Reagent.objects.select_for_update().filter(
+        pk__in=set(reagent_ids)
+    ).order_by('pk')
+    return {reagent.pk: reagent for reagent in reagents}
+
+
+def _delta_case(field, deltas):
+    """Выражение field + CASE(delta для каждого реагента из deltas)"""
+    return F(field) + Case(
+        *[When(pk=pk, then=Value(delta)) for pk, delta in deltas.items()],
+        default=Value(Decimal('0')),
+        output_field=DecimalField(max_digits=12, decimal_places=2),
+    )
+
+
+def reserve(items, recipe=None, task=None, user=None, comment=''):
+    """
+    Резервирует реагенты: items - [(reagent_id, quantity), ...]
+
+    Всё или ничего: если доступного остатка (on_hand - reserved) хватает
+    не для всех позиций, резервы не создаются и выбрасывается
+    InsufficientStockError. Reagent.reserved увеличивается одним UPDATE.
+    Возвращает список созданных ReagentReservation
+    """
+    requested = defaultdict(Decimal)
+    for reagent_id, quantity in items:
+        requested[reagent_id] += Decimal(quantity)
+
+    with transaction.atomic():
+        reagents = lock_reagents(requested)
+        unknown = set(requested) - set(reagents)
+        if unknown:
+            raise Reagent.DoesNotExist(f'Реагенты не найдены: {sorted(unknown)}')
+
+        shortages = [
+            {
+                'reagent_id': pk,
+                'name': reagents[pk].name,
+                'requested': quantity,
+                'available': reagents[pk].available,
+            }
+            for pk, quantity in sorted(requested.items())
+            if quantity > reagents[pk].available
+        ]
+        if shortages:
+            raise InsufficientStockError(shortages)
+
+        reservations = ReagentReservation.objects.bulk_create([
+            ReagentReservation(
+                reagent_id=reagent_id, quantity=quantity, recipe=recipe,
+                task=task, user=user, comment=comment
+            )
+            for reagent_id, quantity in items
+        ])
+        Reagent.objects.filter(pk__in=requested).update(
+            reserved=_delta_case('reserved', requested)
+        )
+        notify_stock_changed(requested.keys())
+    return reservations
+
+
+def _close_reservations(reservation_ids, status):
+    """
+    Блокирует реагенты и активные резервы из списка
+    Возвращает резервы, которые ещё активны (остальные пропускаются)
+    """
+    reagent_ids = ReagentReservation.objects.filter(
+        pk__in=reservation_ids, status='active'
+    ).values_list('reagent_id', flat=True)
+    lock_reagents(list(reagent_ids))
+    reservations = list(
+        ReagentReservation.objects.select_for_update().filter(
+            pk__in=reservation_ids, status='active'
+        ).order_by('pk')
+    )
+    closed_at = timezone.now()
+    for reservation in reservations:
+        reservation.status = status
+        reservation.closed_at = closed_at
+    return reservations
+
+
+def consume_reservations(reservation_ids, user=None):
+    """
+    Расходует активные резервы: создаёт движения 'out' (bulk_create),
+    уменьшает on_hand и reserved одним UPDATE, списывает партии по FEFO
+    Возвращает список израсходованных резервов
+    """
+    with transaction.atomic():
+        reservations = _close_reservations(reservation_ids, 'consumed')
+        if not reservations:
+            return []
+
+        movements = ReagentMovement.objects.bulk_create([
+            ReagentMovement(
+                reagent_id=reservation.reagent_id,
+                quantity=reservation.quantity,
+                movement_type='out',
+                user=user or reservation.user,
+                comment=f'Расход по резерву #{reservation.pk}',
+            )
+            for reservation in reservations
+        ])
+        for reservation, movement in zip(reservations, movements):
+            reservation.movement = movement
+        ReagentReservation.objects.bulk_update(reservations, ['status', 'closed_at', 'movement'])
+
+        released = defaultdict(Decimal)
+        for reservation in reservations:
+            released[reservation.reagent_id] -= reservation.quantity
+        Reagent.objects.filter(pk__in=released).update(
+            on_hand=_delta_case('on_hand', released),
+            reserved=_delta_case('reserved', released),
+        )
+        register_movements(movements)
+        notify_stock_changed(released.keys())
+    return reservations
+
+
+def cancel_reservations(reservation_ids):
+    """
+    Отменяет активные резервы и освобождает reserved
+    Возвращает список отменённых резервов
+    """
+    with transaction.atomic():
+        reservations = _close_reservations(reservation_ids, 'cancelled')
+        if not reservations:
+            return []
+
+        ReagentReservation.objects.bulk_update(reservations, ['status', 'closed_at'])
+        released = defaultdict(Decimal)
+        for reservation in reservations:
+            released[reservation.reagent_id] -= reservation.quantity
+        Reagent.objects.filter(pk__in=released).update(
+            reserved=_delta_case('reserved', released)
+        )
+        notify_stock_changed(released.keys())
+    return reservations
+
+
+# ============================================================================
+# ИНВЕНТАРИЗАЦИЯ
+# ============================================================================
+
+class StocktakeError(Exception):
+    """Строки пересчёта не соответствуют партиям реагентов"""
+
+
+def apply_stocktake(counts, user=None, comment='', dry_run=False):
+    """
+    Инвентаризация: counts - [(reagent_id, lot_id, фактический остаток), ...]
+
+    Реагенты с партиями пересчитываются по партиям: в строке указывается
+    партия (lot_id), расхождение проводится движением с этой партией.
+    Партии, не вошедшие в пересчёт, не меняются. У реагентов без партий
+    lot_id - None.
+
+    Учётные остатки реагентов и партий читаются и блокируются двумя
+    запросами, на каждое расхождение создаётся корректирующее движение
+    (приход или расход) через bulk_create, on_hand всех реагентов
+    обновляется одним UPDATE. Пересчёт и строки инвентаризации
+    сохраняются в Stocktake/StocktakeLine.
+
+    dry_run - только рассчитать расхождения, ничего не сохраняя.
+    Неизвестные реагенты - Reagent.DoesNotExist, строка без партии у реагента
+    с партиями или чужая партия - StocktakeError; ничего не сохраняется.
+    Возвращает (Stocktake, [StocktakeLine, ...])
+    """
+    counted = {(reagent_id, lot_id): Decimal(quantity) for reagent_id, lot_id, quantity in counts}
+    reagent_ids = {reagent_id for reagent_id, _ in counted}
+
+    with transaction.atomic():
+        reagents = Reagent.objects.select_for_update().filter(
+            pk__in=reagent_ids
+        ).only('pk', 'name', 'unit', 'on_hand').order_by('pk')
+        reagents = {reagent.pk: reagent for reagent in reagents}
+        unknown = reagent_ids - set(reagents)
+        if unknown:
+            raise Reagent.DoesNotExist(f'Реагенты не найдены: {sorted(unknown)}')
+
+        lots = ReagentLot.objects.select_for_update().filter(
+            reagent_id__in=reagent_ids
+        ).only('pk', 'reagent_id', 'lot_number', 'on_hand').order_by('pk')
+        lots = {lot.pk: lot for lot in lots}
+        lot_tracked = {lot.reagent_id for lot in lots.values()}
+        for reagent_id, lot_id in counted:
+            if lot_id is None and reagent_id in lot_tracked:
+                raise StocktakeError(f'У реагента {reagent_id} есть партии: пересчёт указывается по партиям')
+            if lot_id is not None and (lot_id not in lots or lots[lot_id].reagent_id != reagent_id):
+                raise StocktakeError(f'Партия {lot_id} не найдена у реагента {reagent_id}')
+
+        stocktake = Stocktake(user=user, comment=comment, reagents_counted=len(reagents))
+        lines = []
+        for (reagent_id, lot_id), quantity in sorted(counted.items(), key=lambda item: (item[0][0], item[0][1] or 0)):
+            lot = lots.get(lot_id)
+            expected = lot.on_hand if lot is not None else reagents[reagent_id].on_hand
+            lines.append(StocktakeLine(
+                stocktake=stocktake, reagent=reagents[reagent_id], lot=lot,
+                expected=expected, counted=quantity, difference=quantity - expected,
+            ))
+        adjusted = [line for line in lines if line.difference]
+        stocktake.discrepancies = len(adjusted)
+        if dry_run:
+            return stocktake, lines
+
+        stocktake.save()
+        movements = ReagentMovement.objects.bulk_create([
+            ReagentMovement(
+                reagent_id=line.reagent_id,
+                lot=line.lot,
+                quantity=abs(line.difference),
+                movement_type='in' if line.difference > 0 else 'out',
+                user=user,
+                comment=f'Инвентаризация #{stocktake.pk}',
+            )
+            for line in adjusted
+        ])
+        for line, movement in zip(adjusted, movements):
+            line.movement = movement
+        StocktakeLine.objects.bulk_create(lines)
+
+        deltas = stock_deltas(movements)
+        if deltas:
+            Reagent.objects.filter(pk__in=deltas).update(on_hand=_delta_case('on_hand', deltas))
+            register_movements(movements)
+            notify_stock_changed(deltas.keys())
+    return stocktake, lines
@@ -0,0 +1,43 @@
+"""
+Перенос старых движений реагентов в архив
+
+Использование:
+    python manage.py archive_movements                 # старше 24 месяцев
+    python manage.py archive_movements --months 12
+    python manage.py archive_movements --dry-run       # только посчитать
+
+Переносятся целые месяцы; месячные итоги (ReagentMovementMonthly)
+не меняются - они уже учитывают архивные движения.
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from intranet import rollups
+from intranet.models import ReagentMovement
+
+
+class Command(BaseCommand):
+    help = 'Переносит движения реагентов старше срока хранения в архив'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months', type=int, default=rollups.RETENTION_MONTHS,
+                            help='Срок хранения в рабочей таблице, месяцев')
+        parser.add_argument('--batch-size', type=int, default=rollups.ARCHIVE_BATCH_SIZE,
+                            help='Движений в одной транзакции')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только показать, сколько движений будет перенесено')
+
+    def handle(self, *args, **options):
+        if options['months'] < 1 or options['batch_size'] < 1:
+            raise CommandError('Срок хранения и размер пакета должны быть больше нуля')
+
+        cutoff = rollups.archive_cutoff(months=options['months'])
+        if options['dry_run']:
+            count = ReagentMovement.objects.filter(date__lt=cutoff).count()
+            self.stdout.write(f'Движений до {cutoff:%d.%m.%Y}: {count}')
+            return
+
+        archived = rollups.archive_movements(cutoff, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Перенесено в архив движений до {cutoff:%d.%m.%Y}: {archived}'
+        ))
@@ -0,0 +1,49 @@
+"""
+Выпуск токена API для сервисной учётной записи (прибор, скрипт)
+
+Использование:
+    python manage.py create_api_token bench-reader --name "Дозатор 3"
+    python manage.py create_api_token importer --name ERP --scopes read,write --days 365
+
+Ключ выводится один раз; в базе хранится только его хеш.
+Запросы: заголовок «Authorization: Token <ключ>»
+"""
+
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from intranet import authentication
+from intranet.models import ApiToken, User
+
+
+class Command(BaseCommand):
+    help = 'Выпускает токен API для пользователя'
+
+    def add_arguments(self, parser):
+        parser.add_argument('username', help='Пользователь - владелец токена')
+        parser.add_argument('--name', required=True, help='Название токена (прибор, скрипт)')
+        parser.add_argument('--scopes', default='read', help='Права через запятую: read, write')
+        parser.add_argument('--days', type=int, help='Срок действия, дней (по умолчанию бессрочно)')
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(username=options['username'], is_active=True).first()
+        if user is None:
+            raise CommandError(f'Активный пользователь {options["username"]} не найден')
+
+        scopes = [scope.strip() for scope in options['scopes'].split(',') if scope.strip()]
+        known = dict(ApiToken.SCOPE_CHOICES)
+        unknown = [scope for scope in scopes if scope not in known]
+        if not scopes or unknown:
+            raise CommandError(f'Неизвестные права: {", ".join(unknown) or "-"} (допустимы: read, write)')
+
+        expires_at = None
+        if options['days'] is not None:
+            if options['days'] <= 0:
+                raise CommandError('Срок действия должен быть больше нуля')
+            expires_at = timezone.now() + timedelta(days=options['days'])
+
+        token, key = authentication.issue_token(user, options['name'], scopes, expires_at)
+        self.stdout.write(self.style.SUCCESS(f'Токен «{token.name}» выпущен для {user.username}'))
+        self.stdout.write(key)
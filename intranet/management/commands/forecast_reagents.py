@@ -0,0 +1,18 @@
+"""
+Пересчёт прогноза расхода реагентов (таблица ReagentForecast)
+
+Запускается планировщиком (cron), например ежедневно ночью:
+    python manage.py forecast_reagents
+"""
+
+from django.core.management.base import BaseCommand
+
+from intranet import forecasting
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает прогноз расхода и даты окончания остатков реагентов'
+
+    def handle(self, *args, **options):
+        count = forecasting.refresh_forecasts()
+        self.stdout.write(self.style.SUCCESS(f'Рассчитано прогнозов: {count}'))
@@ -0,0 +1,84 @@
+"""
+Потоковый импорт движений реагентов из CSV
+
+Использование:
+    python manage.py import_movements export.csv
+    python manage.py import_movements export.csv --user ivanov --rejected rejected.csv
+    python manage.py import_movements export.csv --dry-run    # только проверка
+
+Формат файла - см. intranet/csv_import.py
+"""
+
+import csv
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from intranet import csv_import
+from intranet.models import User
+
+
+class Command(BaseCommand):
+    help = 'Импортирует движения реагентов из CSV-выгрузки'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Путь к CSV-файлу')
+        parser.add_argument('--encoding', default='utf-8-sig',
+                            help='Кодировка файла (для выгрузок Excel - cp1251)')
+        parser.add_argument('--user', help='Пользователь, от имени которого создаются движения')
+        parser.add_argument('--chunk-size', type=int, default=csv_import.CHUNK_SIZE,
+                            help='Строк в одной транзакции')
+        parser.add_argument('--rejected', help='Записать отклонённые строки с ошибками в CSV')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только проверить строки, ничего не сохраняя')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] <= 0:
+            raise CommandError('Размер пакета должен быть больше нуля')
+
+        user = None
+        if options['user']:
+            user = User.objects.filter(username=options['user']).first()
+            if user is None:
+                raise CommandError(f'Пользователь {options["user"]} не найден')
+
+        rejected_file = None
+        on_reject = None
+        if options['rejected']:
+            rejected_file = open(options['rejected'], 'w', newline='', encoding='utf-8')
+            writer = csv.writer(rejected_file)
+            writer.writerow(['line', 'errors', 'row'])
+
+            def on_reject(line, row, errors):
+                writer.writerow([
+                    line,
+                    '; '.join(f'{field}: {message}' for field, message in errors.items()),
+                    ','.join(row.values()),
+                ])
+
+        started = time.monotonic()
+        try:
+            with open(options['path'], newline='', encoding=options['encoding']) as stream:
+                result = csv_import.import_movements(
+                    stream,
+                    user=user,
+                    chunk_size=options['chunk_size'],
+                    dry_run=options['dry_run'],
+                    on_reject=on_reject,
+                )
+        except (OSError, UnicodeDecodeError, csv.Error, csv_import.CSVImportError) as error:
+            raise CommandError(str(error))
+        finally:
+            if rejected_file is not None:
+                rejected_file.close()
+        elapsed = time.monotonic() - started
+
+        for error in result['errors'][:20]:
+            self.stdout.write(self.style.WARNING(f"Строка {error['line']}: {error['errors']}"))
+
+        action = 'проверено' if options['dry_run'] else 'создано'
+        self.stdout.write(self.style.SUCCESS(
+            f"Строк: {result['rows']}, {action} движений: {result['created']}, "
+            f"отклонено: {result['rejected']}, пакетов: {result['chunks']}, "
+            f"{result['rows'] / max(elapsed, 1e-6):.0f} строк/с"
+        ))
@@ -0,0 +1,21 @@
+"""
+Пересчёт месячных итогов движений реагентов
+
+Итоги ведутся инкрементально; команда пересчитывает их заново по рабочей
+таблице и архиву (например, после загрузки движений через loaddata)
+
+Использование:
+    python manage.py rebuild_movement_rollup
+"""
+
+from django.core.management.base import BaseCommand
+
+from intranet import rollups
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает месячные итоги движений реагентов'
+
+    def handle(self, *args, **options):
+        rows = rollups.rebuild_rollup()
+        self.stdout.write(self.style.SUCCESS(f'Строк месячных итогов: {rows}'))
@@ -0,0 +1,18 @@
+"""
+Полная перестройка поискового индекса
+
+Использование:
+    python manage.py rebuild_search_index
+"""
+
+from django.core.management.base import BaseCommand
+
+from intranet import search
+
+
+class Command(BaseCommand):
+    help = 'Перестраивает полнотекстовый поисковый индекс'
+
+    def handle(self, *args, **options):
+        count = search.rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f'Проиндексировано объектов: {count}'))
@@ -0,0 +1,35 @@
+"""
+Расчёт рекомендуемых минимальных порогов реагентов (страховой запас)
+
+Запускается планировщиком (cron), например еженедельно:
+    python manage.py recommend_thresholds
+Параметры по умолчанию берутся из settings.SAFETY_STOCK:
+    python manage.py recommend_thresholds --lead-time 21 --service-level 0.99
+
+Рекомендации сохраняются рядом с текущим порогом и применяются
+вручную в админке (действие «Применить рекомендуемые пороги»).
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from intranet import forecasting
+
+
+class Command(BaseCommand):
+    help = 'Рассчитывает рекомендуемые минимальные пороги по статистике расхода'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lead-time', type=float, help='Срок поставки, дней')
+        parser.add_argument('--service-level', type=float, help='Уровень сервиса, например 0.95')
+        parser.add_argument('--history-days', type=int, help='Глубина статистики расхода, дней')
+
+    def handle(self, *args, **options):
+        try:
+            count = forecasting.refresh_recommended_thresholds(
+                lead_time_days=options['lead_time'],
+                service_level=options['service_level'],
+                history_days=options['history_days'],
+            )
+        except ValueError as error:
+            raise CommandError(str(error))
+        self.stdout.write(self.style.SUCCESS(f'Рассчитано рекомендаций: {count}'))
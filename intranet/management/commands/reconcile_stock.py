@@ -0,0 +1,58 @@
+"""
+Сверка остатков реагентов с журналом движений
+
+Использование:
+    python manage.py reconcile_stock            # только отчёт
+    python manage.py reconcile_stock --fix      # отчёт и исправление
+"""
+
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+
+from intranet import inventory
+
+
+class Command(BaseCommand):
+    help = 'Сверяет остатки реагентов с журналом движений'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--fix',
+            action='store_true',
+            help='Исправить остатки по журналу движений',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Количество реагентов в одном UPDATE при исправлении',
+        )
+        parser.add_argument(
+            '--tolerance',
+            type=Decimal,
+            default=Decimal('0'),
+            help='Допустимое расхождение',
+        )
+
+    def handle(self, *args, **options):
+        drifts = inventory.find_stock_drift(tolerance=options['tolerance'])
+
+        for item in drifts:
+            self.stdout.write(
+                f"{item['name']} (id={item['reagent_id']}): "
+                f"остаток {item['on_hand']}, по журналу {item['expected']}, "
+                f"расхождение {item['drift']}"
+            )
+
+        if not drifts:
+            self.stdout.write(self.style.SUCCESS('Расхождений не найдено'))
+            return
+
+        if options['fix']:
+            repaired = inventory.repair_stock_drift(drifts, batch_size=options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f'Исправлено реагентов: {repaired}'))
+        else:
+            self.stdout.write(self.style.WARNING(
+                f'Найдено расхождений: {len(drifts)}. Для исправления запустите с --fix'
+            ))
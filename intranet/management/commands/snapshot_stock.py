@@ -0,0 +1,28 @@
+"""
+Снимки остатков реагентов для восстановления остатка на дату
+
+Запускается планировщиком (cron), например ежедневно:
+    python manage.py snapshot_stock
+или чаще, но только для реагентов с накопившимися движениями:
+    python manage.py snapshot_stock --min-movements 500
+"""
+
+from django.core.management.base import BaseCommand
+
+from intranet import inventory
+
+
+class Command(BaseCommand):
+    help = 'Создаёт снимки текущих остатков реагентов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--min-movements',
+            type=int,
+            default=0,
+            help='Снимать только реагенты с указанным числом движений после последнего снимка',
+        )
+
+    def handle(self, *args, **options):
+        count = inventory.take_snapshots(min_movements=options['min_movements'])
+        self.stdout.write(self.style.SUCCESS(f'Создано снимков: {count}'))
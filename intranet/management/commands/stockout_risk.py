@@ -0,0 +1,59 @@
+"""
+Вероятность окончания остатков реагентов (Монте-Карло)
+
+Пример: реагенты, которые закончатся в ближайшие 60 дней с вероятностью не ниже 20%
+    python manage.py stockout_risk --days 60 --min-probability 0.2
+
+API (/api/reagents/stockout-risk/) считает только небольшие варианты
+(forecasting.RISK_PRESET_DAYS x RISK_PRESET_TRIALS) без пула процессов;
+длинные горизонты и большое число испытаний - этой командой.
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from intranet import forecasting
+from intranet.models import Reagent
+
+
+class Command(BaseCommand):
+    help = 'Оценивает вероятность окончания остатка каждого реагента методом Монте-Карло'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=forecasting.RISK_HORIZON_DAYS,
+                            help='Горизонт прогноза, дней')
+        parser.add_argument('--trials', type=int, default=forecasting.RISK_TRIALS,
+                            help='Количество испытаний')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Количество процессов (по умолчанию - по числу ядер)')
+        parser.add_argument('--min-probability', type=float, default=0.0,
+                            help='Выводить реагенты с вероятностью не ниже указанной')
+        parser.add_argument('--no-cache', action='store_true',
+                            help='Пересчитать, даже если есть результат в кеше')
+
+    def handle(self, *args, **options):
+        if options['days'] <= 0 or options['trials'] <= 0:
+            raise CommandError('Горизонт и количество испытаний должны быть больше нуля')
+
+        risk = forecasting.stockout_risk(
+            horizon_days=options['days'],
+            trials=options['trials'],
+            workers=options['workers'],
+            use_cache=not options['no_cache'],
+        )
+        results = [
+            row for row in risk['results']
+            if row['probability'] > 0 and row['probability'] >= options['min_probability']
+        ]
+        names = dict(
+            Reagent.objects.filter(
+                pk__in=[row['reagent_id'] for row in results]
+            ).values_list('pk', 'name')
+        )
+        for row in results:
+            self.stdout.write(
+                f"{names.get(row['reagent_id'], row['reagent_id'])}: "
+                f"{row['probability']:.1%} (остаток {row['on_hand']})"
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f"Реагентов с риском окончания за {risk['horizon_days']} дн.: {len(results)}"
+        ))
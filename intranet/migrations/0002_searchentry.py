@@ -0,0 +1,132 @@
+# Generated by Django 4.2.16 on 2026-10-17 10:05
+
+from django.db import migrations, models
+
+
+SQLITE_FORWARD = [
+    """
+    CREATE VIRTUAL TABLE intranet_searchentry_fts USING fts5(
+        title, body,
+        content='intranet_searchentry', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER intranet_searchentry_ai AFTER INSERT ON intranet_searchentry BEGIN
+        INSERT INTO intranet_searchentry_fts(rowid, title, body)
+        VALUES (new.id, new.title, new.body);
+    END
+    """,
+    """
+    CREATE TRIGGER intranet_searchentry_ad AFTER DELETE ON intranet_searchentry BEGIN
+        INSERT INTO intranet_searchentry_fts(intranet_searchentry_fts, rowid, title, body)
+        VALUES ('delete', old.id, old.title, old.body);
+    END
+    """,
+    """
+    CREATE TRIGGER intranet_searchentry_au AFTER UPDATE ON intranet_searchentry BEGIN
+        INSERT INTO intranet_searchentry_fts(intranet_searchentry_fts, rowid, title, body)
+        VALUES ('delete', old.id, old.title, old.body);
+        INSERT INTO intranet_searchentry_fts(rowid, title, body)
+        VALUES (new.id, new.title, new.body);
+    END
+    """,
+]
+
+SQLITE_BACKWARD = [
+    "DROP TRIGGER IF EXISTS intranet_searchentry_au",
+    "DROP TRIGGER IF EXISTS intranet_searchentry_ad",
+    "DROP TRIGGER IF EXISTS intranet_searchentry_ai",
+    "DROP TABLE IF EXISTS intranet_searchentry_fts",
+]
+
+POSTGRESQL_FORWARD = [
+    """
+    ALTER TABLE intranet_searchentry ADD COLUMN search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('russian', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('russian', coalesce(body, '')), 'B')
+    ) STORED
+    """,
+    "CREATE INDEX intranet_searchentry_vector_gin ON intranet_searchentry USING GIN (search_vector)",
+]
+
+POSTGRESQL_BACKWARD = [
+    "DROP INDEX IF EXISTS intranet_searchentry_vector_gin",
+    "ALTER TABLE intranet_searchentry DROP COLUMN IF EXISTS search_vector",
+]
+
+# kind -> (модель, поле заголовка, поле текста)
+INDEXED_MODELS = {
+    'reagent': ('Reagent', 'name', None),
+    'task': ('Task', 'title', 'description'),
+    'announcement': ('Announcement', 'title', 'text'),
+    'culture': ('Culture', 'name', 'notes'),
+    'recipe': ('Recipe', 'name', 'description'),
+    'document': ('DocumentTemplate', 'name', 'description'),
+}
+
+
+def _run(schema_editor, statements):
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def create_fulltext_index(apps, schema_editor):
+    """Создаёт индекс, специфичный для СУБД"""
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        _run(schema_editor, SQLITE_FORWARD)
+    elif vendor == 'postgresql':
+        _run(schema_editor, POSTGRESQL_FORWARD)
+
+
+def drop_fulltext_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        _run(schema_editor, SQLITE_BACKWARD)
+    elif vendor == 'postgresql':
+        _run(schema_editor, POSTGRESQL_BACKWARD)
+
+
+def populate_index(apps, schema_editor):
+    """Индексирует уже существующие объекты"""
+    SearchEntry = apps.get_model('intranet', 'SearchEntry')
+    entries = []
+    for kind, (model_name, title_field, body_field) in INDEXED_MODELS.items():
+        model = apps.get_model('intranet', model_name)
+        for obj in model.objects.all().iterator():
+            entries.append(SearchEntry(
+                kind=kind,
+                object_id=obj.pk,
+                title=getattr(obj, title_field) or '',
+                body=(getattr(obj, body_field) or '') if body_field else '',
+            ))
+    SearchEntry.objects.bulk_create(entries, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('intranet', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('reagent', 'Реагент'), ('task', 'Задача'), ('announcement', 'Объявление'), ('culture', 'Культура'), ('recipe', 'Рецептура'), ('document', 'Документ')], max_length=20, verbose_name='Тип объекта')),
+                ('object_id', models.PositiveBigIntegerField(verbose_name='ID объекта')),
+                ('title', models.CharField(max_length=255, verbose_name='Заголовок')),
+                ('body', models.TextField(blank=True, verbose_name='Текст')),
+            ],
+            options={
+                'verbose_name': 'Запись поискового индекса',
+                'verbose_name_plural': 'Поисковый индекс',
+                'unique_together': {('kind', 'object_id')},
+            },
+        ),
+        migrations.RunPython(create_fulltext_index, drop_fulltext_index),
+        migrations.RunPython(populate_index, migrations.RunPython.noop),
+    ]
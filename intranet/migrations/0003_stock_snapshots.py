@@ -0,0 +1,41 @@
+# Generated by Django 4.2.16 on 2026-10-17 10:09
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('intranet', '0002_searchentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReagentStockSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('taken_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Момент снимка')),
+                ('on_hand', models.DecimalField(decimal_places=2, max_digits=10, verbose_name='Остаток')),
+            ],
+            options={
+                'verbose_name': 'Снимок остатка',
+                'verbose_name_plural': 'Снимки остатков',
+                'ordering': ['-taken_at'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='reagentmovement',
+            index=models.Index(fields=['reagent', 'date'], name='movement_reagent_date_idx'),
+        ),
+        migrations.AddField(
+            model_name='reagentstocksnapshot',
+            name='reagent',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_snapshots', to='intranet.reagent', verbose_name='Реагент'),
+        ),
+        migrations.AddIndex(
+            model_name='reagentstocksnapshot',
+            index=models.Index(fields=['reagent', 'taken_at'], name='snapshot_reagent_taken_idx'),
+        ),
+    ]
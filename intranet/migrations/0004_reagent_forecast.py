@@ -0,0 +1,35 @@
+# Generated by Django 4.2.16 on 2026-10-17 10:11
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('intranet', '0003_stock_snapshots'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReagentForecast',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('daily_rate_7d', models.DecimalField(decimal_places=4, default=0, max_digits=12, verbose_name='Расход в день (7 дней)')),
+                ('daily_rate_30d', models.DecimalField(decimal_places=4, default=0, max_digits=12, verbose_name='Расход в день (30 дней)')),
+                ('daily_rate', models.DecimalField(decimal_places=4, default=0, max_digits=12, verbose_name='Прогнозный расход в день')),
+                ('days_left', models.DecimalField(blank=True, decimal_places=1, max_digits=10, null=True, verbose_name='Дней до окончания')),
+                ('stockout_date', models.DateField(blank=True, null=True, verbose_name='Дата окончания остатка')),
+                ('reorder_date', models.DateField(blank=True, null=True, verbose_name='Дата достижения порога')),
+                ('computed_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Дата расчёта')),
+                ('reagent', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='forecast', to='intranet.reagent', verbose_name='Реагент')),
+            ],
+            options={
+                'verbose_name': 'Прогноз расхода',
+                'verbose_name_plural': 'Прогнозы расхода',
+                'ordering': ['stockout_date'],
+                'indexes': [models.Index(fields=['reorder_date'], name='forecast_reorder_date_idx')],
+            },
+        ),
+    ]
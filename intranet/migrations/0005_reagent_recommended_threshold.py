@@ -0,0 +1,23 @@
+# Generated by Django 4.2.16 on 2026-10-17 10:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('intranet', '0004_reagent_forecast'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reagent',
+            name='recommended_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Дата расчёта рекомендации'),
+        ),
+        migrations.AddField(
+            model_name='reagent',
+            name='recommended_threshold',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True, verbose_name='Рекомендуемый порог'),
+        ),
+    ]
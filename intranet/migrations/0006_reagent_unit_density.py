@@ -0,0 +1,25 @@
+# Generated by Django 4.2.16 on 2026-10-17 10:18
+
+from decimal import Decimal
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('intranet', '0005_reagent_recommended_threshold'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reagent',
+            name='density',
+            field=models.DecimalField(blank=True, decimal_places=4, help_text='Нужна для пересчёта массы в объём и обратно', max_digits=10, null=True, validators=[django.core.validators.MinValueValidator(Decimal('0.0001'))], verbose_name='Плотность, г/мл'),
+        ),
+        migrations.AddField(
+            model_name='reagent',
+            name='unit',
+            field=models.CharField(choices=[('ml', 'мл'), ('g', 'г'), ('mg', 'мг'), ('ul', 'мкл'), ('units', 'ед.')], default='ml', help_text='В этой единице ведутся остаток, порог и движения', max_length=10, verbose_name='Единица учёта'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.2.16 on 2026-10-17 10:21
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('intranet', '0006_reagent_unit_density'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reagent',
+            name='reserved',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10, verbose_name='Зарезервировано'),
+        ),
+        migrations.CreateModel(
+            name='ReagentReservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.DecimalField(decimal_places=2, max_digits=10, verbose_name='Количество')),
+                ('status', models.CharField(choices=[('active', 'Активен'), ('consumed', 'Израсходован'), ('cancelled', 'Отменён')], default='active', max_length=20, verbose_name='Статус')),
+                ('comment', models.TextField(blank=True, verbose_name='Комментарий')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('closed_at', models.DateTimeField(blank=True, null=True, verbose_name='Дата закрытия')),
+                ('movement', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='reservation', to='intranet.reagentmovement', verbose_name='Движение расхода')),
+                ('reagent', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='intranet.reagent', verbose_name='Реагент')),
+                ('recipe', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='reservations', to='intranet.recipe', verbose_name='Рецептура')),
+                ('task', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='reservations', to='intranet.task', verbose_name='Задача')),
+                ('user', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='reagent_reservations', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Резерв реагента',
+                'verbose_name_plural': 'Резервы реагентов',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['reagent', 'status'], name='reservation_reagent_status_idx')],
+            },
+        ),
+    ]
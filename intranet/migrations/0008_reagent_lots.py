@@ -0,0 +1,58 @@
+# Generated by Django 4.2.16 on 2026-10-17 10:27
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('intranet', '0007_reagent_reservations'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReagentLot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('lot_number', models.CharField(max_length=100, verbose_name='Номер партии')),
+                ('expiry_date', models.DateField(blank=True, null=True, verbose_name='Срок годности')),
+                ('on_hand', models.DecimalField(decimal_places=2, default=0, max_digits=10, verbose_name='Остаток')),
+                ('certificate', models.FileField(blank=True, null=True, upload_to='certificates/lots/', verbose_name='Сертификат')),
+                ('received_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Дата поступления')),
+                ('reagent', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lots', to='intranet.reagent', verbose_name='Реагент')),
+            ],
+            options={
+                'verbose_name': 'Партия реагента',
+                'verbose_name_plural': 'Партии реагентов',
+                'ordering': ['reagent', 'expiry_date', 'received_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ReagentLotAllocation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.DecimalField(decimal_places=2, max_digits=10, verbose_name='Количество')),
+                ('lot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='allocations', to='intranet.reagentlot', verbose_name='Партия')),
+                ('movement', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lot_allocations', to='intranet.reagentmovement', verbose_name='Движение')),
+            ],
+            options={
+                'verbose_name': 'Списание с партии',
+                'verbose_name_plural': 'Списания с партий',
+            },
+        ),
+        migrations.AddField(
+            model_name='reagentmovement',
+            name='lot',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='movements', to='intranet.reagentlot', verbose_name='Партия'),
+        ),
+        migrations.AddIndex(
+            model_name='reagentlot',
+            index=models.Index(fields=['reagent', 'expiry_date', 'received_at', 'id'], name='lot_fefo_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='reagentlot',
+            unique_together={('reagent', 'lot_number')},
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.16 on 2026-10-17 10:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('intranet', '0008_reagent_lots'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reagentlot',
+            name='barcode',
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True, verbose_name='Штрихкод'),
+        ),
+    ]
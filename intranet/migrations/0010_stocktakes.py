@@ -0,0 +1,48 @@
+# Generated by Django 4.2.16 on 2026-10-17 10:29
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('intranet', '0009_reagent_lot_barcode'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Stocktake',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('comment', models.TextField(blank=True, verbose_name='Комментарий')),
+                ('reagents_counted', models.PositiveIntegerField(default=0, verbose_name='Пересчитано реагентов')),
+                ('discrepancies', models.PositiveIntegerField(default=0, verbose_name='Расхождений')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата')),
+                ('user', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='stocktakes', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Инвентаризация',
+                'verbose_name_plural': 'Инвентаризации',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='StocktakeLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('expected', models.DecimalField(decimal_places=2, max_digits=10, verbose_name='По учёту')),
+                ('counted', models.DecimalField(decimal_places=2, max_digits=10, verbose_name='Фактически')),
+                ('difference', models.DecimalField(decimal_places=2, max_digits=10, verbose_name='Расхождение')),
+                ('movement', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='stocktake_line', to='intranet.reagentmovement', verbose_name='Корректирующее движение')),
+                ('reagent', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stocktake_lines', to='intranet.reagent', verbose_name='Реагент')),
+                ('stocktake', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='intranet.stocktake', verbose_name='Инвентаризация')),
+            ],
+            options={
+                'verbose_name': 'Строка инвентаризации',
+                'verbose_name_plural': 'Строки инвентаризации',
+                'unique_together': {('stocktake', 'reagent')},
+            },
+        ),
+    ]
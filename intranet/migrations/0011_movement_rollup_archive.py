@@ -0,0 +1,74 @@
+# Generated by Django 4.2.16 on 2026-10-17 10:36
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count, DateField, Sum
+from django.db.models.functions import TruncMonth
+
+
+def populate_rollup(apps, schema_editor):
+    """Месячные итоги по уже существующим движениям"""
+    ReagentMovement = apps.get_model('intranet', 'ReagentMovement')
+    ReagentMovementMonthly = apps.get_model('intranet', 'ReagentMovementMonthly')
+    totals = ReagentMovement.objects.annotate(
+        month=TruncMonth('date', output_field=DateField())
+    ).order_by().values('reagent', 'month', 'movement_type').annotate(
+        total=Sum('quantity'), movements=Count('id')
+    ).values_list('reagent', 'month', 'movement_type', 'total', 'movements')
+    ReagentMovementMonthly.objects.bulk_create([
+        ReagentMovementMonthly(
+            reagent_id=reagent_id, month=month, movement_type=movement_type,
+            quantity=total, count=count
+        )
+        for reagent_id, month, movement_type, total, count in totals
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('intranet', '0010_stocktakes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReagentMovementMonthly',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(verbose_name='Месяц')),
+                ('movement_type', models.CharField(choices=[('in', 'Приход'), ('out', 'Расход')], max_length=10, verbose_name='Тип движения')),
+                ('quantity', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Количество')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='Движений')),
+                ('reagent', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='monthly_movements', to='intranet.reagent', verbose_name='Реагент')),
+            ],
+            options={
+                'verbose_name': 'Итоги движений за месяц',
+                'verbose_name_plural': 'Итоги движений по месяцам',
+                'ordering': ['-month', 'reagent'],
+                'unique_together': {('reagent', 'month', 'movement_type')},
+            },
+        ),
+        migrations.CreateModel(
+            name='ReagentMovementArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('movement_id', models.IntegerField(unique=True, verbose_name='id движения')),
+                ('lot_id', models.IntegerField(blank=True, null=True, verbose_name='id партии')),
+                ('quantity', models.DecimalField(decimal_places=2, max_digits=10, verbose_name='Количество')),
+                ('movement_type', models.CharField(choices=[('in', 'Приход'), ('out', 'Расход')], max_length=10, verbose_name='Тип движения')),
+                ('date', models.DateTimeField(verbose_name='Дата')),
+                ('comment', models.TextField(blank=True, verbose_name='Комментарий')),
+                ('archived_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата архивации')),
+                ('reagent', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_movements', to='intranet.reagent', verbose_name='Реагент')),
+                ('user', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='archived_reagent_movements', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Архивное движение',
+                'verbose_name_plural': 'Архив движений',
+                'ordering': ['-date'],
+                'indexes': [models.Index(fields=['reagent', 'date'], name='archive_reagent_date_idx')],
+            },
+        ),
+        migrations.RunPython(populate_rollup, migrations.RunPython.noop),
+    ]
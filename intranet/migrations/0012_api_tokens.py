@@ -0,0 +1,35 @@
+# Generated by Django 4.2.16 on 2026-10-17 10:50
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('intranet', '0011_movement_rollup_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ApiToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, verbose_name='Название')),
+                ('prefix', models.CharField(editable=False, max_length=16, unique=True, verbose_name='Префикс')),
+                ('key_hash', models.CharField(editable=False, max_length=64, verbose_name='Хеш ключа')),
+                ('scopes', models.CharField(default='read', help_text='Через запятую: read, write', max_length=100, verbose_name='Права')),
+                ('expires_at', models.DateTimeField(blank=True, null=True, verbose_name='Действует до')),
+                ('is_active', models.BooleanField(default=True, verbose_name='Активен')),
+                ('last_used_at', models.DateTimeField(blank=True, editable=False, null=True, verbose_name='Последнее использование')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Создан')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='api_tokens', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Токен API',
+                'verbose_name_plural': 'Токены API',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.16 on 2026-10-17 10:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('intranet', '0012_api_tokens'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='reagentmovement',
+            name='movement_reagent_date_idx',
+        ),
+        migrations.AddIndex(
+            model_name='cultureevent',
+            index=models.Index(fields=['date', 'id'], name='event_date_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cultureevent',
+            index=models.Index(fields=['culture', 'date', 'id'], name='event_culture_date_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reagentmovement',
+            index=models.Index(fields=['reagent', 'date', 'id'], name='movement_reagent_date_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reagentmovement',
+            index=models.Index(fields=['date', 'id'], name='movement_date_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='taskcomment',
+            index=models.Index(fields=['date', 'id'], name='comment_date_id_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.16 on 2026-10-17 11:32
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('intranet', '0013_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='stocktakeline',
+            unique_together=set(),
+        ),
+        migrations.AddField(
+            model_name='stocktakeline',
+            name='lot',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='stocktake_lines', to='intranet.reagentlot', verbose_name='Партия'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='stocktakeline',
+            unique_together={('stocktake', 'reagent', 'lot')},
+        ),
+    ]
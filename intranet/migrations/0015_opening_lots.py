@@ -0,0 +1,38 @@
+from django.db import migrations
+from django.db.models import Sum
+
+
+OPENING_LOT_NUMBER = 'Остаток до учёта партий'
+
+
+def create_opening_lots(apps, schema_editor):
+    """
+    Остаток реагентов, учтённый до появления партий, переносится
+    в начальную партию: сумма партий совпадает с on_hand
+    """
+    Reagent = apps.get_model('intranet', 'Reagent')
+    ReagentLot = apps.get_model('intranet', 'ReagentLot')
+
+    totals = ReagentLot.objects.order_by().values('reagent').annotate(total=Sum('on_hand'))
+    totals = {row['reagent']: row['total'] for row in totals}
+    reagents = Reagent.objects.filter(pk__in=totals).only('pk', 'on_hand', 'expiry_date', 'created_at')
+    ReagentLot.objects.bulk_create([
+        ReagentLot(
+            reagent_id=reagent.pk, lot_number=OPENING_LOT_NUMBER,
+            on_hand=reagent.on_hand - totals[reagent.pk],
+            expiry_date=reagent.expiry_date, received_at=reagent.created_at,
+        )
+        for reagent in reagents.iterator()
+        if reagent.on_hand != totals[reagent.pk]
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('intranet', '0014_stocktake_lots'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_opening_lots, migrations.RunPython.noop),
+    ]
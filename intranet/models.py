@@ -3,11 +3,14 @@
 Все модели собраны в одном файле для студенческого монолитного проекта
 """
 
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import AbstractUser
 from django.urls import reverse
 from django.utils import timezone
 from django.db.models import F
+from django.core.exceptions import ValidationError
+from django.core.validators import MinValueValidator
+from decimal import Decimal
 
 
 # ============================================================================
@@ -51,6 +54,58 @@ class User(AbstractUser):
         return f"{self.get_full_name() or self.username} ({self.get_role_display()})"
 
 
+class ApiToken(models.Model):
+    """
+    Токен доступа к API для сервисных учётных записей (приборы, скрипты)
+    Ключ вида «<префикс>.<секрет>» показывается один раз при выпуске;
+    в базе хранится только SHA-256 ключа, поиск - по уникальному префиксу
+    (см. intranet/authentication.py)
+    """
+    SCOPE_CHOICES = [
+        ('read', 'Чтение'),
+        ('write', 'Запись'),
+    ]
+    
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='api_tokens',
+        verbose_name='Пользователь'
+    )
+    name = models.CharField('Название', max_length=100)
+    prefix = models.CharField('Префикс', max_length=16, unique=True, editable=False)
+    key_hash = models.CharField('Хеш ключа', max_length=64, editable=False)
+    scopes = models.CharField(
+        'Права',
+        max_length=100,
+        default='read',
+        help_text='Через запятую: read, write'
+    )
+    expires_at = models.DateTimeField('Действует до', null=True, blank=True)
+    is_active = models.BooleanField('Активен', default=True)
+    last_used_at = models.DateTimeField('Последнее использование', null=True, blank=True, editable=False)
+    created_at = models.DateTimeField('Создан', auto_now_add=True)
+    
+    class Meta:
+        verbose_name = 'Токен API'
+        verbose_name_plural = 'Токены API'
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"{self.name} ({self.prefix}…, {self.user.username})"
+    
+    @property
+    def scope_list(self):
+        return [scope.strip() for scope in self.scopes.split(',') if scope.strip()]
+    
+    def has_scope(self, scope):
+        return scope in self.scope_list
+    
+    @property
+    def is_expired(self):
+        return self.expires_at is not None and self.expires_at <= timezone.now()
+
+
 # ============================================================================
 # РЕАГЕНТЫ И ДВИЖЕНИЯ
 # ============================================================================
@@ -76,6 +131,15 @@ class Reagent(models.Model):
         ('other', 'Прочее'),
     ]
     
+    # Единицы измерения (коэффициенты пересчёта - в intranet/units.py)
+    UNIT_CHOICES = [
+        ('ml', 'мл'),
+        ('g', 'г'),
+        ('mg', 'мг'),
+        ('ul', 'мкл'),
+        ('units', 'ед.'),
+    ]
+    
     name = models.CharField('Название', max_length=255)
     category = models.CharField(
         'Категория',
@@ -88,12 +152,49 @@ class Reagent(models.Model):
         decimal_places=2,
         default=0
     )
+    unit = models.CharField(
+        'Единица учёта',
+        max_length=10,
+        choices=UNIT_CHOICES,
+        default='ml',
+        help_text='В этой единице ведутся остаток, порог и движения'
+    )
+    density = models.DecimalField(
+        'Плотность, г/мл',
+        max_digits=10,
+        decimal_places=4,
+        null=True,
+        blank=True,
+        validators=[MinValueValidator(Decimal('0.0001'))],
+        help_text='Нужна для пересчёта массы в объём и обратно'
+    )
+    # Сумма активных резервов; поддерживается инкрементально
+    # операциями резервирования (см. inventory.reserve)
+    reserved = models.DecimalField(
+        'Зарезервировано',
+        max_digits=10,
+        decimal_places=2,
+        default=0
+    )
     min_threshold = models.DecimalField(
         'Минимальный порог',
         max_digits=10,
         decimal_places=2,
         default=0
     )
+    # Рассчитывается по статистике расхода (см. forecasting.recommend_thresholds)
+    recommended_threshold = models.DecimalField(
+        'Рекомендуемый порог',
+        max_digits=10,
+        decimal_places=2,
+        null=True,
+        blank=True
+    )
+    recommended_at = models.DateTimeField(
+        'Дата расчёта рекомендации',
+        null=True,
+        blank=True
+    )
     expiry_date = models.DateField(
         'Срок годности',
         null=True,
@@ -139,6 +240,11 @@ class Reagent(models.Model):
         """Проверяет, критичен ли остаток реагента"""
         return self.on_hand <= self.min_threshold
     
+    @property
+    def available(self):
+        """Доступный остаток: остаток за вычетом активных резервов"""
+        return self.on_hand - self.reserved
+    
     def is_expiring_soon(self):
         """Проверяет, истекает ли срок годности в ближайшие 30 дней"""
         if not self.expiry_date:
@@ -147,6 +253,63 @@ class Reagent(models.Model):
         return 0 <= days_left <= 30
 
 
+class ReagentLot(models.Model):
+    """
+    Партия (лот) реагента со своим сроком годности и сертификатом
+    Reagent.on_hand и Reagent.expiry_date реагентов с партиями - сводные
+    значения по партиям (см. inventory.refresh_lot_rollups)
+    """
+    reagent = models.ForeignKey(
+        Reagent,
+        on_delete=models.CASCADE,
+        related_name='lots',
+        verbose_name='Реагент'
+    )
+    lot_number = models.CharField('Номер партии', max_length=100)
+    # Штрихкод на флаконе партии; поиск при сканировании - по уникальному индексу
+    barcode = models.CharField(
+        'Штрихкод',
+        max_length=64,
+        unique=True,
+        null=True,
+        blank=True
+    )
+    expiry_date = models.DateField('Срок годности', null=True, blank=True)
+    on_hand = models.DecimalField(
+        'Остаток',
+        max_digits=10,
+        decimal_places=2,
+        default=0
+    )
+    certificate = models.FileField(
+        'Сертификат',
+        upload_to='certificates/lots/',
+        blank=True,
+        null=True
+    )
+    received_at = models.DateTimeField('Дата поступления', default=timezone.now)
+    
+    # Порядок расхода FEFO: сначала партии с ближайшим сроком годности,
+    # партии без срока - последними
+    FEFO_ORDER = [F('expiry_date').asc(nulls_last=True), 'received_at', 'id']
+    
+    class Meta:
+        verbose_name = 'Партия реагента'
+        verbose_name_plural = 'Партии реагентов'
+        ordering = ['reagent', 'expiry_date', 'received_at']
+        unique_together = ['reagent', 'lot_number']
+        indexes = [
+            # Выбор партий реагента для расхода в порядке FEFO
+            models.Index(
+                fields=['reagent', 'expiry_date', 'received_at', 'id'],
+                name='lot_fefo_idx',
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.reagent.name}, партия {self.lot_number}"
+
+
 class ReagentMovement(models.Model):
     """
     Модель движения реагентов (приход/расход)
@@ -182,35 +345,428 @@ class ReagentMovement(models.Model):
         related_name='reagent_movements',
         verbose_name='Пользователь'
     )
+    # Для прихода - партия поступления (обязательна, если у реагента есть
+    # партии, см. lot_error); для расхода - необязательно,
+    # без неё расход распределяется по партиям автоматически (FEFO)
+    lot = models.ForeignKey(
+        ReagentLot,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='movements',
+        verbose_name='Партия'
+    )
     
     class Meta:
         verbose_name = 'Движение реагента'
         verbose_name_plural = 'Движения реагентов'
         ordering = ['-date']
+        indexes = [
+            # Воспроизведение движений реагента за период (остаток на дату)
+            # и курсорная пагинация движений реагента по (date, id)
+            models.Index(fields=['reagent', 'date', 'id'], name='movement_reagent_date_id_idx'),
+            # Курсорная пагинация общего журнала движений
+            models.Index(fields=['date', 'id'], name='movement_date_id_idx'),
+        ]
     
     def __str__(self):
         return f"{self.get_movement_type_display()}: {self.reagent.name} - {self.quantity}"
     
+    def lot_error(self, lot_tracked=None):
+        """
+        Ошибка выбора партии для нового движения или None
+        Приход реагента с партиями должен указывать партию: приход без
+        партии увеличил бы on_hand, не изменив ни одной партии.
+        lot_tracked - есть ли у реагента партии, если уже известно (без запроса)
+        """
+        if self.lot_id is not None:
+            if self.lot.reagent_id != self.reagent_id:
+                return 'Партия относится к другому реагенту'
+        elif self.movement_type == 'in':
+            if lot_tracked is None:
+                lot_tracked = ReagentLot.objects.filter(reagent_id=self.reagent_id).exists()
+            if lot_tracked:
+                return 'У реагента есть партии: укажите партию прихода'
+        return None
+    
+    def clean(self):
+        """Проверка партии нового движения (админка, формы)"""
+        if self._state.adding and self.reagent_id is not None:
+            error = self.lot_error()
+            if error:
+                raise ValidationError({'lot': error})
+    
     def save(self, *args, **kwargs):
         """
         Переопределенный save() с использованием F-выражений
         для автоматического обновления остатка реагента
         """
-        is_new = self.pk is None
-        super().save(*args, **kwargs)
+        from .inventory import register_movements
         
-        if is_new:
-            # Используем F-выражения для атомарного обновления
-            if self.movement_type == 'in':
-                Reagent.objects.filter(pk=self.reagent.pk).update(
-                    on_hand=F('on_hand') + self.quantity
-                )
-            elif self.movement_type == 'out':
-                Reagent.objects.filter(pk=self.reagent.pk).update(
-                    on_hand=F('on_hand') - self.quantity
-                )
-            # Перезагружаем объект для обновления значения
-            self.reagent.refresh_from_db()
+        is_new = self.pk is None
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            
+            if is_new:
+                # Используем F-выражения для атомарного обновления
+                if self.movement_type == 'in':
+                    Reagent.objects.filter(pk=self.reagent.pk).update(
+                        on_hand=F('on_hand') + self.quantity
+                    )
+                elif self.movement_type == 'out':
+                    Reagent.objects.filter(pk=self.reagent.pk).update(
+                        on_hand=F('on_hand') - self.quantity
+                    )
+                # Остатки партий, сводный срок годности и месячные итоги
+                register_movements([self])
+                # Перезагружаем объект для обновления значения
+                self.reagent.refresh_from_db()
+
+
+class ReagentLotAllocation(models.Model):
+    """
+    Списание движения расхода с конкретной партии
+    Один расход может распределиться на несколько партий
+    """
+    movement = models.ForeignKey(
+        ReagentMovement,
+        on_delete=models.CASCADE,
+        related_name='lot_allocations',
+        verbose_name='Движение'
+    )
+    lot = models.ForeignKey(
+        ReagentLot,
+        on_delete=models.CASCADE,
+        related_name='allocations',
+        verbose_name='Партия'
+    )
+    quantity = models.DecimalField(
+        'Количество',
+        max_digits=10,
+        decimal_places=2
+    )
+    
+    class Meta:
+        verbose_name = 'Списание с партии'
+        verbose_name_plural = 'Списания с партий'
+    
+    def __str__(self):
+        return f"{self.lot}: {self.quantity}"
+
+
+class ReagentStockSnapshot(models.Model):
+    """
+    Снимок остатка реагента на момент времени
+    Остаток на произвольную дату восстанавливается от ближайшего снимка
+    воспроизведением только движений между снимком и этой датой
+    """
+    reagent = models.ForeignKey(
+        Reagent,
+        on_delete=models.CASCADE,
+        related_name='stock_snapshots',
+        verbose_name='Реагент'
+    )
+    taken_at = models.DateTimeField('Момент снимка', default=timezone.now)
+    on_hand = models.DecimalField(
+        'Остаток',
+        max_digits=10,
+        decimal_places=2
+    )
+    
+    class Meta:
+        verbose_name = 'Снимок остатка'
+        verbose_name_plural = 'Снимки остатков'
+        ordering = ['-taken_at']
+        indexes = [
+            models.Index(fields=['reagent', 'taken_at'], name='snapshot_reagent_taken_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.reagent.name}: {self.on_hand} ({self.taken_at.strftime('%d.%m.%Y %H:%M')})"
+
+
+class ReagentMovementMonthly(models.Model):
+    """
+    Месячные итоги движений: сумма и количество по реагенту, типу и месяцу
+    Ведутся инкрементально (см. rollups.py) и включают архивные движения,
+    поэтому аналитика не читает журнал движений целиком
+    """
+    reagent = models.ForeignKey(
+        Reagent,
+        on_delete=models.CASCADE,
+        related_name='monthly_movements',
+        verbose_name='Реагент'
+    )
+    month = models.DateField('Месяц')
+    movement_type = models.CharField(
+        'Тип движения',
+        max_length=10,
+        choices=ReagentMovement.MOVEMENT_CHOICES
+    )
+    quantity = models.DecimalField(
+        'Количество',
+        max_digits=14,
+        decimal_places=2,
+        default=0
+    )
+    count = models.PositiveIntegerField('Движений', default=0)
+    
+    class Meta:
+        verbose_name = 'Итоги движений за месяц'
+        verbose_name_plural = 'Итоги движений по месяцам'
+        ordering = ['-month', 'reagent']
+        unique_together = ['reagent', 'month', 'movement_type']
+    
+    def __str__(self):
+        return f"{self.reagent.name}, {self.month:%m.%Y}, {self.get_movement_type_display()}: {self.quantity}"
+
+
+class ReagentMovementArchive(models.Model):
+    """
+    Архив движений старше срока хранения (см. rollups.archive_movements)
+    Партия хранится как id без внешнего ключа
+    """
+    movement_id = models.IntegerField('id движения', unique=True)
+    reagent = models.ForeignKey(
+        Reagent,
+        on_delete=models.CASCADE,
+        related_name='archived_movements',
+        verbose_name='Реагент'
+    )
+    lot_id = models.IntegerField('id партии', null=True, blank=True)
+    quantity = models.DecimalField(
+        'Количество',
+        max_digits=10,
+        decimal_places=2
+    )
+    movement_type = models.CharField(
+        'Тип движения',
+        max_length=10,
+        choices=ReagentMovement.MOVEMENT_CHOICES
+    )
+    date = models.DateTimeField('Дата')
+    comment = models.TextField('Комментарий', blank=True)
+    user = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        related_name='archived_reagent_movements',
+        verbose_name='Пользователь'
+    )
+    archived_at = models.DateTimeField('Дата архивации', auto_now_add=True)
+    
+    class Meta:
+        verbose_name = 'Архивное движение'
+        verbose_name_plural = 'Архив движений'
+        ordering = ['-date']
+        indexes = [
+            models.Index(fields=['reagent', 'date'], name='archive_reagent_date_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.get_movement_type_display()}: {self.reagent.name} - {self.quantity}"
+
+
+class ReagentForecast(models.Model):
+    """
+    Прогноз расхода реагента и даты окончания остатка
+    Пересчитывается пакетно для всего каталога (см. intranet/forecasting.py)
+    """
+    reagent = models.OneToOneField(
+        Reagent,
+        on_delete=models.CASCADE,
+        related_name='forecast',
+        verbose_name='Реагент'
+    )
+    daily_rate_7d = models.DecimalField(
+        'Расход в день (7 дней)',
+        max_digits=12,
+        decimal_places=4,
+        default=0
+    )
+    daily_rate_30d = models.DecimalField(
+        'Расход в день (30 дней)',
+        max_digits=12,
+        decimal_places=4,
+        default=0
+    )
+    daily_rate = models.DecimalField(
+        'Прогнозный расход в день',
+        max_digits=12,
+        decimal_places=4,
+        default=0
+    )
+    days_left = models.DecimalField(
+        'Дней до окончания',
+        max_digits=10,
+        decimal_places=1,
+        null=True,
+        blank=True
+    )
+    stockout_date = models.DateField('Дата окончания остатка', null=True, blank=True)
+    reorder_date = models.DateField('Дата достижения порога', null=True, blank=True)
+    computed_at = models.DateTimeField('Дата расчёта', default=timezone.now)
+    
+    class Meta:
+        verbose_name = 'Прогноз расхода'
+        verbose_name_plural = 'Прогнозы расхода'
+        ordering = ['stockout_date']
+        indexes = [
+            models.Index(fields=['reorder_date'], name='forecast_reorder_date_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.reagent.name}: {self.stockout_date or '—'}"
+
+
+class ReagentReservation(models.Model):
+    """
+    Резерв реагента под запуск рецептуры или задачу
+    Создаётся, расходуется и отменяется только через inventory
+    (reserve, consume_reservations, cancel_reservations) - там же
+    поддерживается Reagent.reserved
+    """
+    STATUS_CHOICES = [
+        ('active', 'Активен'),
+        ('consumed', 'Израсходован'),
+        ('cancelled', 'Отменён'),
+    ]
+    
+    reagent = models.ForeignKey(
+        Reagent,
+        on_delete=models.CASCADE,
+        related_name='reservations',
+        verbose_name='Реагент'
+    )
+    quantity = models.DecimalField(
+        'Количество',
+        max_digits=10,
+        decimal_places=2
+    )
+    recipe = models.ForeignKey(
+        'Recipe',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='reservations',
+        verbose_name='Рецептура'
+    )
+    task = models.ForeignKey(
+        'Task',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='reservations',
+        verbose_name='Задача'
+    )
+    status = models.CharField(
+        'Статус',
+        max_length=20,
+        choices=STATUS_CHOICES,
+        default='active'
+    )
+    movement = models.OneToOneField(
+        ReagentMovement,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='reservation',
+        verbose_name='Движение расхода'
+    )
+    comment = models.TextField('Комментарий', blank=True)
+    user = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        related_name='reagent_reservations',
+        verbose_name='Пользователь'
+    )
+    created_at = models.DateTimeField('Дата создания', auto_now_add=True)
+    closed_at = models.DateTimeField('Дата закрытия', null=True, blank=True)
+    
+    class Meta:
+        verbose_name = 'Резерв реагента'
+        verbose_name_plural = 'Резервы реагентов'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['reagent', 'status'], name='reservation_reagent_status_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.reagent.name}: {self.quantity} ({self.get_status_display()})"
+
+
+class Stocktake(models.Model):
+    """
+    Инвентаризация: пересчёт фактических остатков
+    Расхождения с учётом проводятся корректирующими движениями
+    (см. inventory.apply_stocktake)
+    """
+    comment = models.TextField('Комментарий', blank=True)
+    user = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        related_name='stocktakes',
+        verbose_name='Пользователь'
+    )
+    reagents_counted = models.PositiveIntegerField('Пересчитано реагентов', default=0)
+    discrepancies = models.PositiveIntegerField('Расхождений', default=0)
+    created_at = models.DateTimeField('Дата', auto_now_add=True)
+    
+    class Meta:
+        verbose_name = 'Инвентаризация'
+        verbose_name_plural = 'Инвентаризации'
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"Инвентаризация #{self.pk} от {self.created_at:%d.%m.%Y}"
+
+
+class StocktakeLine(models.Model):
+    """
+    Строка инвентаризации: учётный и фактический остаток реагента,
+    у реагентов с партиями - остаток отдельной партии
+    """
+    stocktake = models.ForeignKey(
+        Stocktake,
+        on_delete=models.CASCADE,
+        related_name='lines',
+        verbose_name='Инвентаризация'
+    )
+    reagent = models.ForeignKey(
+        Reagent,
+        on_delete=models.CASCADE,
+        related_name='stocktake_lines',
+        verbose_name='Реагент'
+    )
+    lot = models.ForeignKey(
+        ReagentLot,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='stocktake_lines',
+        verbose_name='Партия'
+    )
+    expected = models.DecimalField('По учёту', max_digits=10, decimal_places=2)
+    counted = models.DecimalField('Фактически', max_digits=10, decimal_places=2)
+    difference = models.DecimalField('Расхождение', max_digits=10, decimal_places=2)
+    movement = models.OneToOneField(
+        ReagentMovement,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='stocktake_line',
+        verbose_name='Корректирующее движение'
+    )
+    
+    class Meta:
+        verbose_name = 'Строка инвентаризации'
+        verbose_name_plural = 'Строки инвентаризации'
+        unique_together = ['stocktake', 'reagent', 'lot']
+    
+    def __str__(self):
+        return f"{self.reagent.name}: {self.expected} -> {self.counted}"
 
 
 # ============================================================================
@@ -268,13 +824,7 @@ class RecipeReagent(models.Model):
     """
     Промежуточная модель для связи рецептуры и реагентов (through)
     """
-    UNIT_CHOICES = [
-        ('ml', 'мл'),
-        ('g', 'г'),
-        ('mg', 'мг'),
-        ('ul', 'мкл'),
-        ('units', 'ед.'),
-    ]
+    UNIT_CHOICES = Reagent.UNIT_CHOICES
     
     recipe = models.ForeignKey(
         Recipe,
@@ -400,6 +950,11 @@ class CultureEvent(models.Model):
         verbose_name = 'События культуры'
         verbose_name_plural = 'События культур'
         ordering = ['-date']
+        indexes = [
+            # Курсорная пагинация по (date, id): общий журнал и события культуры
+            models.Index(fields=['date', 'id'], name='event_date_id_idx'),
+            models.Index(fields=['culture', 'date', 'id'], name='event_culture_date_id_idx'),
+        ]
     
     def __str__(self):
         return f"{self.culture.name}: {self.get_event_type_display()} ({self.date.strftime('%d.%m.%Y')})"
@@ -501,6 +1056,10 @@ class TaskComment(models.Model):
         verbose_name = 'Комментарий к задаче'
         verbose_name_plural = 'Комментарии к задачам'
         ordering = ['date']
+        indexes = [
+            # Курсорная пагинация по (date, id)
+            models.Index(fields=['date', 'id'], name='comment_date_id_idx'),
+        ]
     
     def __str__(self):
         return f"Комментарий к {self.task.title} от {self.user}"
@@ -593,3 +1152,36 @@ class DocumentTemplate(models.Model):
     
     def __str__(self):
         return self.name
+
+
+# ============================================================================
+# ПОИСКОВЫЙ ИНДЕКС
+# ============================================================================
+
+class SearchEntry(models.Model):
+    """
+    Денормализованный текст объекта для полнотекстового поиска
+    Поверх таблицы строится FTS5 (SQLite) или tsvector + GIN (PostgreSQL),
+    см. intranet/search.py
+    """
+    KIND_CHOICES = [
+        ('reagent', 'Реагент'),
+        ('task', 'Задача'),
+        ('announcement', 'Объявление'),
+        ('culture', 'Культура'),
+        ('recipe', 'Рецептура'),
+        ('document', 'Документ'),
+    ]
+    
+    kind = models.CharField('Тип объекта', max_length=20, choices=KIND_CHOICES)
+    object_id = models.PositiveBigIntegerField('ID объекта')
+    title = models.CharField('Заголовок', max_length=255)
+    body = models.TextField('Текст', blank=True)
+    
+    class Meta:
+        verbose_name = 'Запись поискового индекса'
+        verbose_name_plural = 'Поисковый индекс'
+        unique_together = ['kind', 'object_id']
+    
+    def __str__(self):
+        return f"{self.get_kind_display()}: {self.title}"
@@ -0,0 +1,113 @@
+"""
+Курсорная (keyset) пагинация для больших журналов API
+
+PageNumberPagination выполняет COUNT(*) и OFFSET на каждой странице -
+чем дальше страница, тем дольше запрос. Для журналов, которые только
+дополняются (движения реагентов, события культур, комментарии), страница
+выбирается условием по ключу (date, id) последней выданной записи:
+
+    WHERE date <= :date AND (date < :date OR id < :id)
+    ORDER BY date DESC, id DESC LIMIT :size + 1
+
+Запрос идёт по составному индексу (…, date, id), и любая страница стоит
+столько же, сколько первая. Курсор - непрозрачная строка в ссылке next;
+клиент выгружает всю историю, переходя по next, пока он не станет null.
+Направление (по убыванию или возрастанию даты) берётся из сортировки
+запроса (ordering вьюсета или параметр ?ordering=date / -date).
+"""
+
+import base64
+import binascii
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Пагинация по ключу (date, id)
+    Ответ: {'next': ссылка на следующую страницу или null, 'results': [...]}
+    """
+    field = 'date'
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return settings.REST_FRAMEWORK['PAGE_SIZE']
+        return min(max(size, 1), self.max_page_size)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            value, _, pk = base64.urlsafe_b64decode(encoded.encode()).decode().rpartition('|')
+            position = (parse_datetime(value), int(pk))
+        except (binascii.Error, UnicodeDecodeError, ValueError):
+            position = (None, None)
+        if position[0] is None:
+            raise NotFound('Неверный курсор')
+        return position
+
+    def encode_cursor(self, item):
+        value = f'{getattr(item, self.field).isoformat()}|{item.pk}'
+        return base64.urlsafe_b64encode(value.encode()).decode()
+
+    def is_descending(self, queryset):
+        ordering = queryset.query.order_by or queryset.model._meta.ordering
+        return bool(ordering) and str(ordering[0]).startswith('-')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        descending = self.is_descending(queryset)
+        position = self.decode_cursor(request)
+
+        if position is not None:
+            value, pk = position
+            if descending:
+                queryset = queryset.filter(**{f'{self.field}__lte': value}).filter(
+                    Q(**{f'{self.field}__lt': value}) | Q(pk__lt=pk)
+                )
+            else:
+                queryset = queryset.filter(**{f'{self.field}__gte': value}).filter(
+                    Q(**{f'{self.field}__gt': value}) | Q(pk__gt=pk)
+                )
+        sign = '-' if descending else ''
+        page = list(queryset.order_by(f'{sign}{self.field}', f'{sign}pk')[:self.page_size + 1])
+
+        self.has_next = len(page) > self.page_size
+        page = page[:self.page_size]
+        self.next_cursor = self.encode_cursor(page[-1]) if self.has_next else None
+        return page
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
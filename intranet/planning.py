@@ -0,0 +1,239 @@
+"""
+Планирование потребности в реагентах по производственному плану
+
+План - список пар (рецептура, количество партий). Состав всех рецептур
+загружается одним запросом, количества пересчитываются в единицу учёта
+реагента (см. units.py), потребность по каждому реагенту суммируется
+векторно (NumPy) и сравнивается с остатком и прогнозом расхода.
+
+Там же - доступность рецептур: сколько партий каждой утверждённой
+рецептуры можно приготовить из текущих остатков.
+"""
+
+from collections import defaultdict
+from decimal import Decimal, ROUND_UP
+
+import numpy as np
+from django.core.cache import cache
+from django.utils import timezone
+
+from . import dashboard_cache, units
+from .models import Recipe, RecipeReagent, Reagent
+
+
+def _normalize_schedule(schedule):
+    """Складывает партии повторяющихся рецептур: {recipe_id: batches}"""
+    batches = defaultdict(float)
+    for recipe_id, count in schedule:
+        batches[recipe_id] += float(count)
+    return dict(batches)
+
+
+def plan_demand(schedule, horizon_days=0):
+    """
+    Потребность в реагентах для плана производства
+
+    schedule     - [(recipe_id, batches), ...]
+    horizon_days - через сколько дней начнётся производство: к потребности
+                   добавляется прогнозный расход за этот срок (ReagentForecast)
+
+    Возвращает словарь:
+    {'missing_recipes': [id, ...],
+     'unconvertible': [{'recipe_id', 'reagent_id', 'unit', 'stock_unit'}, ...],
+     'reagents': [{'reagent_id', 'name', 'unit', 'required', 'on_hand',
+                   'reserved', 'forecast_consumption', 'shortfall'}, ...]}
+    Дефицит считается от доступного остатка (on_hand - reserved).
+    Реагенты упорядочены по убыванию дефицита. Выполняет три запроса
+    независимо от размера плана.
+    """
+    batches = _normalize_schedule(schedule)
+    existing = set(Recipe.objects.filter(pk__in=batches).values_list('pk', flat=True))
+    missing = sorted(set(batches) - existing)
+
+    rows = list(
+        RecipeReagent.objects.filter(recipe_id__in=existing).values_list(
+            'recipe_id', 'reagent_id', 'quantity', 'unit', 'reagent__unit', 'reagent__density'
+        )
+    )
+    if not rows:
+        return {'missing_recipes': missing, 'unconvertible': [], 'reagents': []}
+
+    reagent_ids = np.array([row[1] for row in rows], dtype=np.int64)
+    batch_counts = np.array([batches[row[0]] for row in rows], dtype=np.float64)
+    quantities = units.convert(
+        [row[2] for row in rows],
+        [row[3] for row in rows],
+        [row[4] for row in rows],
+        [row[5] for row in rows],
+    )
+
+    # Строки, которые нельзя пересчитать в единицу учёта (другая величина,
+    # нет плотности), в сумму не входят и возвращаются отдельно
+    convertible = ~np.isnan(quantities)
+    unconvertible = [
+        {'recipe_id': rows[i][0], 'reagent_id': rows[i][1], 'unit': rows[i][3], 'stock_unit': rows[i][4]}
+        for i in np.flatnonzero(~convertible).tolist()
+    ]
+    demand = np.where(convertible, quantities, 0) * batch_counts
+
+    group_reagents, inverse = np.unique(reagent_ids, return_inverse=True)
+    required = np.bincount(inverse, weights=demand)
+
+    stock = {
+        pk: (name, unit, float(on_hand), float(reserved), float(rate or 0))
+        for pk, name, unit, on_hand, reserved, rate in Reagent.objects.filter(
+            pk__in=group_reagents.tolist()
+        ).values_list('pk', 'name', 'unit', 'on_hand', 'reserved', 'forecast__daily_rate')
+    }
+    reagent_stock = [stock[pk] for pk in group_reagents.tolist()]
+    on_hand = np.array([item[2] for item in reagent_stock])
+    reserved = np.array([item[3] for item in reagent_stock])
+    forecast = np.array([item[4] for item in reagent_stock]) * horizon_days
+    shortfall = np.maximum(required + forecast - (on_hand - reserved), 0)
+
+    order = np.lexsort((group_reagents, -shortfall))
+    return {
+        'missing_recipes': missing,
+        'unconvertible': unconvertible,
+        'reagents': [
+            {
+                'reagent_id': int(group_reagents[i]),
+                'name': reagent_stock[i][0],
+                'unit': reagent_stock[i][1],
+                'required': round(float(required[i]), 4),
+                'on_hand': round(float(on_hand[i]), 4),
+                'reserved': round(float(reserved[i]), 4),
+                'forecast_consumption': round(float(forecast[i]), 4),
+                'shortfall': round(float(shortfall[i]), 4),
+            }
+            for i in order.tolist()
+        ],
+    }
+
+
+def recipe_requirements(recipe_id, batches):
+    """
+    Количества реагентов на batches партий рецептуры в единицах учёта
+    Возвращает [(reagent_id, Decimal), ...]; ValueError, если количество
+    какого-то реагента нельзя пересчитать в его единицу учёта
+    """
+    rows = list(
+        RecipeReagent.objects.filter(recipe_id=recipe_id).values_list(
+            'reagent_id', 'reagent__name', 'quantity', 'unit', 'reagent__unit', 'reagent__density'
+        ).order_by('reagent_id')
+    )
+    quantities = units.convert(
+        [row[2] for row in rows],
+        [row[3] for row in rows],
+        [row[4] for row in rows],
+        [row[5] for row in rows],
+    ) * float(batches)
+    unconvertible = [rows[i][1] for i in np.flatnonzero(np.isnan(quantities)).tolist()]
+    if unconvertible:
+        raise ValueError(
+            f'Нельзя пересчитать в единицу учёта: {", ".join(unconvertible)}'
+        )
+    # Округление вверх до сотых, чтобы не зарезервировать меньше нужного
+    return [
+        (row[0], Decimal(str(quantity)).quantize(Decimal('0.01'), rounding=ROUND_UP))
+        for row, quantity in zip(rows, quantities.tolist())
+        if quantity > 0
+    ]
+
+
+# ============================================================================
+# ДОСТУПНОСТЬ РЕЦЕПТУР
+# ============================================================================
+
+AVAILABILITY_CACHE_KEY = 'planning:availability'
+# Кеш сбрасывают сигналы только своего процесса: с LocMemCache устаревание
+# ограничено тем же сроком, что и у виджетов дашборда
+AVAILABILITY_CACHE_TIMEOUT = 60 * 60 if dashboard_cache.SHARED_CACHE else dashboard_cache.LOCAL_CACHE_TIMEOUT
+
+
+def compute_availability():
+    """
+    Сколько партий каждой утверждённой рецептуры можно приготовить сейчас
+
+    Один запрос RecipeReagent JOIN Reagent JOIN Recipe; для каждой строки
+    состава - floor(доступный остаток / количество в единице учёта)
+    (доступный - без активных резервов), для рецептуры -
+    минимум по строкам и лимитирующий реагент.
+
+    Возвращает словарь:
+    {'computed_at', 'reagent_ids' (используемые реагенты),
+     'recipes': [{'recipe_id', 'name', 'batches', 'limiting_reagent_id',
+                  'limiting_reagent_name'}, ...]}
+    batches = None, если количество какого-то реагента нельзя пересчитать
+    в его единицу учёта
+    """
+    rows = list(
+        RecipeReagent.objects.filter(recipe__status='approved').values_list(
+            'recipe_id', 'recipe__name', 'reagent_id', 'reagent__name',
+            'quantity', 'unit', 'reagent__unit', 'reagent__density',
+            'reagent__on_hand', 'reagent__reserved'
+        ).order_by('recipe_id', 'reagent_id')
+    )
+    result = {'computed_at': timezone.now(), 'reagent_ids': set(), 'recipes': []}
+    if not rows:
+        return result
+
+    recipe_ids = np.array([row[0] for row in rows], dtype=np.int64)
+    required = units.convert(
+        [row[4] for row in rows],
+        [row[5] for row in rows],
+        [row[6] for row in rows],
+        [row[7] for row in rows],
+    )
+    available = np.maximum(np.array([float(row[8] - row[9]) for row in rows]), 0)
+
+    # Партий из остатка каждой строки; нулевое количество не ограничивает
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratios = np.where(required > 0, np.floor(available / required), np.inf)
+    unknown = np.isnan(required)
+    ratios[unknown] = np.nan
+
+    # Строки упорядочены по рецептуре: минимум по группам через reduceat
+    starts = np.flatnonzero(np.r_[True, recipe_ids[1:] != recipe_ids[:-1]])
+    has_unknown = np.logical_or.reduceat(unknown, starts)
+    batches = np.minimum.reduceat(np.where(unknown, np.inf, ratios), starts)
+
+    # Лимитирующий реагент - строка с минимальным отношением в группе
+    order = np.lexsort((np.where(unknown, np.inf, ratios), recipe_ids))
+    limiting = order[starts]
+
+    result['reagent_ids'] = {row[2] for row in rows}
+    for position, start in enumerate(starts.tolist()):
+        row = rows[limiting[position]]
+        value = batches[position]
+        is_known = not has_unknown[position] and np.isfinite(value)
+        result['recipes'].append({
+            'recipe_id': rows[start][0],
+            'name': rows[start][1],
+            'batches': int(value) if is_known else None,
+            'limiting_reagent_id': row[2] if is_known else None,
+            'limiting_reagent_name': row[3] if is_known else None,
+        })
+    return result
+
+
+def recipe_availability():
+    """Доступность рецептур (см. compute_availability) из кеша"""
+    result = cache.get(AVAILABILITY_CACHE_KEY)
+    if result is None:
+        result = compute_availability()
+        cache.set(AVAILABILITY_CACHE_KEY, result, AVAILABILITY_CACHE_TIMEOUT)
+    return result
+
+
+def invalidate_availability(reagent_ids=None):
+    """
+    Сбрасывает кеш доступности рецептур
+    reagent_ids - сбросить, только если изменился остаток реагента,
+    который входит в утверждённую рецептуру (None - сбросить всегда)
+    """
+    if reagent_ids is not None:
+        cached = cache.get(AVAILABILITY_CACHE_KEY)
+        if cached is None or cached['reagent_ids'].isdisjoint(reagent_ids):
+            return
+    cache.delete(AVAILABILITY_CACHE_KEY)
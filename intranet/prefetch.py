@@ -0,0 +1,59 @@
+"""
+Ограниченная подгрузка дочерних записей: последние N на каждого родителя
+
+prefetch_related('events') загружает всю историю каждой культуры на
+странице, хотя в ответе нужны несколько последних событий. Здесь
+дочерние записи нумеруются оконной функцией внутри родителя и
+отсекаются в том же запросе:
+
+    SELECT * FROM (
+        SELECT ..., ROW_NUMBER() OVER (PARTITION BY culture_id
+                                       ORDER BY date DESC, id DESC) AS row_number
+        FROM intranet_cultureevent WHERE culture_id IN (...)
+    ) WHERE row_number <= 5
+
+Один запрос на страницу независимо от длины истории; общее число
+записей выводится отдельно аннотацией (related_count).
+"""
+
+from django.db.models import Count, IntegerField, OuterRef, Prefetch, Subquery, Value, Window
+from django.db.models.functions import Coalesce, RowNumber
+
+
+def _reverse_relation(model, lookup):
+    """Обратная связь «один ко многим» модели по имени ('events')"""
+    relation = next(
+        (rel for rel in model._meta.related_objects
+         if rel.get_accessor_name() == lookup and rel.one_to_many),
+        None,
+    )
+    if relation is None:
+        raise ValueError(f'{model.__name__}.{lookup} - не обратная связь «один ко многим»')
+    return relation
+
+
+def prefetch_latest(model, lookup, limit, queryset=None, order_by=('-date', '-pk')):
+    """
+    Prefetch последних limit дочерних записей связи lookup для каждого
+    объекта model. «Последние» - первые по order_by; в ответе записи
+    идут в порядке queryset (по умолчанию - Meta.ordering дочерней модели)
+    """
+    relation = _reverse_relation(model, lookup)
+    if queryset is None:
+        queryset = relation.related_model._default_manager.all()
+    row_number = Window(RowNumber(), partition_by=relation.field.attname, order_by=list(order_by))
+    return Prefetch(lookup, queryset=queryset.annotate(row_number=row_number).filter(row_number__lte=limit))
+
+
+def related_count(model, lookup):
+    """Число дочерних записей связи lookup - подзапрос для annotate() без GROUP BY"""
+    relation = _reverse_relation(model, lookup)
+    counts = (
+        relation.related_model._default_manager
+        .filter(**{relation.field.name: OuterRef('pk')})
+        .order_by()
+        .values(relation.field.name)
+        .annotate(total=Count('pk'))
+        .values('total')
+    )
+    return Coalesce(Subquery(counts, output_field=IntegerField()), Value(0))
@@ -0,0 +1,255 @@
+"""
+Месячные итоги движений реагентов и архив старых движений
+
+Итоги (ReagentMovementMonthly) - сумма и количество движений по реагенту,
+типу и месяцу. Ведутся инкрементально: при создании движений
+(inventory.register_movements) итоги месяцев прибавляются одним
+INSERT ... ON CONFLICT DO UPDATE на пакет, при изменении и удалении
+(сигналы) - UPDATE с CASE. Аналитика (счётчики дашборда, помесячная
+статистика) читает итоги, а не журнал движений.
+
+Движения старше срока хранения переносятся в ReagentMovementArchive целыми
+месяцами (archive_movements). Итоги при этом не меняются - они уже
+учитывают архивные движения, - а рабочая таблица остаётся небольшой.
+"""
+
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, time
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import Case, Count, DateField, DecimalField, F, IntegerField, Sum, Value, When
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from .models import ReagentMovement, ReagentMovementArchive, ReagentMovementMonthly
+
+
+# Срок хранения движений в рабочей таблице по умолчанию, месяцев
+RETENTION_MONTHS = 24
+ARCHIVE_BATCH_SIZE = 5000
+
+_state = threading.local()
+
+
+def month_of(moment, tz=None):
+    """Первый день месяца движения (в поясе tz, по умолчанию - в текущем)"""
+    return timezone.localtime(moment, tz).date().replace(day=1)
+
+
+def month_key(movement, tz=None):
+    return (movement.reagent_id, month_of(movement.date, tz), movement.movement_type)
+
+
+# ============================================================================
+# МЕСЯЧНЫЕ ИТОГИ
+# ============================================================================
+
+def apply_deltas(deltas):
+    """
+    Применяет изменения итогов: {(reagent_id, month, movement_type): [quantity, count]}
+
+    Добавления (count > 0; все массовые пути) - одним INSERT ... ON CONFLICT
+    DO UPDATE с прибавлением к существующей строке на пакет ключей.
+    Вычитания (удаление, изменение движения) и СУБД без ON CONFLICT -
+    UPDATE с CASE и bulk_create новых строк
+    """
+    deltas = {key: value for key, value in deltas.items() if value[0] or value[1]}
+    if not deltas:
+        return
+
+    if connection.features.supports_update_conflicts_with_target:
+        additions = {key: value for key, value in deltas.items() if value[1] > 0}
+        _upsert_deltas(additions)
+        deltas = {key: value for key, value in deltas.items() if key not in additions}
+    if deltas:
+        _update_deltas(deltas)
+
+
+UPSERT_COLUMNS = ('reagent_id', 'month', 'movement_type', 'quantity', 'count')
+
+
+def _upsert_deltas(deltas):
+    """
+    INSERT ... ON CONFLICT (reagent, month, movement_type) DO UPDATE
+    SET quantity = quantity + excluded.quantity, count = count + excluded.count
+    Строка-кандидат должна проходить CHECK (count >= 0) - только добавления
+    """
+    if not deltas:
+        return
+    ops = connection.ops
+    table = ops.quote_name(ReagentMovementMonthly._meta.db_table)
+    columns = [ops.quote_name(column) for column in UPSERT_COLUMNS]
+    quantity, count = columns[3], columns[4]
+    rows = [
+        (reagent_id, ops.adapt_datefield_value(month), movement_type,
+         ops.adapt_decimalfield_value(value[0], 14, 2), value[1])
+        for (reagent_id, month, movement_type), value in deltas.items()
+    ]
+    batch_size = max(ops.bulk_batch_size(UPSERT_COLUMNS, rows), 1)
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            placeholders = ', '.join(['(%s, %s, %s, %s, %s)'] * len(batch))
+            cursor.execute(
+                f'INSERT INTO {table} ({", ".join(columns)}) VALUES {placeholders} '
+                f'ON CONFLICT ({", ".join(columns[:3])}) DO UPDATE SET '
+                f'{quantity} = {table}.{quantity} + excluded.{quantity}, '
+                f'{count} = {table}.{count} + excluded.{count}',
+                [param for row in batch for param in row],
+            )
+
+
+def _update_deltas(deltas):
+    """Существующие строки обновляются одним UPDATE, новые - bulk_create"""
+    with transaction.atomic(savepoint=False):
+        existing = {
+            (row.reagent_id, row.month, row.movement_type): row.pk
+            for row in ReagentMovementMonthly.objects.select_for_update().filter(
+                reagent_id__in={key[0] for key in deltas},
+                month__in={key[1] for key in deltas},
+            ).order_by().only('pk', 'reagent_id', 'month', 'movement_type')
+        }
+        updates = {existing[key]: value for key, value in deltas.items() if key in existing}
+        if updates:
+            ReagentMovementMonthly.objects.filter(pk__in=updates).update(
+                quantity=F('quantity') + Case(
+                    *[When(pk=pk, then=Value(value[0])) for pk, value in updates.items()],
+                    default=Value(Decimal('0')),
+                    output_field=DecimalField(max_digits=14, decimal_places=2),
+                ),
+                count=F('count') + Case(
+                    *[When(pk=pk, then=Value(value[1])) for pk, value in updates.items()],
+                    default=Value(0),
+                    output_field=IntegerField(),
+                ),
+            )
+        ReagentMovementMonthly.objects.bulk_create([
+            ReagentMovementMonthly(
+                reagent_id=key[0], month=key[1], movement_type=key[2],
+                quantity=value[0], count=value[1]
+            )
+            for key, value in deltas.items()
+            if key not in existing
+        ])
+
+
+def movement_deltas(movements, sign=1):
+    """Изменения итогов от списка движений (sign=-1 - при удалении)"""
+    deltas = defaultdict(lambda: [Decimal('0'), 0])
+    tz = timezone.get_current_timezone()
+    for movement in movements:
+        delta = deltas[month_key(movement, tz)]
+        delta[0] += sign * movement.quantity
+        delta[1] += sign
+    return deltas
+
+
+def add_movements(movements):
+    """Учитывает в итогах новые движения"""
+    apply_deltas(movement_deltas(movements))
+
+
+def remove_movements(movements):
+    """Исключает из итогов удалённые движения (кроме архивации)"""
+    if not getattr(_state, 'archiving', False):
+        apply_deltas(movement_deltas(movements, sign=-1))
+
+
+def replace_movement(old, new):
+    """Движение изменили: старые значения вычитаются, новые добавляются"""
+    deltas = movement_deltas([old], sign=-1)
+    for key, value in movement_deltas([new]).items():
+        deltas[key][0] += value[0]
+        deltas[key][1] += value[1]
+    apply_deltas(deltas)
+
+
+def _grouped_totals(queryset):
+    return queryset.annotate(
+        month=TruncMonth('date', output_field=DateField())
+    ).order_by().values('reagent', 'month', 'movement_type').annotate(
+        total=Sum('quantity'), movements=Count('id')
+    ).values_list('reagent', 'month', 'movement_type', 'total', 'movements')
+
+
+def rebuild_rollup():
+    """
+    Пересчитывает итоги заново по рабочей таблице и архиву
+    (два сгруппированных запроса). Возвращает количество строк итогов
+    """
+    totals = defaultdict(lambda: [Decimal('0'), 0])
+    for model in (ReagentMovement, ReagentMovementArchive):
+        for reagent_id, month, movement_type, total, count in _grouped_totals(model.objects.all()):
+            totals[(reagent_id, month, movement_type)][0] += total
+            totals[(reagent_id, month, movement_type)][1] += count
+
+    with transaction.atomic():
+        ReagentMovementMonthly.objects.all().delete()
+        ReagentMovementMonthly.objects.bulk_create([
+            ReagentMovementMonthly(
+                reagent_id=key[0], month=key[1], movement_type=key[2],
+                quantity=value[0], count=value[1]
+            )
+            for key, value in totals.items()
+        ], batch_size=1000)
+    return len(totals)
+
+
+# ============================================================================
+# АРХИВ
+# ============================================================================
+
+@contextmanager
+def _archiving():
+    """Удаление движений при архивации не должно менять итоги"""
+    _state.archiving = True
+    try:
+        yield
+    finally:
+        _state.archiving = False
+
+
+def archive_cutoff(months=RETENTION_MONTHS, today=None):
+    """
+    Граница архивации: начало месяца, отстоящего на months от текущего
+    Архивируются только целые месяцы
+    """
+    today = today or timezone.localdate()
+    index = today.year * 12 + today.month - 1 - months
+    first_day = today.replace(year=index // 12, month=index % 12 + 1, day=1)
+    return timezone.make_aware(datetime.combine(first_day, time.min))
+
+
+ARCHIVE_FIELDS = ['reagent_id', 'lot_id', 'quantity', 'movement_type', 'date', 'comment', 'user_id']
+
+
+def archive_movements(before, batch_size=ARCHIVE_BATCH_SIZE):
+    """
+    Переносит движения с датой раньше before в архив пакетами
+    (отдельная транзакция на пакет). Списания по партиям архивных движений
+    удаляются, ссылки резервов и инвентаризаций на них обнуляются.
+    Возвращает количество перенесённых движений
+    """
+    archived = 0
+    while True:
+        with transaction.atomic():
+            rows = list(
+                ReagentMovement.objects.filter(date__lt=before).order_by('pk').values(
+                    'pk', *ARCHIVE_FIELDS
+                )[:batch_size]
+            )
+            if not rows:
+                break
+            ReagentMovementArchive.objects.bulk_create([
+                ReagentMovementArchive(
+                    movement_id=row['pk'], **{field: row[field] for field in ARCHIVE_FIELDS}
+                )
+                for row in rows
+            ], batch_size=1000)
+            with _archiving():
+                ReagentMovement.objects.filter(pk__in=[row['pk'] for row in rows]).delete()
+        archived += len(rows)
+    return archived
@@ -0,0 +1,300 @@
+"""
+Полнотекстовый поиск по интранету DDC Biotech
+
+Тексты индексируемых объектов денормализуются в таблицу SearchEntry
+(обновляется сигналами). Поверх неё строится индекс базы данных:
+- SQLite: виртуальная таблица FTS5 intranet_searchentry_fts,
+  синхронизируется триггерами (см. миграцию 0002)
+- PostgreSQL: колонка tsvector search_vector с GIN-индексом,
+  словарь 'russian'
+
+Стемминг для SQLite выполняется на стороне Python (стеммер Snowball для
+русского языка): слова запроса приводятся к основе и ищутся как префиксы,
+поэтому «реагентов» находит «реагент», «реагенты», «реагента».
+"""
+
+import re
+
+from django.db import connection
+from django.db.models import Q
+from django.utils.html import escape
+
+from .models import (
+    Reagent, Task, Announcement, Culture, Recipe, DocumentTemplate, SearchEntry
+)
+
+
+# ============================================================================
+# ИНДЕКСИРУЕМЫЕ МОДЕЛИ
+# ============================================================================
+
+# kind -> (модель, поле заголовка, поле текста)
+INDEXED_MODELS = {
+    'reagent': (Reagent, 'name', None),
+    'task': (Task, 'title', 'description'),
+    'announcement': (Announcement, 'title', 'text'),
+    'culture': (Culture, 'name', 'notes'),
+    'recipe': (Recipe, 'name', 'description'),
+    'document': (DocumentTemplate, 'name', 'description'),
+}
+
+KIND_BY_MODEL = {model: kind for kind, (model, _, _) in INDEXED_MODELS.items()}
+
+# Маркеры подсветки внутри СУБД; заменяются на <mark> после экранирования
+HIGHLIGHT_START = '\x02'
+HIGHLIGHT_END = '\x03'
+
+
+def index_object(instance):
+    """Добавляет или обновляет объект в поисковом индексе"""
+    kind = KIND_BY_MODEL[type(instance)]
+    _, title_field, body_field = INDEXED_MODELS[kind]
+    SearchEntry.objects.update_or_create(
+        kind=kind,
+        object_id=instance.pk,
+        defaults={
+            'title': getattr(instance, title_field) or '',
+            'body': (getattr(instance, body_field) or '') if body_field else '',
+        },
+    )
+
+
+def remove_object(instance):
+    """Удаляет объект из поискового индекса"""
+    kind = KIND_BY_MODEL[type(instance)]
+    SearchEntry.objects.filter(kind=kind, object_id=instance.pk).delete()
+
+
+def rebuild_index():
+    """
+    Полностью перестраивает индекс по текущим данным
+    Возвращает количество проиндексированных объектов
+    """
+    entries = []
+    for kind, (model, title_field, body_field) in INDEXED_MODELS.items():
+        fields = ['pk', title_field] + ([body_field] if body_field else [])
+        for row in model.objects.values_list(*fields).iterator():
+            entries.append(SearchEntry(
+                kind=kind,
+                object_id=row[0],
+                title=row[1] or '',
+                body=(row[2] or '') if body_field else '',
+            ))
+
+    SearchEntry.objects.all().delete()
+    SearchEntry.objects.bulk_create(entries, batch_size=1000)
+    return len(entries)
+
+
+# ============================================================================
+# СТЕММЕР SNOWBALL ДЛЯ РУССКОГО ЯЗЫКА
+# ============================================================================
+
+_VOWELS = 'аеиоуыэюя'
+
+_PERFECTIVE_GERUND = (('в', 'вши', 'вшись'), ('ив', 'ивши', 'ившись', 'ыв', 'ывши', 'ывшись'))
+_ADJECTIVE = (
+    'ее', 'ие', 'ые', 'ое', 'ими', 'ыми', 'ей', 'ий', 'ый', 'ой', 'ем', 'им',
+    'ым', 'ом', 'его', 'ого', 'ему', 'ому', 'их', 'ых', 'ую', 'юю', 'ая',
+    'яя', 'ою', 'ею',
+)
+_PARTICIPLE = (('ем', 'нн', 'вш', 'ющ', 'щ'), ('ивш', 'ывш', 'ующ'))
+_REFLEXIVE = ('ся', 'сь')
+_VERB = (
+    ('ла', 'на', 'ете', 'йте', 'ли', 'й', 'л', 'ем', 'н', 'ло', 'но', 'ет',
+     'ют', 'ны', 'ть', 'ешь', 'нно'),
+    ('ила', 'ыла', 'ена', 'ейте', 'уйте', 'ите', 'или', 'ыли', 'ей', 'уй',
+     'ил', 'ыл', 'им', 'ым', 'ен', 'ило', 'ыло', 'ено', 'ят', 'ует', 'уют',
+     'ит', 'ыт', 'ены', 'ить', 'ыть', 'ишь', 'ую', 'ю'),
+)
+_NOUN = (
+    'а', 'ев', 'ов', 'ие', 'ье', 'е', 'иями', 'ями', 'ами', 'еи', 'ии', 'и',
+    'ией', 'ей', 'ой', 'ий', 'й', 'иям', 'ям', 'ием', 'ем', 'ам', 'ом', 'о',
+    'у', 'ах', 'иях', 'ях', 'ы', 'ь', 'ию', 'ью', 'ю', 'ия', 'ья', 'я',
+)
+_DERIVATIONAL = ('ост', 'ость')
+_SUPERLATIVE = ('ейш', 'ейше')
+
+
+def _strip_suffix(word, groups):
+    """
+    Удаляет самое длинное подходящее окончание (семантика among в Snowball)
+    groups - (окончания после 'а'/'я', окончания без условия)
+    Возвращает новое слово или None, если окончание не удалено
+    """
+    conditional, plain = groups
+    candidates = [(ending, True) for ending in conditional] + [(ending, False) for ending in plain]
+    for ending, needs_a in sorted(candidates, key=lambda item: -len(item[0])):
+        if word.endswith(ending):
+            stem = word[:-len(ending)]
+            if needs_a and not stem.endswith(('а', 'я')):
+                return None
+            return stem
+    return None
+
+
+def _strip_optional(word, groups):
+    """Как _strip_suffix, но при отсутствии окончания возвращает слово без изменений"""
+    result = _strip_suffix(word, groups)
+    return word if result is None else result
+
+
+def _region_start(word, start=0):
+    """Начало региона R1 (или R2 при start=R1) по правилам Snowball"""
+    for i in range(start + 1, len(word)):
+        if word[i] not in _VOWELS and word[i - 1] in _VOWELS:
+            return i + 1
+    return len(word)
+
+
+def stem(word):
+    """Возвращает основу русского слова; остальные слова - в нижнем регистре"""
+    word = word.lower().replace('ё', 'е')
+    if not re.search('[а-я]', word):
+        return word
+
+    rv_start = next((i + 1 for i, ch in enumerate(word) if ch in _VOWELS), len(word))
+    r2_start = _region_start(word, _region_start(word))
+    prefix, rv = word[:rv_start], word[rv_start:]
+
+    # Шаг 1
+    result = _strip_suffix(rv, _PERFECTIVE_GERUND)
+    if result is None:
+        rv = _strip_optional(rv, ((), _REFLEXIVE))
+        result = _strip_suffix(rv, ((), _ADJECTIVE))
+        if result is not None:
+            result = _strip_optional(result, _PARTICIPLE)
+        else:
+            result = _strip_suffix(rv, _VERB)
+            if result is None:
+                result = _strip_suffix(rv, ((), _NOUN))
+    rv = rv if result is None else result
+
+    # Шаг 2
+    if rv.endswith('и'):
+        rv = rv[:-1]
+
+    # Шаг 3: словообразовательные окончания в R2
+    for ending in sorted(_DERIVATIONAL, key=len, reverse=True):
+        if rv.endswith(ending) and rv_start + len(rv) - len(ending) >= r2_start:
+            rv = rv[:-len(ending)]
+            break
+
+    # Шаг 4
+    if rv.endswith('нн'):
+        rv = rv[:-1]
+    else:
+        superlative = _strip_suffix(rv, ((), _SUPERLATIVE))
+        if superlative is not None:
+            rv = superlative[:-1] if superlative.endswith('нн') else superlative
+        elif rv.endswith('ь'):
+            rv = rv[:-1]
+
+    return prefix + rv
+
+
+# ============================================================================
+# ПОИСК
+# ============================================================================
+
+def _query_terms(query):
+    """Слова запроса, приведённые к основе"""
+    return [stem(word) for word in re.findall(r'\w+', query) if word.strip('_')]
+
+
+def _highlight(text):
+    """Экранирует HTML и превращает маркеры СУБД в <mark>"""
+    return escape(text).replace(HIGHLIGHT_START, '<mark>').replace(HIGHLIGHT_END, '</mark>')
+
+
+def _search_sqlite(terms, kinds, limit):
+    match = ' '.join(f'"{term}"*' for term in terms)
+    kind_filter = ''
+    params = [HIGHLIGHT_START, HIGHLIGHT_END, match]
+    if kinds:
+        kind_filter = 'AND e.kind IN (%s)' % ', '.join(['%s'] * len(kinds))
+        params.extend(kinds)
+    params.append(limit)
+
+    # bm25: совпадение в заголовке весит в 10 раз больше, чем в тексте
+    sql = f"""
+        SELECT e.kind, e.object_id, e.title,
+               snippet(intranet_searchentry_fts, -1, %s, %s, '…', 16),
+               bm25(intranet_searchentry_fts, 10.0, 1.0) AS rank
+        FROM intranet_searchentry_fts
+        JOIN intranet_searchentry e ON e.id = intranet_searchentry_fts.rowid
+        WHERE intranet_searchentry_fts MATCH %s {kind_filter}
+        ORDER BY rank
+        LIMIT %s
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        # В bm25 меньшее значение - лучшее совпадение
+        return [(kind, pk, title, snippet, -rank) for kind, pk, title, snippet, rank in cursor.fetchall()]
+
+
+def _search_postgresql(query, kinds, limit):
+    kind_filter = ''
+    params = [f'StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_END}, MaxWords=20, MinWords=5', query]
+    if kinds:
+        kind_filter = 'AND e.kind = ANY(%s)'
+        params.append(list(kinds))
+    params.append(limit)
+
+    sql = f"""
+        SELECT e.kind, e.object_id, e.title,
+               ts_headline('russian', e.title || ' ' || e.body, q, %s),
+               ts_rank(e.search_vector, q) AS rank
+        FROM intranet_searchentry e, websearch_to_tsquery('russian', %s) q
+        WHERE e.search_vector @@ q {kind_filter}
+        ORDER BY rank DESC
+        LIMIT %s
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+def _search_fallback(terms, kinds, limit):
+    """Для СУБД без полнотекстового индекса - поиск подстрок без ранжирования"""
+    entries = SearchEntry.objects.all()
+    for term in terms:
+        entries = entries.filter(Q(title__icontains=term) | Q(body__icontains=term))
+    if kinds:
+        entries = entries.filter(kind__in=kinds)
+    return [
+        (entry.kind, entry.object_id, entry.title, entry.body[:200], 0.0)
+        for entry in entries[:limit]
+    ]
+
+
+def search(query, kinds=None, limit=20):
+    """
+    Ранжированный поиск по всем индексируемым моделям
+
+    Возвращает список словарей:
+    {'kind', 'kind_display', 'id', 'title', 'snippet' (HTML с <mark>), 'rank'}
+    """
+    terms = _query_terms(query)
+    if not terms:
+        return []
+
+    if connection.vendor == 'sqlite':
+        rows = _search_sqlite(terms, kinds, limit)
+    elif connection.vendor == 'postgresql':
+        rows = _search_postgresql(query, kinds, limit)
+    else:
+        rows = _search_fallback(terms, kinds, limit)
+
+    kind_names = dict(SearchEntry.KIND_CHOICES)
+    return [
+        {
+            'kind': kind,
+            'kind_display': kind_names.get(kind, kind),
+            'id': object_id,
+            'title': title,
+            'snippet': _highlight(snippet or ''),
+            'rank': round(float(rank), 4),
+        }
+        for kind, object_id, title, snippet, rank in rows
+    ]
@@ -2,19 +2,140 @@
 Сериализаторы для REST API интранета DDC Biotech
 """
 
+import math
+from decimal import Decimal
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
 from rest_framework import serializers
+
+from . import units
+from .prefetch import prefetch_latest, related_count
 from .models import (
     User, Reagent, ReagentMovement, Recipe, RecipeReagent,
     Culture, CultureEvent, Task, TaskComment, Announcement,
-    CalendarEvent, DocumentTemplate
+    CalendarEvent, DocumentTemplate, ReagentForecast, ReagentReservation,
+    ReagentLot, Stocktake, StocktakeLine
 )
 
 
+# ============================================================================
+# ВЫБОР ПОЛЕЙ (?fields=, ?expand=)
+# ============================================================================
+
+def query_param_set(request, name):
+    """Значения параметра запроса через запятую или None"""
+    value = request.query_params.get(name) if request is not None else None
+    if not value:
+        return None
+    return {item.strip() for item in value.split(',') if item.strip()}
+
+
+class DynamicFieldsMixin:
+    """
+    Выбор полей ответа параметрами запроса (только у сериализатора
+    верхнего уровня):
+    ?fields=id,name    - только перечисленные поля (для GET)
+    ?expand=comments   - вложенные коллекции из Meta.expandable_fields;
+                         без запроса они не выводятся и не загружаются
+                         (см. related_lookups)
+    """
+    
+    def is_root(self):
+        parent = self.parent
+        if isinstance(parent, serializers.ListSerializer):
+            parent = parent.parent
+        return parent is None
+    
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.context.get('request') if self.is_root() else None
+        expand = query_param_set(request, 'expand') or set()
+        only = query_param_set(request, 'fields') if request is not None and request.method == 'GET' else None
+        
+        for name in getattr(self.Meta, 'expandable_fields', ()):
+            if name not in expand and (only is None or name not in only):
+                fields.pop(name, None)
+        if only is not None:
+            for name in set(fields) - only:
+                fields.pop(name)
+        return fields
+
+
+def _relation(model, name):
+    """Связь модели по имени поля или атрибута обратной связи ('recipereagent_set')"""
+    try:
+        field = model._meta.get_field(name)
+    except FieldDoesNotExist:
+        field = next(
+            (rel for rel in model._meta.related_objects if rel.get_accessor_name() == name), None
+        )
+    return field if field is not None and field.is_relation else None
+
+
+def _related_model(model, names):
+    """Модель в конце пути связей или None, если путь - не цепочка связей"""
+    for name in names:
+        field = _relation(model, name)
+        if field is None:
+            return None
+        model = field.related_model
+    return model
+
+
+def related_lookups(serializer):
+    """
+    Какие связи нужны для вывода полей сериализатора:
+    (select_related, prefetch_related, annotate). Источники вида
+    'reagent.name' - JOIN; вложенные коллекции - Prefetch с собственными
+    JOIN (один запрос на коллекцию), ограниченные Meta.nested_limits;
+    many-to-many без вложенного сериализатора - prefetch id;
+    Meta.count_fields - подзапросы с числом дочерних записей
+    """
+    model = serializer.Meta.model
+    limits = getattr(serializer.Meta, 'nested_limits', {})
+    counts = getattr(serializer.Meta, 'count_fields', {})
+    fields = serializer.fields
+    select = set()
+    prefetch = {}
+    annotations = {
+        name: related_count(model, lookup) for name, lookup in counts.items() if name in fields
+    }
+    for name, field in fields.items():
+        if field.source == '*' or name in annotations:
+            continue
+        names = field.source.split('.')
+        if isinstance(field, (serializers.ListSerializer, serializers.ManyRelatedField)):
+            related_model = _related_model(model, names)
+            if related_model is None:
+                continue
+            path = '__'.join(names)
+            if isinstance(field, serializers.ListSerializer):
+                nested_select, nested_prefetch, nested_annotations = related_lookups(field.child)
+                queryset = related_model._default_manager.prefetch_related(*nested_prefetch)
+                if nested_select:
+                    queryset = queryset.select_related(*nested_select)
+                if nested_annotations:
+                    queryset = queryset.annotate(**nested_annotations)
+                if name in limits:
+                    prefetch[path] = prefetch_latest(model, path, limits[name], queryset)
+                else:
+                    prefetch[path] = Prefetch(path, queryset=queryset)
+            else:
+                prefetch.setdefault(path, path)
+            continue
+        if not isinstance(field, serializers.BaseSerializer):
+            names = names[:-1]
+        if names and _related_model(model, names) is not None:
+            select.add('__'.join(names))
+    return sorted(select), list(prefetch.values()), annotations
+
+
 # ============================================================================
 # ПОЛЬЗОВАТЕЛИ
 # ============================================================================
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """Сериализатор для модели пользователя"""
     full_name = serializers.SerializerMethodField()
     role_display = serializers.CharField(source='get_role_display', read_only=True)
@@ -36,9 +157,11 @@ class UserSerializer(serializers.ModelSerializer):
 # РЕАГЕНТЫ
 # ============================================================================
 
-class ReagentSerializer(serializers.ModelSerializer):
+class ReagentSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """Сериализатор для модели реагента"""
     category_display = serializers.CharField(source='get_category_display', read_only=True)
+    unit_display = serializers.CharField(source='get_unit_display', read_only=True)
+    available = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
     is_critical = serializers.SerializerMethodField()
     is_expiring_soon = serializers.SerializerMethodField()
     url = serializers.SerializerMethodField()
@@ -47,11 +170,14 @@ class ReagentSerializer(serializers.ModelSerializer):
         model = Reagent
         fields = [
             'id', 'name', 'category', 'category_display', 'on_hand',
-            'min_threshold', 'expiry_date', 'image', 'certificate',
+            'unit', 'unit_display', 'density', 'reserved', 'available', 'min_threshold', 'recommended_threshold', 'recommended_at',
+            'expiry_date', 'image', 'certificate',
             'external_link', 'is_critical', 'is_expiring_soon',
             'created_at', 'updated_at', 'url'
         ]
-        read_only_fields = ['created_at', 'updated_at']
+        read_only_fields = [
+            'reserved', 'recommended_threshold', 'recommended_at', 'created_at', 'updated_at'
+        ]
     
     def get_is_critical(self, obj):
         return obj.is_critical()
@@ -66,36 +192,251 @@ class ReagentSerializer(serializers.ModelSerializer):
         return obj.get_absolute_url()
 
 
-class ReagentMovementSerializer(serializers.ModelSerializer):
+class ReagentForecastSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    """Сериализатор прогноза расхода реагента"""
+    reagent_name = serializers.CharField(source='reagent.name', read_only=True)
+    on_hand = serializers.DecimalField(
+        source='reagent.on_hand', max_digits=10, decimal_places=2, read_only=True
+    )
+    min_threshold = serializers.DecimalField(
+        source='reagent.min_threshold', max_digits=10, decimal_places=2, read_only=True
+    )
+    
+    class Meta:
+        model = ReagentForecast
+        fields = [
+            'reagent', 'reagent_name', 'on_hand', 'min_threshold',
+            'daily_rate_7d', 'daily_rate_30d', 'daily_rate', 'days_left',
+            'stockout_date', 'reorder_date', 'computed_at'
+        ]
+
+
+class ReagentReservationSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    """Сериализатор для резервов реагентов"""
+    reagent_name = serializers.CharField(source='reagent.name', read_only=True)
+    user_name = serializers.CharField(source='user.username', read_only=True)
+    status_display = serializers.CharField(source='get_status_display', read_only=True)
+    
+    class Meta:
+        model = ReagentReservation
+        fields = [
+            'id', 'reagent', 'reagent_name', 'quantity', 'recipe', 'task',
+            'status', 'status_display', 'movement', 'comment', 'user', 'user_name',
+            'created_at', 'closed_at'
+        ]
+        read_only_fields = fields
+
+
+class ReagentReservationItemSerializer(serializers.Serializer):
+    """Позиция резерва: реагент и количество в его единице учёта"""
+    reagent = serializers.PrimaryKeyRelatedField(queryset=Reagent.objects.all())
+    quantity = serializers.DecimalField(
+        max_digits=10, decimal_places=2, min_value=Decimal('0.01')
+    )
+
+
+class ReagentReservationCreateSerializer(serializers.Serializer):
+    """
+    Запрос резервирования: под рецептуру (recipe + batches - количества
+    берутся из состава) или под задачу (task + items)
+    """
+    recipe = serializers.PrimaryKeyRelatedField(queryset=Recipe.objects.all(), required=False)
+    batches = serializers.DecimalField(
+        max_digits=10, decimal_places=2, min_value=Decimal('0.01'), required=False
+    )
+    task = serializers.PrimaryKeyRelatedField(queryset=Task.objects.all(), required=False)
+    items = ReagentReservationItemSerializer(many=True, required=False)
+    comment = serializers.CharField(required=False, allow_blank=True, default='')
+    
+    def validate(self, data):
+        if not data.get('recipe') and not data.get('task'):
+            raise serializers.ValidationError('Укажите рецептуру или задачу')
+        if not data.get('items') and not (data.get('recipe') and data.get('batches')):
+            raise serializers.ValidationError(
+                'Укажите позиции (items) или рецептуру и количество партий (batches)'
+            )
+        return data
+
+
+class StocktakeLineSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    """Строка инвентаризации"""
+    reagent_name = serializers.CharField(source='reagent.name', read_only=True)
+    unit = serializers.CharField(source='reagent.unit', read_only=True)
+    lot_number = serializers.CharField(source='lot.lot_number', read_only=True, default=None)
+    
+    class Meta:
+        model = StocktakeLine
+        fields = [
+            'reagent', 'reagent_name', 'unit', 'lot', 'lot_number', 'expected', 'counted',
+            'difference', 'movement'
+        ]
+        read_only_fields = fields
+
+
+class StocktakeSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    """Сериализатор для инвентаризаций"""
+    user_name = serializers.CharField(source='user.username', read_only=True)
+    
+    class Meta:
+        model = Stocktake
+        fields = ['id', 'comment', 'user', 'user_name', 'reagents_counted', 'discrepancies', 'created_at']
+        read_only_fields = fields
+
+
+class StocktakeCountSerializer(serializers.Serializer):
+    """
+    Фактический остаток реагента или его партии (для реагентов с партиями)
+    Реагенты и партии проверяются отдельно - одним запросом для всех строк
+    """
+    reagent = serializers.IntegerField()
+    lot = serializers.IntegerField(required=False, allow_null=True, default=None)
+    counted = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=Decimal('0'))
+
+
+class StocktakeCreateSerializer(serializers.Serializer):
+    """Запрос инвентаризации: фактические остатки реагентов"""
+    MAX_ROWS = 5000
+    
+    counts = StocktakeCountSerializer(many=True, allow_empty=False, max_length=MAX_ROWS)
+    comment = serializers.CharField(required=False, allow_blank=True, default='')
+    dry_run = serializers.BooleanField(required=False, default=False)
+    
+    def validate_counts(self, value):
+        keys = [(item['reagent'], item['lot']) for item in value]
+        if len(set(keys)) != len(keys):
+            raise serializers.ValidationError('Реагент или партия указаны несколько раз')
+        return value
+
+
+class ReagentLotSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    """Сериализатор для партий реагентов"""
+    reagent_name = serializers.CharField(source='reagent.name', read_only=True)
+    
+    class Meta:
+        model = ReagentLot
+        fields = [
+            'id', 'reagent', 'reagent_name', 'lot_number', 'barcode', 'expiry_date',
+            'on_hand', 'certificate', 'received_at'
+        ]
+    
+    def validate_barcode(self, value):
+        # Пустой штрихкод хранится как NULL, иначе уникальный индекс
+        # не допустит больше одной партии без штрихкода
+        return value or None
+    
+    def validate_reagent(self, value):
+        # Остаток партии учтён в остатке реагента - перенос партии
+        # к другому реагенту разошёлся бы с журналом движений
+        if self.instance is not None and value.pk != self.instance.reagent_id:
+            raise serializers.ValidationError('Партию нельзя перенести к другому реагенту')
+        return value
+
+
+class ReagentMovementSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """Сериализатор для движений реагентов"""
     reagent_name = serializers.CharField(source='reagent.name', read_only=True)
     user_name = serializers.CharField(source='user.username', read_only=True)
     movement_type_display = serializers.CharField(source='get_movement_type_display', read_only=True)
+    lot_number = serializers.CharField(source='lot.lot_number', read_only=True, default=None)
     
     class Meta:
         model = ReagentMovement
         fields = [
             'id', 'reagent', 'reagent_name', 'quantity', 'movement_type',
-            'movement_type_display', 'date', 'comment', 'user', 'user_name'
+            'movement_type_display', 'lot', 'lot_number', 'date', 'comment',
+            'user', 'user_name'
         ]
         read_only_fields = ['date']
+    
+    def validate(self, attrs):
+        lot = attrs.get('lot')
+        reagent = attrs.get('reagent') or getattr(self.instance, 'reagent', None)
+        if lot is not None and lot.reagent_id != reagent.pk:
+            raise serializers.ValidationError({'lot': 'Партия относится к другому реагенту'})
+        if self.instance is None:
+            error = ReagentMovement(
+                reagent=reagent, lot=lot, movement_type=attrs.get('movement_type')
+            ).lot_error()
+            if error:
+                raise serializers.ValidationError({'lot': error})
+        return attrs
+
+
+class ReagentMovementBulkItemSerializer(serializers.Serializer):
+    """
+    Строка пакетной загрузки движений
+    Реагент и партия проверяются отдельно - одним запросом для всех строк
+    """
+    reagent = serializers.IntegerField()
+    quantity = serializers.DecimalField(
+        max_digits=10, decimal_places=2, min_value=Decimal('0.01')
+    )
+    movement_type = serializers.ChoiceField(choices=ReagentMovement.MOVEMENT_CHOICES)
+    lot = serializers.IntegerField(required=False, allow_null=True, default=None)
+    date = serializers.DateTimeField(required=False)
+    comment = serializers.CharField(required=False, allow_blank=True, default='')
+
+
+class ReagentMovementBulkSerializer(serializers.Serializer):
+    """
+    Запрос пакетной загрузки движений
+    mode: atomic - всё или ничего, partial - принимаются корректные строки
+    """
+    MODE_CHOICES = [
+        ('atomic', 'Всё или ничего'),
+        ('partial', 'Частичное принятие'),
+    ]
+    MAX_ROWS = 5000
+    
+    mode = serializers.ChoiceField(choices=MODE_CHOICES, default='atomic')
+    movements = serializers.ListField(
+        child=serializers.DictField(),
+        allow_empty=False,
+        max_length=MAX_ROWS
+    )
 
 
 # ============================================================================
 # РЕЦЕПТУРЫ
 # ============================================================================
 
-class RecipeReagentSerializer(serializers.ModelSerializer):
-    """Сериализатор для реагентов в рецептуре"""
+class RecipeReagentListSerializer(serializers.ListSerializer):
+    """
+    Список реагентов рецептуры: количество в единице учёта реагента
+    пересчитывается одним векторным вызовом для всего списка
+    """
+    
+    def to_representation(self, data):
+        items = list(data.all() if hasattr(data, 'all') else data)
+        rows = super().to_representation(items)
+        converted = units.convert(
+            [item.quantity for item in items],
+            [item.unit for item in items],
+            [item.reagent.unit for item in items],
+            [item.reagent.density for item in items],
+        )
+        for row, item, value in zip(rows, items, converted.tolist()):
+            row['stock_unit'] = item.reagent.unit
+            row['quantity_in_stock_unit'] = None if math.isnan(value) else round(value, 4)
+        return rows
+
+
+class RecipeReagentSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    """
+    Сериализатор для реагентов в рецептуре
+    quantity_in_stock_unit - количество в единице учёта реагента
+    (None, если пересчёт невозможен); заполняется при many=True
+    """
     reagent_name = serializers.CharField(source='reagent.name', read_only=True)
     unit_display = serializers.CharField(source='get_unit_display', read_only=True)
     
     class Meta:
         model = RecipeReagent
         fields = ['id', 'reagent', 'reagent_name', 'quantity', 'unit', 'unit_display']
+        list_serializer_class = RecipeReagentListSerializer
 
 
-class RecipeSerializer(serializers.ModelSerializer):
+class RecipeSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """Сериализатор для рецептур"""
     author_name = serializers.CharField(source='author.username', read_only=True)
     status_display = serializers.CharField(source='get_status_display', read_only=True)
@@ -111,11 +452,38 @@ class RecipeSerializer(serializers.ModelSerializer):
         read_only_fields = ['created_at', 'updated_at', 'approved_at']
 
 
+class RecipePlanItemSerializer(serializers.Serializer):
+    """Строка производственного плана: рецептура и количество партий"""
+    recipe = serializers.IntegerField()
+    batches = serializers.DecimalField(
+        max_digits=10, decimal_places=2, min_value=Decimal('0.01')
+    )
+
+
+class RecipePlanSerializer(serializers.Serializer):
+    """
+    Запрос планировщика потребности в реагентах
+    horizon_days - через сколько дней начнётся производство (учитывается прогноз расхода)
+    """
+    MAX_ITEMS = 1000
+    
+    items = RecipePlanItemSerializer(many=True, allow_empty=False)
+    horizon_days = serializers.IntegerField(required=False, default=0, min_value=0, max_value=365)
+    only_shortfalls = serializers.BooleanField(required=False, default=False)
+    
+    def validate_items(self, value):
+        if len(value) > self.MAX_ITEMS:
+            raise serializers.ValidationError(
+                f'Не более {self.MAX_ITEMS} строк в одном плане'
+            )
+        return value
+
+
 # ============================================================================
 # КУЛЬТУРЫ
 # ============================================================================
 
-class CultureEventSerializer(serializers.ModelSerializer):
+class CultureEventSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """Сериализатор для событий культуры"""
     culture_name = serializers.CharField(source='culture.name', read_only=True)
     user_name = serializers.CharField(source='user.username', read_only=True)
@@ -130,28 +498,32 @@ class CultureEventSerializer(serializers.ModelSerializer):
         read_only_fields = ['date']
 
 
-class CultureSerializer(serializers.ModelSerializer):
-    """Сериализатор для культур"""
+class CultureSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    """Сериализатор для культур (5 последних событий - по ?expand=recent_events)"""
     status_display = serializers.CharField(source='get_status_display', read_only=True)
     responsible_name = serializers.CharField(source='responsible.username', read_only=True)
     recipe_name = serializers.CharField(source='recipe.name', read_only=True)
     recent_events = CultureEventSerializer(source='events', many=True, read_only=True)
+    events_count = serializers.IntegerField(read_only=True)
     
     class Meta:
         model = Culture
         fields = [
             'id', 'name', 'status', 'status_display', 'seeding_date',
             'passage_number', 'recipe', 'recipe_name', 'responsible',
-            'responsible_name', 'notes', 'recent_events'
+            'responsible_name', 'notes', 'events_count', 'recent_events'
         ]
         read_only_fields = ['seeding_date']
+        expandable_fields = ['recent_events']
+        nested_limits = {'recent_events': 5}
+        count_fields = {'events_count': 'events'}
 
 
 # ============================================================================
 # ЗАДАЧИ
 # ============================================================================
 
-class TaskCommentSerializer(serializers.ModelSerializer):
+class TaskCommentSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """Сериализатор для комментариев к задачам"""
     user_name = serializers.CharField(source='user.username', read_only=True)
     
@@ -161,14 +533,15 @@ class TaskCommentSerializer(serializers.ModelSerializer):
         read_only_fields = ['date']
 
 
-class TaskSerializer(serializers.ModelSerializer):
-    """Сериализатор для задач"""
+class TaskSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    """Сериализатор для задач (3 последних комментария - по ?expand=comments)"""
     status_display = serializers.CharField(source='get_status_display', read_only=True)
     priority_display = serializers.CharField(source='get_priority_display', read_only=True)
     assignee_name = serializers.CharField(source='assignee.username', read_only=True)
     creator_name = serializers.CharField(source='creator.username', read_only=True)
     is_overdue = serializers.SerializerMethodField()
     comments = TaskCommentSerializer(many=True, read_only=True)
+    comments_count = serializers.IntegerField(read_only=True)
     
     class Meta:
         model = Task
@@ -176,9 +549,12 @@ class TaskSerializer(serializers.ModelSerializer):
             'id', 'title', 'description', 'assignee', 'assignee_name',
             'creator', 'creator_name', 'status', 'status_display',
             'priority', 'priority_display', 'deadline', 'is_overdue',
-            'created_at', 'updated_at', 'comments'
+            'created_at', 'updated_at', 'comments_count', 'comments'
         ]
         read_only_fields = ['created_at', 'updated_at']
+        expandable_fields = ['comments']
+        nested_limits = {'comments': 3}
+        count_fields = {'comments_count': 'comments'}
     
     def get_is_overdue(self, obj):
         return obj.is_overdue()
@@ -188,7 +564,7 @@ class TaskSerializer(serializers.ModelSerializer):
 # ОБЪЯВЛЕНИЯ И КАЛЕНДАРЬ
 # ============================================================================
 
-class AnnouncementSerializer(serializers.ModelSerializer):
+class AnnouncementSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """Сериализатор для объявлений"""
     author_name = serializers.CharField(source='author.username', read_only=True)
     
@@ -201,8 +577,8 @@ class AnnouncementSerializer(serializers.ModelSerializer):
         read_only_fields = ['published_at']
 
 
-class CalendarEventSerializer(serializers.ModelSerializer):
-    """Сериализатор для событий календаря"""
+class CalendarEventSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    """Сериализатор для событий календаря (участники - по ?expand=participants_list)"""
     organizer_name = serializers.CharField(source='organizer.username', read_only=True)
     participants_list = UserSerializer(source='participants', many=True, read_only=True)
     
@@ -213,9 +589,10 @@ class CalendarEventSerializer(serializers.ModelSerializer):
             'organizer', 'organizer_name', 'participants', 'participants_list',
             'location'
         ]
+        expandable_fields = ['participants_list']
 
 
-class DocumentTemplateSerializer(serializers.ModelSerializer):
+class DocumentTemplateSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """Сериализатор для документов"""
     uploaded_by_name = serializers.CharField(source='uploaded_by.username', read_only=True)
     file_url = serializers.SerializerMethodField()
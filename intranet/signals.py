@@ -0,0 +1,257 @@
+"""
+Обработчики сигналов интранета DDC Biotech
+Подключаются в IntranetConfig.ready()
+"""
+
+from decimal import Decimal
+
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver, Signal
+
+from . import barcodes, dashboard_cache, planning, rollups, search
+from .authentication import forget_tokens
+from .autocomplete import reagent_index
+from .models import (
+    User, ApiToken, Announcement, Task, TaskComment, Reagent, ReagentLot, ReagentMovement, Culture,
+    CultureEvent, Recipe, RecipeReagent
+)
+
+
+# Изменились остатки или резервы реагентов в обход ReagentMovement.save()
+# (массовые операции, резервирование). Аргументы: reagent_ids - список id реагентов
+stock_changed = Signal()
+
+
+# ============================================================================
+# ИНВАЛИДАЦИЯ КЕША ДАШБОРДА
+# ============================================================================
+
+# Какие группы виджетов затрагивает изменение модели.
+# Движение меняет остаток реагента через update(), поэтому
+# сбрасывает и виджеты реагентов. По тем же поколениям строятся ETag
+# списков (conditional.py): комментарии и события входят в ответы
+# API задач и культур
+DASHBOARD_GROUPS = {
+    Announcement: [dashboard_cache.GROUP_ANNOUNCEMENTS],
+    Task: [dashboard_cache.GROUP_TASKS],
+    TaskComment: [dashboard_cache.GROUP_TASKS],
+    Reagent: [dashboard_cache.GROUP_REAGENTS],
+    ReagentLot: [dashboard_cache.GROUP_REAGENTS],
+    ReagentMovement: [dashboard_cache.GROUP_MOVEMENTS, dashboard_cache.GROUP_REAGENTS],
+    Culture: [dashboard_cache.GROUP_CULTURES],
+    CultureEvent: [dashboard_cache.GROUP_CULTURES],
+}
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def invalidate_dashboard_cache(sender, **kwargs):
+    """Сбрасывает виджеты дашборда при изменении связанных моделей"""
+    groups = DASHBOARD_GROUPS.get(sender)
+    if groups:
+        dashboard_cache.invalidate(*groups)
+
+
+@receiver(stock_changed)
+def invalidate_dashboard_stock(sender, **kwargs):
+    """Массовые операции со складом не отправляют post_save"""
+    dashboard_cache.invalidate(dashboard_cache.GROUP_MOVEMENTS, dashboard_cache.GROUP_REAGENTS)
+
+
+# ============================================================================
+# КЕШ СКАНИРОВАНИЯ ШТРИХКОДОВ
+# ============================================================================
+# Сбрасываются записи только затронутых реагентов (barcodes.invalidate_reagents)
+
+@receiver(post_save, sender=Reagent)
+@receiver(post_delete, sender=Reagent)
+def invalidate_reagent_scans(sender, instance, **kwargs):
+    barcodes.invalidate_reagents([instance.pk])
+
+
+@receiver(post_save, sender=ReagentLot)
+@receiver(post_delete, sender=ReagentLot)
+@receiver(post_save, sender=ReagentMovement)
+@receiver(post_delete, sender=ReagentMovement)
+def invalidate_related_scans(sender, instance, **kwargs):
+    # При изменении движения остаток меняется и у прежнего реагента
+    previous = getattr(instance, '_previous', None)
+    barcodes.invalidate_reagents(
+        [instance.reagent_id] + ([previous.reagent_id] if previous is not None else [])
+    )
+
+
+@receiver(stock_changed)
+def invalidate_stock_scans(sender, reagent_ids, **kwargs):
+    barcodes.invalidate_reagents(reagent_ids)
+
+
+# ============================================================================
+# ПАРТИИ РЕАГЕНТОВ
+# ============================================================================
+
+@receiver(pre_save, sender=ReagentLot)
+def hold_lot_quantity(sender, instance, raw=False, **kwargs):
+    """
+    Остаток партии не переписывается при сохранении: запрошенный остаток
+    запоминается, а в базу уходит учтённый. Разницу проводит
+    корректирующее движение (apply_lot_changes)
+    """
+    if raw:
+        return
+    recorded = None
+    if instance.pk is not None:
+        recorded = ReagentLot.objects.filter(pk=instance.pk).values_list('on_hand', flat=True).first()
+    instance._requested_on_hand = instance.on_hand
+    instance.on_hand = recorded if recorded is not None else Decimal('0')
+
+
+@receiver(post_save, sender=ReagentLot)
+def apply_lot_changes(sender, instance, created, raw=False, **kwargs):
+    """
+    Партию изменили напрямую (админка, API): изменение остатка проводится
+    движением, срок годности реагента пересчитывается по партиям.
+    Остаток реагента до первой партии переносится в начальную партию.
+    Движения меняют партии через update() и сюда не попадают
+    """
+    requested = instance.__dict__.pop('_requested_on_hand', None)
+    if raw:
+        return
+    # inventory импортирует stock_changed из этого модуля
+    from . import inventory
+    if created:
+        inventory.open_lot_balance(instance)
+    if requested is None or inventory.adjust_lot(instance, requested) is None:
+        inventory.refresh_lot_rollups([instance.reagent_id])
+        inventory.notify_stock_changed([instance.reagent_id])
+
+
+@receiver(post_delete, sender=ReagentLot)
+def refresh_reagent_expiry(sender, instance, **kwargs):
+    """Срок годности реагента - по оставшимся партиям (см. inventory.delete_lot)"""
+    from . import inventory
+    inventory.refresh_lot_rollups([instance.reagent_id])
+    inventory.notify_stock_changed([instance.reagent_id])
+
+
+# ============================================================================
+# МЕСЯЧНЫЕ ИТОГИ ДВИЖЕНИЙ
+# ============================================================================
+# Новые движения учитываются в inventory.register_movements (в т.ч. массовые),
+# здесь - изменение и удаление отдельных движений
+
+@receiver(pre_save, sender=ReagentMovement)
+def remember_previous_movement(sender, instance, raw=False, **kwargs):
+    if raw or instance._state.adding:
+        return
+    instance._previous = ReagentMovement.objects.filter(pk=instance.pk).only(
+        'reagent_id', 'date', 'movement_type', 'quantity'
+    ).first()
+
+
+@receiver(post_save, sender=ReagentMovement)
+def update_rollup_on_change(sender, instance, created, raw=False, **kwargs):
+    previous = instance.__dict__.pop('_previous', None)
+    if not created and not raw and previous is not None:
+        rollups.replace_movement(previous, instance)
+
+
+@receiver(post_delete, sender=ReagentMovement)
+def update_rollup_on_delete(sender, instance, **kwargs):
+    rollups.remove_movements([instance])
+
+
+# ============================================================================
+# ПОИСКОВЫЙ ИНДЕКС
+# ============================================================================
+
+@receiver(post_save)
+def update_search_index(sender, instance, raw=False, **kwargs):
+    """Обновляет запись поискового индекса при сохранении объекта"""
+    if sender in search.KIND_BY_MODEL and not raw:
+        search.index_object(instance)
+
+
+@receiver(post_delete)
+def remove_from_search_index(sender, instance, **kwargs):
+    """Удаляет объект из поискового индекса"""
+    if sender in search.KIND_BY_MODEL:
+        search.remove_object(instance)
+
+
+# ============================================================================
+# АВТОДОПОЛНЕНИЕ НАЗВАНИЙ РЕАГЕНТОВ
+# ============================================================================
+
+@receiver(pre_save, sender=Reagent)
+def remember_indexed_name(sender, instance, raw=False, **kwargs):
+    """Название и категория до сохранения - индекс меняется, только если они изменились"""
+    if raw or instance._state.adding:
+        return
+    instance._indexed = Reagent.objects.filter(pk=instance.pk).values_list('name', 'category').first()
+
+
+@receiver(post_save, sender=Reagent)
+def update_reagent_index(sender, instance, raw=False, **kwargs):
+    """Инкрементально обновляет индекс автодополнения"""
+    previous = instance.__dict__.pop('_indexed', None)
+    if not raw:
+        reagent_index.update(instance, previous)
+
+
+@receiver(post_delete, sender=Reagent)
+def remove_from_reagent_index(sender, instance, **kwargs):
+    reagent_index.remove(instance.pk)
+
+
+# ============================================================================
+# ДОСТУПНОСТЬ РЕЦЕПТУР
+# ============================================================================
+
+@receiver(post_save, sender=ReagentMovement)
+@receiver(post_delete, sender=ReagentMovement)
+def invalidate_availability_on_movement(sender, instance, **kwargs):
+    """Сбрасывает доступность, только если реагент входит в рецептуры"""
+    planning.invalidate_availability([instance.reagent_id])
+
+
+@receiver(post_save, sender=Reagent)
+@receiver(post_delete, sender=Reagent)
+def invalidate_availability_on_reagent(sender, instance, **kwargs):
+    planning.invalidate_availability([instance.pk])
+
+
+@receiver(stock_changed)
+def invalidate_availability_on_stock_change(sender, reagent_ids, **kwargs):
+    planning.invalidate_availability(reagent_ids)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_save, sender=RecipeReagent)
+@receiver(post_delete, sender=RecipeReagent)
+def invalidate_availability_on_recipe(sender, **kwargs):
+    """Изменился состав или статус рецептуры"""
+    planning.invalidate_availability()
+
+
+# ============================================================================
+# ТОКЕНЫ API
+# ============================================================================
+
+@receiver(post_save, sender=ApiToken)
+@receiver(post_delete, sender=ApiToken)
+def forget_token(sender, instance, **kwargs):
+    """Отозванный или изменённый токен не должен действовать из кеша"""
+    forget_tokens([instance])
+
+
+@receiver(post_save, sender=User)
+def forget_user_tokens(sender, instance, raw=False, **kwargs):
+    """
+    В кеше хранится и пользователь токена: после любого сохранения
+    (деактивация, смена прав) токены читаются из базы заново
+    """
+    if raw:
+        return
+    forget_tokens(instance.api_tokens.only('key_hash'))
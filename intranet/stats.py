@@ -0,0 +1,69 @@
+"""
+Сервис статистики интранета DDC Biotech
+
+Все счётчики считаются условной агрегацией (Count/Sum с filter=Q(...)):
+один запрос на таблицу вместо отдельного count() на каждое значение.
+Используется дашбордом, шаблонным тегом get_user_stats и /api/stats/.
+"""
+
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Task, Reagent, Culture, ReagentMovement, ReagentMovementMonthly
+
+
+def user_task_stats(user):
+    """
+    Счётчики задач пользователя за один проход по таблице задач
+    """
+    if not user or not user.is_authenticated:
+        return {}
+
+    return Task.objects.filter(assignee=user).aggregate(
+        total_tasks=Count('id'),
+        pending_tasks=Count('id', filter=Q(status='new')),
+        in_progress_tasks=Count('id', filter=Q(status='in_progress')),
+        completed_tasks=Count('id', filter=Q(status='done')),
+        open_tasks=Count('id', filter=~Q(status='done')),
+        overdue_tasks=Count(
+            'id',
+            filter=Q(deadline__lt=timezone.now()) & ~Q(status='done')
+        ),
+    )
+
+
+def global_stats():
+    """
+    Общие счётчики: по одному агрегату на реагенты, культуры и движения
+    """
+    stats = Reagent.objects.aggregate(
+        total_reagents=Count('id'),
+        critical_reagents=Count('id', filter=Q(on_hand__lt=F('min_threshold'))),
+    )
+    stats.update(Culture.objects.aggregate(
+        total_cultures=Count('id'),
+        active_cultures=Count('id', filter=Q(status='active')),
+    ))
+
+    # Количество движений по каждому типу из MOVEMENT_CHOICES - по месячным
+    # итогам (включают архив), а не по журналу движений
+    movement_totals = ReagentMovementMonthly.objects.aggregate(**{
+        movement_type: Coalesce(Sum('count', filter=Q(movement_type=movement_type)), 0)
+        for movement_type, _ in ReagentMovement.MOVEMENT_CHOICES
+    })
+    stats['movements'] = movement_totals
+
+    return stats
+
+
+def movements_by_type(stats):
+    """
+    Движения по типам в формате values().annotate() -
+    [{'movement_type': 'in', 'total': 10}, ...], только ненулевые
+    """
+    return [
+        {'movement_type': movement_type, 'total': total}
+        for movement_type, total in stats['movements'].items()
+        if total
+    ]
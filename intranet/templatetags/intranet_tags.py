@@ -6,6 +6,7 @@ from django import template
 from django.db.models import Count, Q
 from django.utils import timezone
 from intranet.models import Task, Announcement, Reagent
+from intranet import dashboard_cache, stats
 
 register = template.Library()
 
@@ -20,10 +21,10 @@ def count_pending_tasks(user=None):
     Подсчитывает количество незавершенных задач
     Если передан пользователь, считает только его задачи
     """
-    tasks = Task.objects.exclude(status='done')
     if user and user.is_authenticated:
-        tasks = tasks.filter(assignee=user)
-    return tasks.count()
+        # Берём из кешированной статистики пользователя (общий с дашбордом)
+        return dashboard_cache.user_task_stats(user)['open_tasks']
+    return Task.objects.exclude(status='done').count()
 
 
 @register.simple_tag
@@ -149,23 +150,8 @@ def get_user_stats(user):
     """
     Возвращает статистику пользователя
     """
-    if not user or not user.is_authenticated:
-        return {}
-    
-    stats = {
-        'total_tasks': Task.objects.filter(assignee=user).count(),
-        'pending_tasks': Task.objects.filter(
-            assignee=user, status='new'
-        ).count(),
-        'in_progress_tasks': Task.objects.filter(
-            assignee=user, status='in_progress'
-        ).count(),
-        'completed_tasks': Task.objects.filter(
-            assignee=user, status='done'
-        ).count(),
-    }
-    
-    return stats
+    # Все счётчики считаются одним запросом, см. intranet.stats
+    return stats.user_task_stats(user)
 
 
 @register.simple_tag
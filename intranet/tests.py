@@ -1,3 +1,1639 @@
+"""
+Тесты интранета DDC Biotech
+"""
+
+import base64
+import io
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+
+import numpy as np
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from . import (
+    authentication, barcodes, csv_import, dashboard_cache, forecasting, history, inventory, planning, rollups, search,
+    stats, units
+)
+from .autocomplete import VERSION_CACHE_KEY, ReagentNameIndex
+from .models import (
+    User, Reagent, ReagentMovement, ReagentStockSnapshot, ReagentForecast,
+    ReagentReservation, ReagentLot, ReagentLotAllocation, ReagentMovementMonthly,
+    ReagentMovementArchive, Recipe, RecipeReagent, Stocktake, Task, TaskComment, Announcement,
+    Culture, CultureEvent, CalendarEvent
+)
+from .prefetch import prefetch_latest
+
+
+class DashboardCacheTests(TestCase):
+    """Кеширование виджетов дашборда"""
+
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user('alice', password='pass')
+        self.bob = User.objects.create_user('bob', password='pass')
+
+    def test_user_tasks_are_cached_per_user(self):
+        Task.objects.create(title='Посев', description='-', assignee=self.alice)
+
+        self.assertEqual(len(dashboard_cache.user_tasks(self.alice)), 1)
+        self.assertEqual(len(dashboard_cache.user_tasks(self.bob)), 0)
+
+    def test_widget_is_served_from_cache(self):
+        dashboard_cache.latest_announcements()
+        with self.assertNumQueries(0):
+            dashboard_cache.latest_announcements()
+
+    def test_save_invalidates_widget(self):
+        self.assertEqual(dashboard_cache.latest_announcements(), [])
+        Announcement.objects.create(title='Собрание', text='В пятницу')
+        self.assertEqual(len(dashboard_cache.latest_announcements()), 1)
+
+    def test_movement_invalidates_reagent_widgets(self):
+        reagent = Reagent.objects.create(
+            name='FBS', category='media', on_hand=10, min_threshold=5
+        )
+        self.assertEqual(dashboard_cache.critical_reagents(), [])
+
+        ReagentMovement.objects.create(
+            reagent=reagent, quantity=Decimal('8'), movement_type='out'
+        )
+        self.assertEqual(dashboard_cache.critical_reagents(), [reagent])
+
+    def test_local_cache_bounds_staleness(self):
+        # LocMemCache не общий для воркеров: поколения и виджеты живут 5 минут
+        self.assertFalse(dashboard_cache.SHARED_CACHE)
+        self.assertEqual(dashboard_cache.WIDGET_TIMEOUT, 5 * 60)
+        self.assertEqual(dashboard_cache.GENERATION_TIMEOUT, 5 * 60)
+
+    def test_dashboard_shows_only_own_tasks(self):
+        Task.objects.create(title='Задача Алисы', description='-', assignee=self.alice)
+
+        self.client.force_login(self.alice)
+        self.client.get(reverse('dashboard'))
+        self.client.force_login(self.bob)
+        response = self.client.get(reverse('dashboard'))
+
+        self.assertNotContains(response, 'Задача Алисы')
+
+
+class StatsTests(TestCase):
+    """Сервис статистики и число запросов дашборда"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('alice', password='pass')
+
+    def create_data(self, count):
+        for i in range(count):
+            Task.objects.create(
+                title=f'Задача {i}', description='-', assignee=self.user,
+                status=['new', 'in_progress', 'done'][i % 3]
+            )
+            reagent = Reagent.objects.create(
+                name=f'Реагент {i}', category='buffer', on_hand=1, min_threshold=5
+            )
+            ReagentMovement.objects.create(
+                reagent=reagent, quantity=1, movement_type=['in', 'out'][i % 2]
+            )
+            Announcement.objects.create(
+                title=f'Объявление {i}', text='-', author=self.user
+            )
+
+    def test_user_task_stats(self):
+        self.create_data(6)
+        result = stats.user_task_stats(self.user)
+
+        self.assertEqual(result['total_tasks'], 6)
+        self.assertEqual(result['pending_tasks'], 2)
+        self.assertEqual(result['in_progress_tasks'], 2)
+        self.assertEqual(result['completed_tasks'], 2)
+        self.assertEqual(result['open_tasks'], 4)
+
+    def test_global_stats_use_one_query_per_table(self):
+        self.create_data(4)
+        with self.assertNumQueries(3):
+            result = stats.global_stats()
+
+        self.assertEqual(result['total_reagents'], 4)
+        self.assertEqual(result['movements'], {'in': 2, 'out': 2})
+
+    def test_dashboard_query_count_does_not_grow(self):
+        self.client.force_login(self.user)
+        # Сессия, пользователь, 6 виджетов, 3 агрегата, пагинатор объявлений
+        expected_queries = 12
+
+        self.create_data(2)
+        cache.clear()
+        with self.assertNumQueries(expected_queries):
+            self.client.get(reverse('dashboard'))
+
+        self.create_data(20)
+        cache.clear()
+        with self.assertNumQueries(expected_queries):
+            self.client.get(reverse('dashboard'))
+
+    def test_stats_api(self):
+        self.create_data(3)
+        self.client.force_login(self.user)
+        response = self.client.get('/api/stats/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['user']['total_tasks'], 3)
+        self.assertEqual(response.json()['global']['total_reagents'], 3)
+
+
+class SearchTests(TestCase):
+    """Полнотекстовый поиск"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('alice', password='pass')
+        Reagent.objects.create(name='Трипсин', category='enzyme')
+        Task.objects.create(
+            title='Пересев культуры', description='Обработать трипсином флаконы',
+            assignee=self.user
+        )
+        Announcement.objects.create(
+            title='Поставка реагентов', text='Привезли новые реагенты', author=self.user
+        )
+
+    def test_stemmer(self):
+        self.assertEqual(search.stem('реагентов'), search.stem('реагенты'))
+        self.assertEqual(search.stem('культурами'), 'культур')
+
+    def test_search_matches_word_forms(self):
+        results = search.search('реагентов')
+
+        self.assertEqual([r['kind'] for r in results], ['announcement'])
+        self.assertIn('<mark>', results[0]['snippet'])
+
+    def test_title_match_ranks_first(self):
+        results = search.search('трипсин')
+
+        self.assertEqual([r['kind'] for r in results], ['reagent', 'task'])
+
+    def test_index_follows_updates_and_deletes(self):
+        reagent = Reagent.objects.get(name='Трипсин')
+        reagent.name = 'Коллагеназа'
+        reagent.save()
+        self.assertEqual(len(search.search('коллагеназа')), 1)
+
+        reagent.delete()
+        self.assertEqual(search.search('коллагеназа'), [])
+
+    def test_snippet_is_escaped(self):
+        Announcement.objects.create(title='<script>', text='скрипт <b>жирный</b>')
+        snippet = search.search('жирный')[0]['snippet']
+
+        self.assertNotIn('<b>', snippet)
+        self.assertIn('&lt;b&gt;', snippet)
+
+    def test_dashboard_links_every_result(self):
+        self.client.force_login(self.user)
+        results = self.client.get('/', {'q': 'трипсин'}).context['search_results']
+        self.assertEqual([r['kind'] for r in results], ['reagent'])
+
+        self.user.is_staff = True
+        self.user.save()
+        results = self.client.get('/', {'q': 'трипсин'}).context['search_results']
+        task = Task.objects.get()
+        self.assertEqual(
+            [r['url'] for r in results],
+            [reverse('reagent_detail', args=[Reagent.objects.get().pk]),
+             reverse('admin:intranet_task_change', args=[task.pk])]
+        )
+
+    def test_search_api(self):
+        self.client.force_login(self.user)
+        response = self.client.get('/api/search/', {'q': 'трипсин', 'kind': 'task'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['count'], 1)
+
+
+class ReagentAutocompleteTests(TestCase):
+    """Индекс автодополнения названий реагентов"""
+
+    def setUp(self):
+        cache.clear()
+        self.index = ReagentNameIndex()
+        for name in ['DMEM (Среда Игла модифицированная)', 'Трипсин-ЭДТА', 'Трис-HCl буфер']:
+            Reagent.objects.create(name=name, category='other')
+        self.index.build()
+
+    def names(self, query):
+        return [item['name'] for item in self.index.search(query)]
+
+    def test_prefix_search_mixed_alphabets(self):
+        self.assertEqual(self.names('dmem сре'), ['DMEM (Среда Игла модифицированная)'])
+        self.assertEqual(self.names('игл'), ['DMEM (Среда Игла модифицированная)'])
+        self.assertEqual(self.names('Трис')[0], 'Трис-HCl буфер')
+
+    def test_typo_tolerance(self):
+        self.assertEqual(self.names('трипсен')[0], 'Трипсин-ЭДТА')
+
+    def test_wrong_keyboard_layout(self):
+        self.assertEqual(self.names('nhbgcby')[0], 'Трипсин-ЭДТА')
+
+    def test_search_does_not_hit_database(self):
+        with self.assertNumQueries(0):
+            self.index.search('dmem')
+
+    def test_incremental_update(self):
+        reagent = Reagent.objects.get(name='Трипсин-ЭДТА')
+        reagent.name = 'Коллагеназа'
+        self.index.update(reagent)
+        self.assertEqual(self.names('коллаг'), ['Коллагеназа'])
+
+        self.index.remove(reagent.pk)
+        self.assertEqual(self.names('коллаг'), [])
+
+    def test_unrelated_edit_keeps_version(self):
+        reagent = Reagent.objects.get(name='Трипсин-ЭДТА')
+        version = cache.get(VERSION_CACHE_KEY)
+
+        # Остаток и порог не входят в индекс - другие процессы не перестраивают его
+        reagent.min_threshold = 5
+        reagent.save()
+        self.assertEqual(cache.get(VERSION_CACHE_KEY), version)
+
+        reagent.name = 'Трипсин 0,25%'
+        reagent.save()
+        self.assertNotEqual(cache.get(VERSION_CACHE_KEY), version)
+
+    def test_expired_version_rebuilds_sorted_index(self):
+        # Переименование в другом процессе (без сигналов в этом) видно
+        # после истечения локальной версии
+        Reagent.objects.filter(name='Трипсин-ЭДТА').update(name='Коллагеназа')
+        self.assertEqual(self.names('коллаг'), [])
+        cache.delete(VERSION_CACHE_KEY)
+        self.assertEqual(self.names('коллаг'), ['Коллагеназа'])
+        self.assertEqual(self.index._tokens, sorted(self.index._tokens))
+
+    def test_autocomplete_api(self):
+        user = User.objects.create_user('alice', password='pass')
+        self.client.force_login(user)
+        Reagent.objects.create(name='FBS', category='media')
+
+        response = self.client.get('/api/reagents/autocomplete/', {'q': 'fb'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['name'] for item in response.json()], ['FBS'])
+
+
+class BulkMovementTests(TestCase):
+    """Пакетная загрузка движений реагентов"""
+
+    url = '/api/reagent-movements/bulk/'
+
+    def setUp(self):
+        self.user = User.objects.create_user('alice', password='pass')
+        self.client.force_login(self.user)
+        self.fbs = Reagent.objects.create(name='FBS', category='media', on_hand=100)
+        self.pbs = Reagent.objects.create(name='PBS', category='buffer', on_hand=10)
+
+    def post(self, movements, mode='atomic'):
+        return self.client.post(
+            self.url, {'mode': mode, 'movements': movements}, content_type='application/json'
+        )
+
+    def test_atomic_bulk_updates_stock_in_one_query(self):
+        movements = [
+            {'reagent': self.fbs.pk, 'quantity': '1.5', 'movement_type': 'out'}
+            for _ in range(200)
+        ] + [{'reagent': self.pbs.pk, 'quantity': '5', 'movement_type': 'in'}]
+
+        # Остатки обоих реагентов - одним UPDATE;
+        # + один запрос партий для распределения расхода по FEFO
+        # + месячные итоги одним INSERT ... ON CONFLICT DO UPDATE
+        # + поиск снимков, устаревших из-за движений задним числом
+        # + есть ли партии у реагентов прихода без партии
+        with self.assertNumQueries(12):
+            response = self.post(movements)
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['created'], 201)
+        self.fbs.refresh_from_db()
+        self.pbs.refresh_from_db()
+        self.assertEqual(self.fbs.on_hand, Decimal('-200.00'))
+        self.assertEqual(self.pbs.on_hand, Decimal('15.00'))
+        self.assertEqual(ReagentMovement.objects.filter(user=self.user).count(), 201)
+
+    def test_atomic_mode_rejects_everything_on_error(self):
+        response = self.post([
+            {'reagent': self.fbs.pk, 'quantity': '1', 'movement_type': 'out'},
+            {'reagent': 999, 'quantity': '1', 'movement_type': 'out'},
+            {'reagent': self.fbs.pk, 'quantity': '-1', 'movement_type': 'out'},
+        ])
+
+        self.assertEqual(response.status_code, 400)
+        statuses = [row['status'] for row in response.json()['results']]
+        self.assertEqual(statuses, ['skipped', 'error', 'error'])
+        self.assertFalse(ReagentMovement.objects.exists())
+
+    def test_partial_mode_accepts_valid_rows(self):
+        response = self.post([
+            {'reagent': self.fbs.pk, 'quantity': '10', 'movement_type': 'out'},
+            {'reagent': self.fbs.pk, 'quantity': '1', 'movement_type': 'sideways'},
+        ], mode='partial')
+
+        self.assertEqual(response.status_code, 201)
+        results = response.json()['results']
+        self.assertEqual(results[0]['status'], 'created')
+        self.assertIn('id', results[0])
+        self.assertEqual(results[1]['status'], 'error')
+        self.fbs.refresh_from_db()
+        self.assertEqual(self.fbs.on_hand, Decimal('90.00'))
+
+
+class StockSnapshotTests(TestCase):
+    """Остаток на дату по снимкам"""
+
+    def setUp(self):
+        self.reagent = Reagent.objects.create(name='FBS', category='media', on_hand=0)
+        self.start = timezone.now() - timedelta(days=30)
+        for day in range(30):
+            ReagentMovement.objects.create(
+                reagent=self.reagent, quantity=10, movement_type='in',
+                date=self.start + timedelta(days=day)
+            )
+        self.reagent.refresh_from_db()
+
+    def test_stock_at_without_snapshots_replays_back_from_current(self):
+        result = inventory.stock_at(self.reagent, self.start + timedelta(days=9, hours=1))
+
+        self.assertEqual(result['on_hand'], Decimal('100'))
+        self.assertEqual(result['source'], 'current')
+
+    def test_stock_at_uses_nearest_snapshot(self):
+        ReagentStockSnapshot.objects.create(
+            reagent=self.reagent, on_hand=Decimal('50'),
+            taken_at=self.start + timedelta(days=4, hours=12)
+        )
+        result = inventory.stock_at(self.reagent, self.start + timedelta(days=6, hours=1))
+
+        self.assertEqual(result['on_hand'], Decimal('70'))
+        self.assertEqual(result['source'], 'snapshot')
+        self.assertEqual(result['replayed_movements'], 2)
+
+    def test_backdated_movement_discards_later_snapshots(self):
+        early = ReagentStockSnapshot.objects.create(
+            reagent=self.reagent, on_hand=Decimal('50'),
+            taken_at=self.start + timedelta(days=4, hours=12)
+        )
+        inventory.take_snapshots()
+        moment = self.start + timedelta(days=20, hours=1)
+        self.assertEqual(inventory.stock_at(self.reagent, moment)['on_hand'], Decimal('210'))
+
+        # Пакетная загрузка задним числом: позже снятый снимок движение не учитывает
+        inventory.create_movements([ReagentMovement(
+            reagent=self.reagent, quantity=Decimal('5'), movement_type='out',
+            date=self.start + timedelta(days=10, hours=1)
+        )])
+        self.assertEqual(list(ReagentStockSnapshot.objects.all()), [early])
+
+        self.reagent.refresh_from_db()
+        result = inventory.stock_at(self.reagent, moment)
+        self.assertEqual(result['on_hand'], Decimal('205'))
+        earlier = inventory.stock_at(self.reagent, self.start + timedelta(days=6, hours=1))
+        self.assertEqual(earlier['on_hand'], Decimal('70'))
+
+    def test_take_snapshots_min_movements(self):
+        self.assertEqual(inventory.take_snapshots(min_movements=5), 1)
+        self.assertEqual(inventory.take_snapshots(min_movements=5), 0)
+        self.assertEqual(
+            ReagentStockSnapshot.objects.get().on_hand, self.reagent.on_hand
+        )
+
+    def test_stock_at_api(self):
+        user = User.objects.create_user('alice', password='pass')
+        self.client.force_login(user)
+        day = (self.start + timedelta(days=2)).date().isoformat()
+
+        response = self.client.get(f'/api/reagents/{self.reagent.pk}/stock-at/', {'ts': day})
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.get(f'/api/reagents/{self.reagent.pk}/stock-at/', {'ts': 'вчера'})
+        self.assertEqual(response.status_code, 400)
+
+
+class StockReconciliationTests(TestCase):
+    """Сверка остатков с журналом движений"""
+
+    def setUp(self):
+        self.fbs = Reagent.objects.create(name='FBS', category='media')
+        self.pbs = Reagent.objects.create(name='PBS', category='buffer')
+        for reagent in (self.fbs, self.pbs):
+            ReagentMovement.objects.create(reagent=reagent, quantity=10, movement_type='in')
+            ReagentMovement.objects.create(reagent=reagent, quantity=3, movement_type='out')
+
+    def test_no_drift_for_ledger_driven_stock(self):
+        self.assertEqual(inventory.find_stock_drift(), [])
+
+    def test_drift_is_found_and_repaired(self):
+        Reagent.objects.filter(pk=self.fbs.pk).update(on_hand=0)
+
+        with self.assertNumQueries(2):
+            drifts = inventory.find_stock_drift()
+        self.assertEqual(len(drifts), 1)
+        self.assertEqual(drifts[0]['expected'], Decimal('7'))
+
+        self.assertEqual(inventory.repair_stock_drift(drifts), 1)
+        self.fbs.refresh_from_db()
+        self.assertEqual(self.fbs.on_hand, Decimal('7'))
+        self.assertEqual(inventory.find_stock_drift(), [])
+
+
+class ForecastTests(TestCase):
+    """Прогноз расхода и даты окончания остатков"""
+
+    def setUp(self):
+        now = timezone.now()
+        self.today = timezone.localdate()
+        self.fbs = Reagent.objects.create(name='FBS', category='media', min_threshold=20)
+        self.pbs = Reagent.objects.create(name='PBS', category='buffer', min_threshold=1)
+        ReagentMovement.objects.create(
+            reagent=self.fbs, quantity=100, movement_type='in', date=now - timedelta(days=40)
+        )
+        ReagentMovement.objects.create(
+            reagent=self.pbs, quantity=5, movement_type='in', date=now - timedelta(days=40)
+        )
+        for day in range(30):
+            ReagentMovement.objects.create(
+                reagent=self.fbs, quantity=2, movement_type='out',
+                date=now - timedelta(days=day)
+            )
+
+    def test_consumption_matrix_single_query(self):
+        ids, _, _ = forecasting.load_catalog()
+        with self.assertNumQueries(1):
+            matrix = forecasting.consumption_matrix(ids, today=self.today)
+        self.assertEqual(matrix.shape, (2, forecasting.HISTORY_DAYS))
+        self.assertEqual(matrix[0].sum(), 60)
+        self.assertEqual(matrix[1].sum(), 0)
+
+    def test_refresh_forecasts(self):
+        self.assertEqual(forecasting.refresh_forecasts(today=self.today), 2)
+
+        fbs = ReagentForecast.objects.get(reagent=self.fbs)
+        self.assertEqual(fbs.daily_rate, Decimal('2'))
+        self.assertEqual(fbs.days_left, Decimal('20'))
+        self.assertEqual(fbs.stockout_date, self.today + timedelta(days=20))
+        self.assertEqual(fbs.reorder_date, self.today + timedelta(days=10))
+
+        pbs = ReagentForecast.objects.get(reagent=self.pbs)
+        self.assertIsNone(pbs.stockout_date)
+        self.assertIsNone(pbs.days_left)
+
+    def test_forecast_api_and_widget(self):
+        forecasting.refresh_forecasts(today=self.today)
+        user = User.objects.create_user('alice', password='pass')
+        self.client.force_login(user)
+
+        response = self.client.get('/api/reagents/forecast/', {'days': 30})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['reagent'] for row in response.data['results']], [self.fbs.pk])
+
+        self.assertEqual([f.reagent_id for f in dashboard_cache.stockout_forecast()], [self.fbs.pk])
+
+
+class SafetyStockTests(TestCase):
+    """Рекомендуемый минимальный порог по статистике расхода"""
+
+    def setUp(self):
+        now = timezone.now()
+        self.steady = Reagent.objects.create(name='FBS', category='media', on_hand=1000)
+        self.bursty = Reagent.objects.create(name='PBS', category='buffer', on_hand=1000)
+        self.unused = Reagent.objects.create(name='DMSO', category='chemical', min_threshold=5)
+        for day in range(10):
+            ReagentMovement.objects.create(
+                reagent=self.steady, quantity=2, movement_type='out',
+                date=now - timedelta(days=day)
+            )
+        for day in range(0, 10, 5):
+            ReagentMovement.objects.create(
+                reagent=self.bursty, quantity=10, movement_type='out',
+                date=now - timedelta(days=day)
+            )
+
+    def test_threshold_grows_with_variance(self):
+        ids, thresholds = forecasting.recommend_thresholds(
+            lead_time_days=7, service_level=0.95, history_days=10
+        )
+        by_id = dict(zip(ids.tolist(), thresholds.tolist()))
+
+        # Одинаковый средний расход, но у неравномерного - больший запас
+        self.assertEqual(by_id[self.steady.pk], 14)
+        self.assertGreater(by_id[self.bursty.pk], by_id[self.steady.pk])
+        self.assertTrue(np.isnan(by_id[self.unused.pk]))
+
+    def test_invalid_service_level(self):
+        with self.assertRaises(ValueError):
+            forecasting.recommend_thresholds(service_level=1.5)
+
+    def test_refresh_and_apply_in_admin(self):
+        self.assertEqual(
+            forecasting.refresh_recommended_thresholds(lead_time_days=7, history_days=10), 2
+        )
+        self.unused.refresh_from_db()
+        self.assertIsNone(self.unused.recommended_threshold)
+
+        admin_user = User.objects.create_superuser('admin', 'admin@example.com', 'pass')
+        self.client.force_login(admin_user)
+        response = self.client.post(reverse('admin:intranet_reagent_changelist'), {
+            'action': 'apply_recommended_thresholds',
+            '_selected_action': [self.steady.pk, self.unused.pk],
+        })
+        self.assertEqual(response.status_code, 302)
+
+        self.steady.refresh_from_db()
+        self.unused.refresh_from_db()
+        self.assertEqual(self.steady.min_threshold, Decimal('14'))
+        self.assertEqual(self.unused.min_threshold, Decimal('5'))
+
+
+class StockoutRiskTests(TestCase):
+    """Вероятность окончания остатка (Монте-Карло)"""
+
+    def setUp(self):
+        cache.clear()
+        now = timezone.now()
+        self.busy = Reagent.objects.create(name='FBS', category='media', on_hand=10)
+        self.idle = Reagent.objects.create(name='PBS', category='buffer', on_hand=10)
+        for day in range(30):
+            ReagentMovement.objects.create(
+                reagent=self.busy, quantity=1, movement_type='out',
+                date=now - timedelta(days=day)
+            )
+        self.busy.refresh_from_db()
+
+    def test_simulate_chunk_is_vectorized_over_reagents(self):
+        matrix = np.array([[1.0] * 10, [0.0] * 10, [5.0, 0.0] * 5])
+        on_hand = np.array([5.0, 5.0, 1000.0])
+        probabilities = forecasting.simulate_stockout_risk(
+            matrix, on_hand, trials=200, horizon_days=10, seed=1, workers=1
+        )
+        self.assertEqual(probabilities.tolist(), [1.0, 0.0, 0.0])
+
+    def test_stockout_risk_is_cached_until_new_movements(self):
+        risk = forecasting.stockout_risk(horizon_days=30, trials=200, seed=1)
+        by_id = {row['reagent_id']: row['probability'] for row in risk['results']}
+        self.assertGreater(by_id[self.busy.pk], 0.5)
+        self.assertEqual(by_id[self.idle.pk], 0.0)
+
+        with self.assertNumQueries(0):
+            forecasting.stockout_risk(horizon_days=30, trials=200)
+
+        ReagentMovement.objects.create(reagent=self.idle, quantity=1, movement_type='out')
+        with self.assertNumQueries(2):
+            forecasting.stockout_risk(horizon_days=30, trials=200)
+
+    def test_stockout_risk_api(self):
+        user = User.objects.create_user('alice', password='pass')
+        self.client.force_login(user)
+
+        response = self.client.get(
+            '/api/reagents/stockout-risk/', {'days': 30, 'trials': 500, 'min_probability': 0.5}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['reagent'] for row in response.data['results']], [self.busy.pk])
+
+        response = self.client.get('/api/reagents/stockout-risk/', {'days': 0})
+        self.assertEqual(response.status_code, 400)
+
+        # Тяжёлые расчёты в запросе не выполняются
+        response = self.client.get('/api/reagents/stockout-risk/', {'days': 365, 'trials': 10000})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/api/reagents/stockout-risk/', {'days': 45})
+        self.assertEqual(response.status_code, 400)
+
+
+class RecipePlanTests(TestCase):
+    """Планирование потребности в реагентах по плану производства"""
+
+    def setUp(self):
+        self.fbs = Reagent.objects.create(name='FBS', category='media', on_hand=100)
+        self.dmso = Reagent.objects.create(name='DMSO', category='chemical', on_hand=1, unit='g')
+        self.medium = Recipe.objects.create(name='Среда', description='')
+        self.freeze = Recipe.objects.create(name='Заморозка', description='')
+        RecipeReagent.objects.create(recipe=self.medium, reagent=self.fbs, quantity=5, unit='ml')
+        RecipeReagent.objects.create(recipe=self.freeze, reagent=self.fbs, quantity=500, unit='ul')
+        RecipeReagent.objects.create(recipe=self.freeze, reagent=self.dmso, quantity=100, unit='mg')
+
+    def test_plan_demand_normalizes_units(self):
+        with self.assertNumQueries(3):
+            result = planning.plan_demand([
+                (self.medium.pk, 12), (self.freeze.pk, 4), (self.medium.pk, 2)
+            ])
+
+        rows = {row['reagent_id']: row for row in result['reagents']}
+        self.assertEqual(rows[self.fbs.pk]['required'], 72)
+        self.assertEqual(rows[self.fbs.pk]['unit'], 'ml')
+        self.assertEqual(rows[self.fbs.pk]['shortfall'], 0)
+        self.assertEqual(rows[self.dmso.pk]['required'], 0.4)
+        self.assertEqual(rows[self.dmso.pk]['shortfall'], 0)
+
+    def test_mass_to_volume_needs_density(self):
+        RecipeReagent.objects.create(recipe=self.medium, reagent=self.dmso, quantity=550, unit='ul')
+        result = planning.plan_demand([(self.medium.pk, 2)])
+        self.assertEqual(len(result['unconvertible']), 1)
+
+        Reagent.objects.filter(pk=self.dmso.pk).update(density=Decimal('1.1'))
+        result = planning.plan_demand([(self.medium.pk, 2)])
+        rows = {row['reagent_id']: row for row in result['reagents']}
+        self.assertEqual(result['unconvertible'], [])
+        self.assertEqual(rows[self.dmso.pk]['required'], 1.21)
+        self.assertEqual(rows[self.dmso.pk]['shortfall'], 0.21)
+
+    def test_forecast_consumption_adds_to_demand(self):
+        ReagentForecast.objects.create(reagent=self.fbs, daily_rate=5)
+        result = planning.plan_demand([(self.medium.pk, 12)], horizon_days=10)
+
+        self.assertEqual(result['reagents'][0]['forecast_consumption'], 50)
+        self.assertEqual(result['reagents'][0]['shortfall'], 10)
+
+    def test_plan_api(self):
+        user = User.objects.create_user('alice', password='pass')
+        self.client.force_login(user)
+
+        response = self.client.post('/api/recipes/plan/', {
+            'items': [{'recipe': self.medium.pk, 'batches': 30}],
+            'only_shortfalls': True,
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['shortfall_count'], 1)
+        self.assertEqual(response.data['reagents'][0]['shortfall'], 50)
+
+        response = self.client.post('/api/recipes/plan/', {
+            'items': [{'recipe': 999, 'batches': 1}],
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['missing_recipes'], [999])
+
+
+class UnitConversionTests(TestCase):
+    """Пересчёт единиц измерения"""
+
+    def test_convert_batch(self):
+        result = units.convert(
+            [1, 500, 2, 1, 1],
+            ['ml', 'ul', 'mg', 'g', 'units'],
+            ['ul', 'ml', 'g', 'ml', 'ml'],
+            [None, None, None, Decimal('2'), None],
+        )
+        self.assertEqual(result[:4].tolist(), [1000, 0.5, 0.002, 0.5])
+        self.assertTrue(np.isnan(result[4]))
+
+    def test_unknown_unit(self):
+        with self.assertRaises(units.UnitConversionError):
+            units.convert([1], ['l'], ['ml'])
+
+    def test_recipe_serializer_converts_to_stock_unit(self):
+        reagent = Reagent.objects.create(name='FBS', category='media', unit='ml')
+        recipe = Recipe.objects.create(name='Среда', description='')
+        RecipeReagent.objects.create(recipe=recipe, reagent=reagent, quantity=250, unit='ul')
+        user = User.objects.create_user('alice', password='pass')
+        self.client.force_login(user)
+
+        response = self.client.get(f'/api/recipes/{recipe.pk}/')
+        row = response.data['recipe_reagents'][0]
+        self.assertEqual(row['stock_unit'], 'ml')
+        self.assertEqual(row['quantity_in_stock_unit'], 0.25)
+
+
+class RecipeAvailabilityTests(TestCase):
+    """Сколько партий рецептуры можно приготовить из текущих остатков"""
+
+    def setUp(self):
+        cache.clear()
+        self.fbs = Reagent.objects.create(name='FBS', category='media', on_hand=150)
+        self.dmem = Reagent.objects.create(name='DMEM', category='media', on_hand=1000)
+        self.unused = Reagent.objects.create(name='PBS', category='buffer', on_hand=10)
+        self.user = User.objects.create_user('alice', password='pass')
+        self.medium = Recipe.objects.create(
+            name='Среда', description='', status='approved', author=self.user
+        )
+        self.draft = Recipe.objects.create(name='Черновик', description='', author=self.user)
+        RecipeReagent.objects.create(recipe=self.medium, reagent=self.fbs, quantity=50, unit='ml')
+        RecipeReagent.objects.create(recipe=self.medium, reagent=self.dmem, quantity=450000, unit='ul')
+        RecipeReagent.objects.create(recipe=self.draft, reagent=self.fbs, quantity=1, unit='ml')
+
+    def test_single_query_min_ratio(self):
+        with self.assertNumQueries(1):
+            result = planning.compute_availability()
+
+        self.assertEqual(len(result['recipes']), 1)
+        row = result['recipes'][0]
+        self.assertEqual(row['batches'], 2)
+        self.assertEqual(row['limiting_reagent_id'], self.dmem.pk)
+
+    def test_cache_invalidated_only_by_used_reagents(self):
+        planning.recipe_availability()
+
+        ReagentMovement.objects.create(reagent=self.unused, quantity=1, movement_type='out')
+        with self.assertNumQueries(0):
+            planning.recipe_availability()
+
+        ReagentMovement.objects.create(reagent=self.dmem, quantity=500, movement_type='out')
+        self.assertEqual(planning.recipe_availability()['recipes'][0]['batches'], 1)
+
+    def test_admin_bulk_actions_refresh_availability(self):
+        admin_user = User.objects.create_superuser('admin', password='pass')
+        self.client.force_login(admin_user)
+        planning.recipe_availability()
+
+        self.client.post(reverse('admin:intranet_recipe_changelist'), {
+            'action': 'approve_recipes', '_selected_action': [self.draft.pk],
+        })
+        self.assertEqual(len(planning.recipe_availability()['recipes']), 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('admin:intranet_reagent_changelist'), {
+                'action': 'mark_as_critical', '_selected_action': [self.fbs.pk],
+            })
+        self.assertEqual(
+            [row['batches'] for row in planning.recipe_availability()['recipes']], [0, 0]
+        )
+
+    def test_availability_api_and_recipe_list(self):
+        self.client.force_login(self.user)
+
+        response = self.client.get('/api/recipes/availability/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'][0]['limiting_reagent_name'], 'DMEM')
+
+        response = self.client.get(reverse('recipe_list'))
+        self.assertContains(response, 'Можно приготовить: 2 парт.')
+
+
+class ReservationTests(TestCase):
+    """Резервирование реагентов"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('alice', password='pass')
+        self.fbs = Reagent.objects.create(name='FBS', category='media', on_hand=100)
+        self.pbs = Reagent.objects.create(name='PBS', category='buffer', on_hand=10)
+        self.task = Task.objects.create(title='Эксперимент', creator=self.user, assignee=self.user)
+
+    def test_reserve_updates_available_incrementally(self):
+        inventory.reserve([(self.fbs.pk, 60), (self.pbs.pk, 4)], task=self.task, user=self.user)
+        self.fbs.refresh_from_db()
+        self.assertEqual(self.fbs.reserved, Decimal('60'))
+        self.assertEqual(self.fbs.available, Decimal('40'))
+
+        # Второй резерв на тот же остаток не проходит, и ничего не создаётся
+        with self.assertRaises(inventory.InsufficientStockError) as context:
+            inventory.reserve([(self.fbs.pk, 50), (self.pbs.pk, 1)], task=self.task)
+        self.assertEqual([item['reagent_id'] for item in context.exception.shortages], [self.fbs.pk])
+        self.assertEqual(ReagentReservation.objects.count(), 2)
+
+    def test_consume_creates_out_movement(self):
+        reservation, = inventory.reserve([(self.fbs.pk, 30)], task=self.task, user=self.user)
+        consumed = inventory.consume_reservations([reservation.pk])
+        self.assertEqual(len(consumed), 1)
+
+        self.fbs.refresh_from_db()
+        self.assertEqual(self.fbs.on_hand, Decimal('70'))
+        self.assertEqual(self.fbs.reserved, Decimal('0'))
+        reservation.refresh_from_db()
+        self.assertEqual(reservation.status, 'consumed')
+        self.assertEqual(reservation.movement.movement_type, 'out')
+
+        # Повторно резерв не расходуется
+        self.assertEqual(inventory.consume_reservations([reservation.pk]), [])
+
+    def test_cancel_releases_reserved(self):
+        reservation, = inventory.reserve([(self.pbs.pk, 10)], task=self.task)
+        inventory.cancel_reservations([reservation.pk])
+        self.pbs.refresh_from_db()
+        self.assertEqual(self.pbs.reserved, Decimal('0'))
+        self.assertEqual(self.pbs.on_hand, Decimal('10'))
+
+    def test_reserve_for_recipe_api(self):
+        recipe = Recipe.objects.create(name='Среда', description='', author=self.user)
+        RecipeReagent.objects.create(recipe=recipe, reagent=self.fbs, quantity=500, unit='ul')
+        self.client.force_login(self.user)
+
+        response = self.client.post('/api/reagent-reservations/', {
+            'recipe': recipe.pk, 'batches': 100,
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data[0]['quantity'], '50.00')
+
+        response = self.client.post('/api/reagent-reservations/', {
+            'recipe': recipe.pk, 'batches': 120,
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 409)
+
+        reservation_id = ReagentReservation.objects.get().pk
+        response = self.client.post(f'/api/reagent-reservations/{reservation_id}/consume/')
+        self.assertEqual(response.data['status'], 'consumed')
+
+
+class ReagentLotTests(TestCase):
+    """Партии реагентов и расход по FEFO"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('alice', password='pass')
+        self.reagent = Reagent.objects.create(name='FBS', category='media', on_hand=0)
+        today = timezone.localdate()
+        self.late = ReagentLot.objects.create(
+            reagent=self.reagent, lot_number='B', on_hand=50, expiry_date=today + timedelta(days=90)
+        )
+        self.early = ReagentLot.objects.create(
+            reagent=self.reagent, lot_number='A', on_hand=30, expiry_date=today + timedelta(days=10)
+        )
+        self.undated = ReagentLot.objects.create(reagent=self.reagent, lot_number='C', on_hand=20)
+
+    def lot_balances(self):
+        return dict(ReagentLot.objects.values_list('lot_number', 'on_hand'))
+
+    def test_lot_edit_rolls_up_to_reagent(self):
+        self.reagent.refresh_from_db()
+        self.assertEqual(self.reagent.on_hand, Decimal('100'))
+        self.assertEqual(self.reagent.expiry_date, self.early.expiry_date)
+
+    def test_out_movement_spans_lots_in_fefo_order(self):
+        movement = ReagentMovement.objects.create(
+            reagent=self.reagent, quantity=Decimal('40'), movement_type='out', user=self.user
+        )
+        self.assertEqual(self.lot_balances(), {'A': Decimal('0'), 'B': Decimal('40'), 'C': Decimal('20')})
+        self.assertEqual(
+            list(movement.lot_allocations.order_by('lot__lot_number').values_list('lot__lot_number', 'quantity')),
+            [('A', Decimal('30')), ('B', Decimal('10'))]
+        )
+        # Ближайший срок годности - у следующей партии с остатком
+        self.reagent.refresh_from_db()
+        self.assertEqual(self.reagent.on_hand, Decimal('60'))
+        self.assertEqual(self.reagent.expiry_date, self.late.expiry_date)
+
+    def test_overdraw_goes_to_last_lot(self):
+        inventory.create_movements([
+            ReagentMovement(reagent=self.reagent, quantity=Decimal('70'), movement_type='out'),
+            ReagentMovement(reagent=self.reagent, quantity=Decimal('50'), movement_type='out'),
+        ])
+        self.assertEqual(self.lot_balances(), {'A': Decimal('0'), 'B': Decimal('0'), 'C': Decimal('-20')})
+        self.reagent.refresh_from_db()
+        self.assertEqual(self.reagent.on_hand, sum(self.lot_balances().values()))
+
+    def test_explicit_lot_and_receipt(self):
+        ReagentMovement.objects.create(
+            reagent=self.reagent, lot=self.late, quantity=Decimal('5'), movement_type='out'
+        )
+        ReagentMovement.objects.create(
+            reagent=self.reagent, lot=self.early, quantity=Decimal('10'), movement_type='in'
+        )
+        self.assertEqual(self.lot_balances(), {'A': Decimal('40'), 'B': Decimal('45'), 'C': Decimal('20')})
+        self.assertEqual(ReagentLotAllocation.objects.get().lot, self.late)
+
+    def test_movement_api_rejects_foreign_lot(self):
+        other = Reagent.objects.create(name='PBS', category='buffer', on_hand=0)
+        self.client.force_login(self.user)
+        response = self.client.post('/api/reagent-movements/', {
+            'reagent': other.pk, 'lot': self.early.pk, 'quantity': '1', 'movement_type': 'out',
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('lot', response.json())
+
+    def test_first_lot_takes_over_unlotted_stock(self):
+        today = timezone.localdate()
+        reagent = Reagent.objects.create(
+            name='PBS', category='buffer', on_hand=0, expiry_date=today + timedelta(days=60)
+        )
+        ReagentMovement.objects.create(reagent=reagent, quantity=Decimal('100'), movement_type='in')
+        lot = ReagentLot.objects.create(
+            reagent=reagent, lot_number='P1', on_hand=10, expiry_date=today + timedelta(days=30)
+        )
+        ReagentMovement.objects.create(reagent=reagent, quantity=Decimal('50'), movement_type='out')
+
+        balances = dict(reagent.lots.values_list('lot_number', 'on_hand'))
+        self.assertEqual(balances, {inventory.OPENING_LOT_NUMBER: Decimal('60'), lot.lot_number: Decimal('0')})
+        reagent.refresh_from_db()
+        self.assertEqual(reagent.on_hand, Decimal('60'))
+        self.assertEqual(reagent.expiry_date, today + timedelta(days=60))
+        self.assertEqual(inventory.find_stock_drift(reagent_ids=[reagent.pk]), [])
+
+    def test_lot_changes_and_receipts_keep_ledger_in_sync(self):
+        self.client.force_login(self.user)
+        response = self.client.post('/api/reagent-lots/', {
+            'reagent': self.reagent.pk, 'lot_number': 'D', 'on_hand': '10',
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        receipt = ReagentMovement.objects.get(lot_id=response.json()['id'])
+        self.assertEqual((receipt.movement_type, receipt.quantity), ('in', Decimal('10')))
+
+        # Приход без партии у реагента с партиями отклоняется
+        receipt = {'reagent': self.reagent.pk, 'quantity': '5', 'movement_type': 'in'}
+        response = self.client.post('/api/reagent-movements/', receipt, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('lot', response.json())
+        response = self.client.post('/api/reagent-movements/bulk/', {
+            'mode': 'partial', 'movements': [receipt, dict(receipt, lot=self.late.pk)],
+        }, content_type='application/json')
+        self.assertEqual([row['status'] for row in response.json()['results']], ['error', 'created'])
+
+        self.client.patch(f'/api/reagent-lots/{self.undated.pk}/', {'on_hand': '12'},
+                          content_type='application/json')
+        self.client.post('/api/reagent-movements/', {
+            'reagent': self.reagent.pk, 'quantity': '35', 'movement_type': 'out',
+        }, content_type='application/json')
+        self.assertEqual(self.client.delete(f'/api/reagent-lots/{self.early.pk}/').status_code, 204)
+
+        self.reagent.refresh_from_db()
+        self.assertEqual(self.reagent.on_hand, sum(self.lot_balances().values()))
+        self.assertEqual(inventory.find_stock_drift(), [])
+
+
+class BarcodeScanTests(TestCase):
+    """Поиск по штрихкоду партии"""
+
+    def setUp(self):
+        cache.clear()
+        barcodes.scan_cache.clear()
+        self.user = User.objects.create_user('alice', password='pass')
+        self.reagent = Reagent.objects.create(name='FBS', category='media', on_hand=0)
+        self.lot = ReagentLot.objects.create(
+            reagent=self.reagent, lot_number='A1', barcode='4601234567890', on_hand=30
+        )
+
+    def test_repeat_scan_is_served_from_process_cache(self):
+        # Первое сканирование: реагент по индексу штрихкода, затем выборка
+        with self.assertNumQueries(2):
+            result = barcodes.scan('4601234567890\n')
+        self.assertEqual(result['lot']['id'], self.lot.pk)
+        self.assertEqual(result['reagent']['on_hand'], Decimal('30'))
+        with self.assertNumQueries(0):
+            barcodes.scan('4601234567890')
+
+    def test_stock_change_invalidates_cached_scan(self):
+        barcodes.scan('4601234567890')
+        ReagentMovement.objects.create(reagent=self.reagent, quantity=Decimal('10'), movement_type='out')
+        self.assertEqual(barcodes.scan('4601234567890')['reagent']['on_hand'], Decimal('20'))
+
+    def test_other_reagent_movement_keeps_cached_scan(self):
+        other = Reagent.objects.create(name='PBS', category='buffer', on_hand=0)
+        barcodes.scan('4601234567890')
+        ReagentMovement.objects.create(reagent=other, quantity=Decimal('10'), movement_type='in')
+        with self.captureOnCommitCallbacks(execute=True):
+            inventory.create_movements([ReagentMovement(reagent=other, quantity=Decimal('1'), movement_type='out')])
+        with self.assertNumQueries(0):
+            barcodes.scan('4601234567890')
+
+    def test_change_during_lookup_is_not_cached_as_fresh(self):
+        barcodes.scan('4601234567890')
+        ReagentMovement.objects.create(reagent=self.reagent, quantity=Decimal('10'), movement_type='out')
+        lookup = barcodes.find_by_barcode
+
+        def racing_lookup(code):
+            # Движение проведено после чтения версии, но до записи в кеш
+            result = lookup(code)
+            ReagentMovement.objects.create(reagent=self.reagent, quantity=Decimal('5'), movement_type='out')
+            return result
+
+        with mock.patch.object(barcodes, 'find_by_barcode', racing_lookup):
+            self.assertEqual(barcodes.scan('4601234567890')['reagent']['on_hand'], Decimal('20'))
+        self.assertEqual(barcodes.scan('4601234567890')['reagent']['on_hand'], Decimal('15'))
+
+    def test_lot_barcode_change_invalidates_cached_scan(self):
+        barcodes.scan('4601234567890')
+        self.lot.barcode = '4601234567891'
+        self.lot.save()
+        self.assertIsNone(barcodes.scan('4601234567890'))
+
+    def test_scan_api(self):
+        self.client.force_login(self.user)
+        response = self.client.get('/api/reagents/scan/4601234567890/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['movement'], {
+            'reagent': self.reagent.pk, 'lot': self.lot.pk,
+            'movement_type': 'out', 'quantity': None, 'comment': '',
+        })
+        self.assertEqual(self.client.get('/api/reagents/scan/000/').status_code, 404)
+
+
+class StocktakeTests(TestCase):
+    """Инвентаризация"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('alice', password='pass')
+        self.reagents = [
+            Reagent.objects.create(name=f'Реагент {i}', category='other', on_hand=10)
+            for i in range(30)
+        ]
+
+    def test_adjustments_are_posted_in_bulk(self):
+        counts = [(reagent.pk, None, 10) for reagent in self.reagents]
+        counts[0] = (self.reagents[0].pk, None, 7)
+        counts[1] = (self.reagents[1].pk, None, Decimal('12.5'))
+
+        # Чтение реагентов и партий с блокировкой, инвентаризация, движения,
+        # строки, один UPDATE остатков, партии, месячные итоги (upsert),
+        # устаревшие снимки + SAVEPOINT/RELEASE
+        with self.assertNumQueries(11):
+            stocktake, lines = inventory.apply_stocktake(counts, user=self.user)
+
+        self.assertEqual(stocktake.discrepancies, 2)
+        self.assertEqual(stocktake.lines.count(), 30)
+        on_hand = dict(Reagent.objects.filter(pk__in=[r.pk for r in self.reagents[:3]]).values_list('pk', 'on_hand'))
+        self.assertEqual(on_hand, {
+            self.reagents[0].pk: Decimal('7'), self.reagents[1].pk: Decimal('12.5'),
+            self.reagents[2].pk: Decimal('10'),
+        })
+        self.assertEqual(
+            sorted(ReagentMovement.objects.values_list('movement_type', 'quantity')),
+            [('in', Decimal('2.5')), ('out', Decimal('3'))]
+        )
+
+    def test_api_dry_run_and_unknown_reagent(self):
+        self.client.force_login(self.user)
+        response = self.client.post('/api/stocktakes/', {
+            'dry_run': True,
+            'counts': [{'reagent': self.reagents[0].pk, 'counted': '4'}],
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['shortage'], '6.00')
+        self.assertEqual(response.json()['lines'][0]['difference'], '-6.00')
+        self.assertFalse(Stocktake.objects.exists())
+        self.assertEqual(Reagent.objects.get(pk=self.reagents[0].pk).on_hand, Decimal('10'))
+
+        response = self.client.post('/api/stocktakes/', {
+            'counts': [{'reagent': self.reagents[0].pk, 'counted': '4'}, {'reagent': 999999, 'counted': '1'}],
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(ReagentMovement.objects.exists())
+
+    def test_lot_tracked_reagent_is_counted_per_lot(self):
+        reagent = Reagent.objects.create(name='FBS', category='media', on_hand=0)
+        lot_a = ReagentLot.objects.create(reagent=reagent, lot_number='A', on_hand=4)
+        lot_b = ReagentLot.objects.create(reagent=reagent, lot_number='B', on_hand=6)
+        self.client.force_login(self.user)
+
+        response = self.client.post('/api/stocktakes/', {
+            'counts': [{'reagent': reagent.pk, 'counted': '12'}],
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.post('/api/stocktakes/', {
+            'counts': [{'reagent': reagent.pk, 'lot': lot_a.pk, 'counted': '7'}],
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['lines'][0]['lot_number'], 'A')
+        surplus = ReagentMovement.objects.get(comment__startswith='Инвентаризация')
+        self.assertEqual((surplus.lot, surplus.movement_type, surplus.quantity), (lot_a, 'in', Decimal('3')))
+        self.assertEqual(
+            dict(ReagentLot.objects.values_list('lot_number', 'on_hand')),
+            {'A': Decimal('7'), 'B': Decimal('6')}
+        )
+        self.assertEqual(inventory.find_stock_drift(reagent_ids=[reagent.pk]), [])
+
+
+class CSVImportTests(TestCase):
+    """Потоковый импорт движений из CSV"""
+
+    def setUp(self):
+        self.user = User.objects.create_superuser('admin', password='pass')
+        self.fbs = Reagent.objects.create(name='FBS', category='media', on_hand=100)
+        self.pbs = Reagent.objects.create(name='PBS', category='buffer', on_hand=10)
+
+    def test_rows_are_imported_in_chunks(self):
+        data = io.StringIO(
+            'Reagent;Quantity;Movement_Type;Date;Comment\n'
+            'fbs;1,5;расход;01.03.2025 10:00;дозатор\n'
+            f'{self.pbs.pk};5;in;2025-03-01T12:00:00;\n'
+            '\n'
+            'FBS;2;;;\n'
+            'Нет такого;1;out;;\n'
+            'PBS;-1;out;;\n'
+            'PBS;1;out;32.13.2025;\n'
+        )
+        rejected = []
+        result = csv_import.import_movements(
+            data, user=self.user, chunk_size=2, on_reject=lambda line, row, errors: rejected.append(line)
+        )
+
+        self.assertEqual(
+            (result['rows'], result['created'], result['rejected'], result['chunks']), (6, 3, 3, 2)
+        )
+        self.assertEqual(rejected, [6, 7, 8])
+        self.assertEqual(list(result['errors'][1]['errors']), ['quantity'])
+        self.fbs.refresh_from_db()
+        self.pbs.refresh_from_db()
+        self.assertEqual(self.fbs.on_hand, Decimal('96.5'))
+        self.assertEqual(self.pbs.on_hand, Decimal('15'))
+        self.assertEqual(
+            timezone.localtime(ReagentMovement.objects.get(comment='дозатор').date).hour, 10
+        )
+
+    def test_receipt_of_lot_tracked_reagent_requires_lot(self):
+        ReagentLot.objects.create(reagent=self.fbs, lot_number='A', barcode='4601234567890')
+        data = io.StringIO(
+            'reagent,quantity,movement_type,lot\n'
+            'FBS,5,in,\n'
+            'FBS,5,in,4601234567890\n'
+            'FBS,1,out,\n'
+            'PBS,5,in,\n'
+        )
+        result = csv_import.import_movements(data, user=self.user)
+
+        self.assertEqual((result['created'], result['rejected']), (3, 1))
+        self.assertEqual(result['errors'][0], {
+            'line': 2, 'errors': {'lot': 'У реагента есть партии: укажите штрихкод партии прихода'},
+        })
+
+    def test_missing_columns(self):
+        with self.assertRaises(csv_import.CSVImportError):
+            csv_import.import_movements(io.StringIO('name,amount\nFBS,1\n'))
+
+    def test_admin_upload(self):
+        self.client.force_login(self.user)
+        url = reverse('admin:intranet_reagentmovement_import_csv')
+        upload = SimpleUploadedFile('export.csv', 'reagent,quantity\nFBS,10\n'.encode('utf-8'))
+
+        response = self.client.post(url, {'file': upload, 'encoding': 'utf-8-sig'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['result']['created'], 1)
+        self.assertEqual(Reagent.objects.get(pk=self.fbs.pk).on_hand, Decimal('90'))
+
+
+class MovementRollupTests(TestCase):
+    """Месячные итоги движений и архивация"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('alice', password='pass')
+        self.fbs = Reagent.objects.create(name='FBS', category='media')
+        self.old = timezone.now() - timedelta(days=900)
+        self.old_month = rollups.month_of(self.old)
+
+    def totals(self):
+        return {
+            (row.month, row.movement_type): (row.quantity, row.count)
+            for row in ReagentMovementMonthly.objects.filter(reagent=self.fbs)
+        }
+
+    def test_rollup_follows_create_edit_and_delete(self):
+        this_month = rollups.month_of(timezone.now())
+        movement = ReagentMovement.objects.create(reagent=self.fbs, quantity=10, movement_type='in')
+        inventory.create_movements([
+            ReagentMovement(reagent=self.fbs, quantity=2, movement_type='out'),
+            ReagentMovement(reagent=self.fbs, quantity=3, movement_type='out', date=self.old),
+        ])
+        self.assertEqual(self.totals(), {
+            (this_month, 'in'): (Decimal('10'), 1),
+            (this_month, 'out'): (Decimal('2'), 1),
+            (self.old_month, 'out'): (Decimal('3'), 1),
+        })
+
+        movement.quantity = 4
+        movement.save()
+        ReagentMovement.objects.get(quantity=2).delete()
+        self.assertEqual(self.totals()[(this_month, 'in')], (Decimal('4'), 1))
+        self.assertEqual(self.totals()[(this_month, 'out')], (Decimal('0'), 0))
+
+        ReagentMovementMonthly.objects.all().delete()
+        rollups.rebuild_rollup()
+        self.assertEqual(self.totals()[(self.old_month, 'out')], (Decimal('3'), 1))
+
+    def test_bulk_additions_accumulate_in_one_upsert(self):
+        this_month = rollups.month_of(timezone.now())
+        inventory.create_movements([ReagentMovement(reagent=self.fbs, quantity=2, movement_type='out')])
+        with self.assertNumQueries(1):
+            rollups.add_movements([
+                ReagentMovement(reagent=self.fbs, quantity=Decimal('1.5'), movement_type='out', date=timezone.now()),
+                ReagentMovement(reagent=self.fbs, quantity=3, movement_type='out', date=self.old),
+            ])
+        self.assertEqual(self.totals(), {
+            (this_month, 'out'): (Decimal('3.5'), 2),
+            (self.old_month, 'out'): (Decimal('3'), 1),
+        })
+
+    def test_archive_keeps_rollup_and_ledger(self):
+        ReagentMovement.objects.create(reagent=self.fbs, quantity=10, movement_type='in', date=self.old)
+        ReagentMovement.objects.create(reagent=self.fbs, quantity=4, movement_type='out', date=self.old)
+        ReagentMovement.objects.create(reagent=self.fbs, quantity=1, movement_type='out')
+        before = self.totals()
+
+        archived = rollups.archive_movements(rollups.archive_cutoff(months=24), batch_size=1)
+
+        self.assertEqual(archived, 2)
+        self.assertEqual(ReagentMovement.objects.count(), 1)
+        self.assertEqual(ReagentMovementArchive.objects.count(), 2)
+        self.assertEqual(self.totals(), before)
+        self.assertEqual(inventory.find_stock_drift(), [])
+        self.assertEqual(inventory.stock_at(self.fbs, self.old + timedelta(days=1))['on_hand'], Decimal('6'))
+        self.assertEqual(stats.global_stats()['movements'], {'in': 1, 'out': 2})
+
+    def test_monthly_api(self):
+        ReagentMovement.objects.create(reagent=self.fbs, quantity=10, movement_type='in', date=self.old)
+        ReagentMovement.objects.create(reagent=self.fbs, quantity=Decimal('1.5'), movement_type='out')
+        self.client.force_login(self.user)
+
+        response = self.client.get(f'/api/reagents/{self.fbs.pk}/monthly/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(row['movement_type'], row['quantity'], row['count']) for row in response.json()],
+            [('out', '1.50', 1)]
+        )
+
+        response = self.client.get(f'/api/reagents/{self.fbs.pk}/monthly/?months=36')
+        self.assertEqual(len(response.json()), 2)
+        self.assertEqual(self.client.get(f'/api/reagents/{self.fbs.pk}/monthly/?months=0').status_code, 400)
+
+
+class StockHistoryTests(TestCase):
+    """Динамика остатка: оконная функция и прореживание LTTB"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('alice', password='pass', role='lab_head')
+        self.fbs = Reagent.objects.create(name='FBS', category='media', on_hand=5)
+        now = timezone.now()
+        inventory.create_movements([
+            ReagentMovement(reagent=self.fbs, quantity=10, movement_type='in', date=now - timedelta(days=3)),
+            ReagentMovement(reagent=self.fbs, quantity=4, movement_type='out', date=now - timedelta(days=2)),
+            ReagentMovement(reagent=self.fbs, quantity=1, movement_type='out', date=now - timedelta(days=1)),
+        ])
+        self.fbs.refresh_from_db()
+
+    def test_series_is_anchored_to_current_stock(self):
+        with self.assertNumQueries(1):
+            series = inventory.stock_series(self.fbs)
+        self.assertEqual([on_hand for _, on_hand in series], [15.0, 11.0, 10.0])
+
+        since = timezone.now() - timedelta(days=2, hours=1)
+        self.assertEqual(
+            [on_hand for _, on_hand in inventory.stock_series(self.fbs, since=since)], [11.0, 10.0]
+        )
+
+    def test_series_after_archiving_ends_at_current_stock(self):
+        old = timezone.now() - timedelta(days=900)
+        inventory.create_movements([ReagentMovement(reagent=self.fbs, quantity=50, movement_type='in', date=old)])
+        self.assertEqual(rollups.archive_movements(rollups.archive_cutoff(months=24)), 1)
+        self.fbs.refresh_from_db()
+        since = old - timedelta(days=100)
+
+        with self.assertNumQueries(1):
+            series = inventory.stock_series(self.fbs, since=since)
+        self.assertEqual([on_hand for _, on_hand in series], [65.0, 61.0, 60.0])
+        self.assertEqual(series[-1][1], float(self.fbs.on_hand))
+        self.assertEqual(
+            [on_hand for _, on_hand in inventory.stock_series(
+                self.fbs, since=since, until=timezone.now() - timedelta(days=2, hours=12)
+            )],
+            [65.0]
+        )
+
+    def test_lttb_keeps_shape(self):
+        x = np.arange(1000)
+        y = np.zeros(1000)
+        y[500] = 100
+
+        selected = history.lttb(x, y, 50)
+
+        self.assertEqual(len(selected), 50)
+        self.assertEqual((selected[0], selected[-1]), (0, 999))
+        self.assertIn(500, selected)
+        self.assertTrue(np.all(np.diff(selected) > 0))
+
+    def test_history_api_and_chart(self):
+        self.client.force_login(self.user)
+        response = self.client.get(f'/api/reagents/{self.fbs.pk}/history/?points=3')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['total_points'], 3)
+        self.assertEqual([point['on_hand'] for point in response.json()['points']], [15.0, 11.0, 10.0])
+        self.assertEqual(self.client.get(f'/api/reagents/{self.fbs.pk}/history/?points=2').status_code, 400)
+        self.assertEqual(self.client.get(f'/api/reagents/{self.fbs.pk}/history/?since=x').status_code, 400)
+
+        ReagentMovement.objects.create(reagent=self.fbs, quantity=2, movement_type='out')
+        response = self.client.get(f'/api/reagents/{self.fbs.pk}/history/?points=3')
+        self.assertEqual(response.json()['total_points'], 4)
+        self.assertEqual(response.json()['points'][-1]['on_hand'], 8.0)
+
+        response = self.client.get(reverse('reagent_detail', args=[self.fbs.pk]))
+        self.assertContains(response, 'stock-history')
+
+
+class ApiTokenTests(TestCase):
+    """Токены API: поиск по префиксу, кеш учётных данных, права"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('bench', password='pass')
+        self.token, self.key = authentication.issue_token(self.user, 'Дозатор', scopes=['read'])
+        Reagent.objects.create(name='FBS', category='media')
+
+    def get(self, key, url='/api/reagents/'):
+        return self.client.get(url, HTTP_AUTHORIZATION=f'Token {key}')
+
+    def test_token_is_stored_hashed(self):
+        self.assertNotIn(self.key, (self.token.key_hash, self.token.prefix))
+        self.assertEqual(self.token.key_hash, authentication.hash_key(self.key))
+
+    def test_principal_is_cached(self):
+        self.assertEqual(self.get(self.key).status_code, 200)
+        self.token.refresh_from_db()
+        self.assertIsNotNone(self.token.last_used_at)
+
+        # Повторный запрос: аутентификация без обращения к базе
+        # (список реагентов - COUNT и SELECT)
+        with self.assertNumQueries(2):
+            self.assertEqual(self.get(self.key).status_code, 200)
+
+    def test_invalid_revoked_and_expired_tokens(self):
+        self.assertEqual(self.get(self.key + 'x').status_code, 401)
+        self.assertEqual(self.get('unknown.key').status_code, 401)
+        self.assertEqual(self.get(self.key).status_code, 200)
+
+        self.token.expires_at = timezone.now() - timedelta(minutes=1)
+        self.token.save()
+        self.assertEqual(self.get(self.key).status_code, 401)
+
+        self.token.expires_at = None
+        self.token.is_active = False
+        self.token.save()
+        self.assertEqual(self.get(self.key).status_code, 401)
+
+    def test_inactive_user_loses_access(self):
+        self.assertEqual(self.get(self.key).status_code, 200)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.get(self.key).status_code, 401)
+
+    def test_any_user_save_forgets_cached_principal(self):
+        self.get(self.key)
+        cache_key = authentication.principal_cache_key(self.token.key_hash)
+        self.assertIsNotNone(cache.get(cache_key))
+        self.user.is_staff = True
+        self.user.save()
+        self.assertIsNone(cache.get(cache_key))
+
+    def test_scopes(self):
+        data = {'name': 'PBS', 'category': 'buffer'}
+        response = self.client.post('/api/reagents/', data, HTTP_AUTHORIZATION=f'Token {self.key}')
+        self.assertEqual(response.status_code, 403)
+
+        _, key = authentication.issue_token(self.user, 'ERP', scopes=['read', 'write'])
+        response = self.client.post('/api/reagents/', data, HTTP_AUTHORIZATION=f'Token {key}')
+        self.assertEqual(response.status_code, 201)
+
+    def test_basic_auth_is_disabled(self):
+        response = self.client.get(
+            '/api/reagents/', HTTP_AUTHORIZATION='Basic ' + base64.b64encode(b'bench:pass').decode()
+        )
+        self.assertEqual(response.status_code, 401)
+
+
+class KeysetPaginationTests(TestCase):
+    """Курсорная пагинация журналов по (date, id)"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('alice', password='pass')
+        self.client.force_login(self.user)
+        self.fbs = Reagent.objects.create(name='FBS', category='media', on_hand=100)
+        now = timezone.now()
+        # Несколько движений с одинаковой датой - ключ различает их по id
+        ReagentMovement.objects.bulk_create([
+            ReagentMovement(reagent=self.fbs, quantity=1, movement_type='out',
+                            date=now - timedelta(minutes=i // 3))
+            for i in range(25)
+        ])
+
+    def walk(self, url):
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('count', response.json())
+            ids += [item['id'] for item in response.json()['results']]
+            url = response.json()['next']
+        return ids
+
+    def test_walks_full_history_without_gaps(self):
+        expected = list(ReagentMovement.objects.order_by('-date', '-id').values_list('pk', flat=True))
+        self.assertEqual(self.walk('/api/reagent-movements/?page_size=7'), expected)
+        self.assertEqual(
+            self.walk('/api/reagent-movements/?page_size=10&ordering=date'), expected[::-1]
+        )
+        self.assertEqual(self.walk(f'/api/reagents/{self.fbs.pk}/movements/?page_size=4'), expected)
+
+    def test_deep_page_has_no_count_or_offset(self):
+        response = self.client.get('/api/reagent-movements/?page_size=5')
+        cursor_url = response.json()['next']
+        with self.assertNumQueries(3) as queries:
+            self.client.get(cursor_url)
+        sql = ' '.join(query['sql'] for query in queries.captured_queries)
+        self.assertNotIn('COUNT(', sql)
+        self.assertNotIn('OFFSET', sql)
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get('/api/reagent-movements/?cursor=bad').status_code, 404)
+
+    def test_culture_events_and_comments(self):
+        culture = Culture.objects.create(name='HEK293', responsible=self.user)
+        CultureEvent.objects.bulk_create([
+            CultureEvent(culture=culture, event_type='observation', user=self.user) for _ in range(5)
+        ])
+        task = Task.objects.create(title='Посев', description='-', assignee=self.user)
+        TaskComment.objects.bulk_create([
+            TaskComment(task=task, user=self.user, text=str(i)) for i in range(5)
+        ])
+
+        self.assertEqual(len(self.walk(f'/api/cultures/{culture.pk}/events/?page_size=2')), 5)
+        self.assertEqual(len(self.walk('/api/culture-events/?page_size=2')), 5)
+        self.assertEqual(
+            self.walk('/api/task-comments/?page_size=2'),
+            list(TaskComment.objects.order_by('date', 'id').values_list('pk', flat=True))
+        )
+
+
+class SparseFieldsTests(TestCase):
+    """?fields= и ?expand=: вложенные коллекции и JOIN только по запросу"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('alice', password='pass')
+        self.client.force_login(self.user)
+        for i in range(3):
+            task = Task.objects.create(
+                title=f'Задача {i}', description='-', assignee=self.user, creator=self.user
+            )
+            TaskComment.objects.bulk_create([
+                TaskComment(task=task, user=self.user, text='-') for _ in range(4)
+            ])
+
+    def test_nested_collections_are_opt_in(self):
+        # Сессия, пользователь, сроки задач для ETag (затем из кеша),
+        # COUNT, задачи с исполнителем и автором (JOIN)
+        with self.assertNumQueries(5):
+            response = self.client.get('/api/tasks/')
+        self.assertNotIn('comments', response.json()['results'][0])
+
+        # + один запрос комментариев с авторами для всей страницы
+        with self.assertNumQueries(5):
+            response = self.client.get('/api/tasks/?expand=comments')
+        row = response.json()['results'][0]
+        self.assertEqual(len(row['comments']), 3)
+        self.assertEqual(row['comments_count'], 4)
+
+    def test_sparse_fields_skip_joins(self):
+        with self.assertNumQueries(5) as queries:
+            response = self.client.get('/api/tasks/?fields=id,title')
+        self.assertEqual(set(response.json()['results'][0]), {'id', 'title'})
+        self.assertNotIn('JOIN', queries.captured_queries[-1]['sql'])
+
+        response = self.client.get('/api/tasks/?fields=id,comments')
+        self.assertEqual(set(response.json()['results'][0]), {'id', 'comments'})
+
+    def test_fields_do_not_restrict_writes(self):
+        response = self.client.post('/api/tasks/?fields=id', {
+            'title': 'Новая', 'description': '-', 'assignee': self.user.pk
+        })
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['title'], 'Новая')
+
+    def test_culture_events_and_participants(self):
+        culture = Culture.objects.create(name='HEK293', responsible=self.user)
+        CultureEvent.objects.create(culture=culture, event_type='passage', user=self.user)
+        event = CalendarEvent.objects.create(
+            subject='Семинар', start_datetime=timezone.now(), organizer=self.user
+        )
+        event.participants.add(self.user)
+
+        self.assertNotIn('recent_events', self.client.get('/api/cultures/').json()['results'][0])
+        culture_row = self.client.get('/api/cultures/?expand=recent_events').json()['results'][0]
+        self.assertEqual(culture_row['recent_events'][0]['culture_name'], 'HEK293')
+
+        event_row = self.client.get('/api/calendar-events/').json()['results'][0]
+        self.assertEqual(event_row['participants'], [self.user.pk])
+        self.assertNotIn('participants_list', event_row)
+        event_row = self.client.get('/api/calendar-events/?expand=participants_list').json()['results'][0]
+        self.assertEqual(event_row['participants_list'][0]['username'], 'alice')
+
+
+class LatestChildrenTests(TestCase):
+    """Последние N дочерних записей на родителя - одним запросом на страницу"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('alice', password='pass')
+        self.client.force_login(self.user)
+        now = timezone.now()
+        self.cultures = []
+        for i in range(3):
+            culture = Culture.objects.create(name=f'Линия {i}', responsible=self.user)
+            CultureEvent.objects.bulk_create([
+                CultureEvent(
+                    culture=culture, event_type='passage', user=self.user,
+                    comment=f'{i}-{day}', date=now - timedelta(days=day)
+                )
+                for day in range(8 + i)
+            ])
+            self.cultures.append(culture)
+
+    def test_recent_events_are_capped(self):
+        # Сессия, пользователь, COUNT, культуры со счётчиком, события страницы
+        with self.assertNumQueries(5) as queries:
+            response = self.client.get('/api/cultures/?expand=recent_events&ordering=name')
+        self.assertIn('ROW_NUMBER', queries.captured_queries[-1]['sql'])
+
+        for i, row in enumerate(response.json()['results']):
+            self.assertEqual(row['events_count'], 8 + i)
+            self.assertEqual(
+                [event['comment'] for event in row['recent_events']],
+                [f'{i}-{day}' for day in range(5)]
+            )
+
+    def test_latest_comments_in_chronological_order(self):
+        task = Task.objects.create(title='Задача', description='-', assignee=self.user, creator=self.user)
+        for number in range(5):
+            TaskComment.objects.create(task=task, user=self.user, text=str(number))
+
+        row = self.client.get(f'/api/tasks/{task.pk}/?expand=comments').json()
+        self.assertEqual(row['comments_count'], 5)
+        self.assertEqual([comment['text'] for comment in row['comments']], ['2', '3', '4'])
+
+        history = self.client.get(f'/api/task-comments/?task={task.pk}').json()['results']
+        self.assertEqual(len(history), 5)
+
+    def test_prefetch_latest_rejects_forward_relations(self):
+        with self.assertRaises(ValueError):
+            prefetch_latest(CultureEvent, 'culture', 5)
+
+
+class ConditionalGetTests(TestCase):
+    """ETag / Last-Modified: неизменившиеся списки - 304 без выборки и сериализации"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('alice', password='pass')
+        self.client.force_login(self.user)
+        self.reagent = Reagent.objects.create(name='FBS', category='media', on_hand=10)
+
+    def test_unchanged_list_is_not_modified(self):
+        response = self.client.get('/api/reagents/')
+        etag = response['ETag']
+        self.assertIn('no-cache', response['Cache-Control'])
+
+        # Сессия и пользователь; реагенты не выбираются
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/reagents/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+        # Другие параметры - другой ответ
+        response = self.client.get('/api/reagents/?ordering=-on_hand', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_stock_change_updates_etag(self):
+        etag = self.client.get('/api/reagents/')['ETag']
+        ReagentMovement.objects.create(reagent=self.reagent, quantity=Decimal('1'), movement_type='out')
+
+        response = self.client.get('/api/reagents/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'][0]['on_hand'], '9.00')
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_comment_updates_task_etag(self):
+        task = Task.objects.create(title='Задача', description='-', assignee=self.user, creator=self.user)
+        url = f'/api/tasks/{task.pk}/'
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        TaskComment.objects.create(task=task, user=self.user, text='Готово')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.json()['comments_count'], 1)
+
+    def test_recipes_use_last_modified(self):
+        Recipe.objects.create(name='Среда', description='', author=self.user)
+        second = Recipe.objects.create(name='Заморозка', description='', author=self.user)
+        response = self.client.get('/api/recipes/')
+        last_modified = response['Last-Modified']
+
+        response = self.client.get('/api/recipes/', HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+        # Удаление не меняет Max('updated_at'), но меняет число строк в ETag
+        etag = self.client.get('/api/recipes/')['ETag']
+        second.delete()
+        self.assertEqual(self.client.get('/api/recipes/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_unauthenticated_request_is_not_answered_with_304(self):
+        etag = self.client.get('/api/reagents/')['ETag']
+        self.client.logout()
+        response = self.client.get('/api/reagents/', HTTP_IF_NONE_MATCH=etag)
+        self.assertIn(response.status_code, (401, 403))
+
+    def test_task_list_page(self):
+        task = Task.objects.create(title='Задача', description='-', assignee=self.user, creator=self.user)
+        etag = self.client.get(reverse('task_list'))['ETag']
+        self.assertEqual(self.client.get(reverse('task_list'), HTTP_IF_NONE_MATCH=etag).status_code, 304)
 
-# Create your tests here.
+        # Массовое update() сбрасывает поколение задач, а сообщение об
+        # операции не теряется за ответом 304
+        self.client.post(reverse('task_list'), {'mark_done': '1', 'task_ids': [task.pk]})
+        response = self.client.get(reverse('task_list'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Отмечено выполненными')
@@ -0,0 +1,96 @@
+"""
+Пересчёт единиц измерения реагентов
+
+Единицы делятся на величины: объём (базовая единица - мл), масса (г) и
+штуки (ед.). Внутри величины пересчёт - умножение на коэффициент,
+между объёмом и массой - через плотность реагента (г/мл).
+
+Таблица коэффициентов строится один раз при импорте модуля: матрица
+SCALE[из, в] и матрица DENSITY_POWER[из, в] (+1 - умножить на плотность,
+-1 - разделить, 0 - не нужна). Пересчёт массива количеств выполняется
+векторно: коды единиц переводятся в индексы, коэффициенты выбираются
+из матриц целиком, без поиска по словарю для каждой строки.
+"""
+
+import numpy as np
+
+
+VOLUME = 'volume'
+MASS = 'mass'
+COUNT = 'count'
+
+# Единица -> (величина, количество базовых единиц величины в одной единице)
+UNITS = {
+    'ml': (VOLUME, 1.0),
+    'ul': (VOLUME, 0.001),
+    'g': (MASS, 1.0),
+    'mg': (MASS, 0.001),
+    'units': (COUNT, 1.0),
+}
+
+def _build_tables():
+    codes = sorted(UNITS)
+    size = len(codes)
+    scale = np.full((size, size), np.nan)
+    density_power = np.zeros((size, size), dtype=np.int8)
+    for i, source in enumerate(codes):
+        source_quantity, source_factor = UNITS[source]
+        for j, target in enumerate(codes):
+            target_quantity, target_factor = UNITS[target]
+            if source_quantity == target_quantity:
+                scale[i, j] = source_factor / target_factor
+            elif {source_quantity, target_quantity} == {VOLUME, MASS}:
+                # объём -> масса: умножить на плотность, масса -> объём: разделить
+                scale[i, j] = source_factor / target_factor
+                density_power[i, j] = 1 if source_quantity == VOLUME else -1
+    return np.array(codes), scale, density_power
+
+
+CODES, SCALE, DENSITY_POWER = _build_tables()
+
+
+class UnitConversionError(ValueError):
+    """Неизвестная единица измерения"""
+
+
+def unit_indices(units):
+    """Индексы единиц в таблице пересчёта (векторно по массиву кодов)"""
+    units = np.asarray(units, dtype=str)
+    if not units.size:
+        return np.zeros(0, dtype=np.int64)
+    indices = np.minimum(np.searchsorted(CODES, units), len(CODES) - 1)
+    unknown = CODES[indices] != units
+    if unknown.any():
+        raise UnitConversionError(
+            f'Неизвестные единицы измерения: {", ".join(sorted(set(units[unknown].tolist())))}'
+        )
+    return indices
+
+
+def convert(quantities, from_units, to_units, densities=None):
+    """
+    Пересчитывает массив количеств из from_units в to_units
+
+    quantities - числа; from_units, to_units - коды единиц (массивы той же
+    длины); densities - плотности в г/мл (None - неизвестна).
+    Возвращает массив float; NaN - пересчёт невозможен (разные величины
+    или нет плотности для пересчёта массы в объём)
+    """
+    quantities = np.asarray(quantities, dtype=np.float64)
+    source = unit_indices(from_units)
+    target = unit_indices(to_units)
+
+    result = quantities * SCALE[source, target]
+    power = DENSITY_POWER[source, target]
+    if power.any():
+        if densities is None:
+            density = np.full(len(quantities), np.nan)
+        else:
+            density = np.array(
+                [np.nan if value is None else float(value) for value in densities],
+                dtype=np.float64,
+            )
+        with np.errstate(divide='ignore', invalid='ignore'):
+            result = np.where(power != 0, result * density ** power.astype(np.float64), result)
+    return result
+
@@ -13,6 +13,7 @@ from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 from django.db.models import Q, Count, F, Avg, Sum
 from django.utils import timezone
 from django.views.decorators.cache import cache_page
+from django.views.decorators.http import condition
 from django.core.cache import cache
 from datetime import timedelta
 
@@ -21,6 +22,7 @@ from .models import (
     Culture, CultureEvent, Task, TaskComment, Announcement,
     CalendarEvent, DocumentTemplate
 )
+from . import conditional, dashboard_cache, planning, search
 from .forms import (
     UserLoginForm, UserRegisterForm, ReagentForm, ReagentMovementForm,
     RecipeForm, CultureForm, TaskForm, TaskCommentForm,
@@ -32,8 +34,20 @@ from .forms import (
 # ГЛАВНАЯ СТРАНИЦА (ДАШБОРД) - ЗАДАНИЕ 15
 # ============================================================================
 
+# Страницы объектов интранета по типу результата поиска; остальные типы
+# открываются в админке, поэтому ищутся только для сотрудников с доступом к ней
+SEARCH_DETAIL_URLS = {'reagent': 'reagent_detail'}
+
+
+def search_result_url(kind, object_id):
+    """Страница результата поиска: страница интранета или админки"""
+    if kind in SEARCH_DETAIL_URLS:
+        return reverse(SEARCH_DETAIL_URLS[kind], args=[object_id])
+    model = search.INDEXED_MODELS[kind][0]
+    return reverse(f'admin:{model._meta.app_label}_{model._meta.model_name}_change', args=[object_id])
+
+
 @login_required
-@cache_page(60 * 5)  # Кеш на 5 минут
 def dashboard(request):
     """
     Главная страница с виджетами и поиском
@@ -41,7 +55,7 @@ def dashboard(request):
     Демонстрирует:
     - Виджеты с данными из 3+ таблиц
     - aggregate(), Count(), F()
-    - Поиск с __icontains, __contains, values(), values_list(), count(), exists()
+    - Полнотекстовый поиск с ранжированием и подсветкой
     - Пагинацию с try/except
     """
     
@@ -50,77 +64,43 @@ def dashboard(request):
     search_results = []
     
     if search_query:
-        # Поиск реагентов
-        reagents = Reagent.objects.filter(
-            Q(name__icontains=search_query) | 
-            Q(category__contains=search_query)
-        ).values('id', 'name', 'category')[:5]
-        
-        # Поиск задач
-        tasks = Task.objects.filter(
-            Q(title__icontains=search_query) |
-            Q(description__icontains=search_query)
-        ).values_list('id', 'title', 'status')[:5]
-        
-        # Поиск объявлений
-        announcements_found = Announcement.objects.filter(
-            Q(title__icontains=search_query) |
-            Q(text__icontains=search_query)
-        )
-        
-        search_results = {
-            'reagents': list(reagents),
-            'tasks': list(tasks),
-            'announcements_count': announcements_found.count(),
-            'announcements_exist': announcements_found.exists(),
-        }
+        # Ранжированный полнотекстовый поиск по индексу (см. search.py);
+        # ищутся только типы, страницы которых пользователь может открыть
+        kinds = None if request.user.is_staff else list(SEARCH_DETAIL_URLS)
+        search_results = search.search(search_query, kinds=kinds, limit=20)
+        for result in search_results:
+            result['url'] = search_result_url(result['kind'], result['id'])
         
         # Сохраняем последний поиск в сессию
         request.session['last_search'] = search_query
     
+    # Виджеты кешируются по отдельности (персональные - по пользователю)
+    # и сбрасываются сигналами при изменении данных, см. dashboard_cache
+    
     # ВИДЖЕТ 1: Последние объявления
-    latest_announcements = Announcement.objects.select_related('author').order_by(
-        '-is_pinned', '-published_at'
-    )[:5]
+    latest_announcements = dashboard_cache.latest_announcements()
     
     # ВИДЖЕТ 2: Актуальные задачи текущего пользователя
-    user_tasks = Task.objects.filter(assignee=request.user).exclude(
-        status='done'
-    ).select_related('creator').order_by('deadline', '-priority')[:5]
+    user_tasks = dashboard_cache.user_tasks(request.user)
     
     # Подсчет просроченных задач
-    overdue_tasks_count = Task.objects.filter(
-        assignee=request.user,
-        deadline__lt=timezone.now()
-    ).exclude(status='done').count()
+    overdue_tasks_count = dashboard_cache.overdue_tasks_count(request.user)
     
     # ВИДЖЕТ 3: Критические реагенты
     # Реагенты с остатком ниже минимального порога
-    critical_reagents = Reagent.objects.filter(
-        on_hand__lt=F('min_threshold')
-    ).order_by('on_hand')[:5]
+    critical_reagents = dashboard_cache.critical_reagents()
     
     # Реагенты с истекающим сроком годности (следующие 30 дней)
-    expiring_soon = Reagent.objects.filter(
-        expiry_date__lte=timezone.now().date() + timedelta(days=30),
-        expiry_date__gte=timezone.now().date()
-    ).order_by('expiry_date')[:5]
+    expiring_soon = dashboard_cache.expiring_reagents()
+    
+    # ВИДЖЕТ 4: Прогноз окончания остатков (см. forecasting.py)
+    stockout_forecast = dashboard_cache.stockout_forecast()
     
     # СТАТИСТИКА с агрегацией
-    stats = {
-        'total_reagents': Reagent.objects.count(),
-        'total_tasks': Task.objects.filter(assignee=request.user).count(),
-        'active_cultures': Culture.objects.filter(status='active').count(),
-        'pending_tasks': Task.objects.filter(
-            assignee=request.user,
-            status='new'
-        ).count(),
-    }
+    stats = dashboard_cache.dashboard_stats(request.user)
     
     # Агрегация: общее количество движений по типам
-    movements_stats = ReagentMovement.objects.values('movement_type').annotate(
-        total=Count('id')
-    )
+    movements_stats = dashboard_cache.movements_stats()
     
     # Пагинация для списка всех объявлений (если нужно)
     all_announcements = Announcement.objects.all().order_by('-published_at')
@@ -140,6 +120,7 @@ def dashboard(request):
         'overdue_tasks_count': overdue_tasks_count,
         'critical_reagents': critical_reagents,
         'expiring_soon': expiring_soon,
+        'stockout_forecast': stockout_forecast,
         'stats': stats,
         'movements_stats': movements_stats,
         'search_query': search_query,
@@ -155,6 +136,10 @@ def dashboard(request):
 # ============================================================================
 
 @login_required
+@condition(etag_func=conditional.page_etag(
+    # Шапка страницы выводит число задач пользователя; «истекает срок» - от даты
+    [dashboard_cache.GROUP_REAGENTS, dashboard_cache.GROUP_TASKS], timezone.localdate
+))
 def object_list(request):
     """
     Список реагентов с фильтрацией
@@ -332,6 +317,9 @@ def object_delete(request, pk):
 # ============================================================================
 
 @login_required
+@condition(etag_func=conditional.page_etag(
+    [dashboard_cache.GROUP_TASKS], conditional.last_passed_deadline
+))
 def task_list(request):
     """
     Список задач с фильтрацией
@@ -366,6 +354,8 @@ def task_list(request):
     if request.method == 'POST' and 'mark_done' in request.POST:
         task_ids = request.POST.getlist('task_ids')
         Task.objects.filter(id__in=task_ids).update(status='done')
+        # update() не отправляет сигналы - сбрасываем кеш вручную
+        dashboard_cache.invalidate(dashboard_cache.GROUP_TASKS)
         messages.success(request, f'Отмечено выполненными: {len(task_ids)} задач')
         return redirect('task_list')
     
@@ -586,6 +576,13 @@ def recipe_list(request):
     page = request.GET.get('page')
     recipes_page = paginator.get_page(page)
     
+    # Сколько партий можно приготовить из текущих остатков (кешируется)
+    availability = {
+        row['recipe_id']: row for row in planning.recipe_availability()['recipes']
+    }
+    for recipe in recipes_page:
+        recipe.availability = availability.get(recipe.pk)
+    
     context = {
         'recipes': recipes_page,
         'status_choices': Recipe.STATUS_CHOICES,
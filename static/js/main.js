@@ -38,6 +38,9 @@ document.addEventListener('DOMContentLoaded', function() {
         card.classList.add('fade-in');
     });
     
+    // Автодополнение для выпадающих списков реагентов
+    document.querySelectorAll('select[data-autocomplete-url]').forEach(initReagentAutocomplete);
+    
     // Поддержка тултипов Bootstrap
     const tooltipTriggerList = [].slice.call(document.querySelectorAll('[data-bs-toggle="tooltip"]'));
     tooltipTriggerList.map(function(tooltipTriggerEl) {
@@ -67,3 +70,43 @@ function showNotification(message, type = 'info') {
 }
 
 
+
+// Поле поиска над списком реагентов: подсказки приходят из
+// /api/reagents/autocomplete/, выбор подсказки выбирает пункт списка
+function initReagentAutocomplete(select) {
+    const input = document.createElement('input');
+    input.type = 'search';
+    input.className = 'form-control mb-1';
+    input.placeholder = 'Начните вводить название...';
+    input.setAttribute('list', select.id + '_suggestions');
+    
+    const datalist = document.createElement('datalist');
+    datalist.id = select.id + '_suggestions';
+    
+    select.parentNode.insertBefore(input, select);
+    select.parentNode.insertBefore(datalist, select);
+    
+    let timer = null;
+    input.addEventListener('input', function() {
+        clearTimeout(timer);
+        const match = Array.from(datalist.options).find(option => option.value === input.value);
+        if (match) {
+            select.value = match.dataset.id;
+            return;
+        }
+        timer = setTimeout(function() {
+            const url = select.dataset.autocompleteUrl + '?q=' + encodeURIComponent(input.value);
+            fetch(url, {credentials: 'same-origin'})
+                .then(response => response.json())
+                .then(function(items) {
+                    datalist.innerHTML = '';
+                    items.forEach(function(item) {
+                        const option = document.createElement('option');
+                        option.value = item.name;
+                        option.dataset.id = item.id;
+                        datalist.appendChild(option);
+                    });
+                });
+        }, 150);
+    });
+}